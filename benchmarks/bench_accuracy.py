@@ -0,0 +1,38 @@
+""" Accuracy of the analysis against synthetic data with a known
+microrheology. These track the median relative error of the recovered
+quantities, so that approximate fast paths can be compared against the
+exact analysis."""
+import numpy as np
+from dlsmicro.backend import analysis_tools
+from dlsmicro.backend import synthetic
+from . import common
+
+
+class RecoveredMicrorheology:
+    params = (['brownian', 'power_law', 'maxwell'], [True, False])
+    param_names = ['model', 'ergodic']
+    timeout = 300
+
+    def setup(self, model, ergodic):
+        params = {'brownian': {'eta': 2.e-3},
+                  'power_law': {'S': 5.e-2, 'n': 0.6},
+                  'maxwell': {'G': 2., 'tau': 1.e3}}[model]
+        data = synthetic.synthetic_curves(1, model=model, params=params,
+                                          r=common.R, T=common.T, q=common.Q,
+                                          ergodic=ergodic, seed=0)
+        [t, g] = analysis_tools.truncate_correlation(data['time_lag'],
+                                                     data['correlation'][0])
+        self.df = analysis_tools.full_dlsur_analysis(
+            t, g, ergodic, common.R, common.T, common.Q,
+            data['point_intensity'][0], data['ensemble_intensities'][0])
+        inds = np.searchsorted(data['time_lag'], t)
+        self.msd = data['msd'][0][inds]
+        self.G = np.hypot(data['G1'][0], data['G2'][0])[inds]
+
+    def track_msd_relative_error(self, model, ergodic):
+        err = np.abs(self.df['msd_smooth'].values/self.msd - 1.)
+        return np.median(err)
+
+    def track_modulus_relative_error(self, model, ergodic):
+        G = np.hypot(self.df['G1'].values, self.df['G2'].values)
+        return np.median(np.abs(G/self.G - 1.))
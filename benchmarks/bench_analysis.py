@@ -0,0 +1,119 @@
+""" Benchmarks for the full DLS microrheology analysis"""
+import numpy as np
+from dlsmicro.backend import analysis_tools
+from dlsmicro.backend import utils
+from . import common
+
+
+class FullDlsurAnalysis:
+    params = (['example', 'synthetic'], [True, False])
+    param_names = ['data', 'ergodic']
+    timeout = 300
+
+    def setup(self, data, ergodic):
+        if data == 'example':
+            [self.t, self.g, self.Ip, self.Ie] = common.example_curve()
+        else:
+            [self.t, self.g] = common.synthetic_curve()
+            # Ensemble intensities twice the point intensity
+            [self.Ip, self.Ie] = [1.e4, [2.e4]]
+
+    def time_full_dlsur_analysis(self, data, ergodic):
+        analysis_tools.full_dlsur_analysis(self.t, self.g, ergodic,
+                                           common.R, common.T, common.Q,
+                                           self.Ip, self.Ie)
+
+    def peakmem_full_dlsur_analysis(self, data, ergodic):
+        analysis_tools.full_dlsur_analysis(self.t, self.g, ergodic,
+                                           common.R, common.T, common.Q,
+                                           self.Ip, self.Ie)
+
+    def time_full_dlsur_analysis_omega(self, data, ergodic):
+        analysis_tools.full_dlsur_analysis(self.t, self.g, ergodic,
+                                           common.R, common.T, common.Q,
+                                           self.Ip, self.Ie,
+                                           omega=np.logspace(0., 6., 40))
+
+
+class CalcG1:
+    params = ['example', 'synthetic']
+    param_names = ['data']
+
+    def setup(self, data):
+        if data == 'example':
+            [self.t, self.g] = common.example_curve()[0:2]
+        else:
+            [self.t, self.g] = common.synthetic_curve()
+
+    def time_calc_g1(self, data):
+        analysis_tools.calc_g1(self.t, self.g, True)
+
+    def time_calc_g1_binned(self, data):
+        [t, g] = analysis_tools.log_bin_correlation(self.t, self.g, 60)[0:2]
+        analysis_tools.calc_g1(t, g, True)
+
+
+class BatchDlsurAnalysis:
+    params = ([1, 10, 100], ['float64', 'float32'])
+    param_names = ['n_curves', 'dtype']
+
+    def setup(self, n_curves, dtype):
+        [self.t, self.g] = common.synthetic_stack(n_curves)
+
+    def time_batch_dlsur_analysis_fixed_g0(self, n_curves, dtype):
+        analysis_tools.batch_dlsur_analysis(self.t, self.g, True, common.R,
+                                            common.T, common.Q, g0=0.9,
+                                            dtype=dtype)
+
+    def peakmem_batch_dlsur_analysis_fixed_g0(self, n_curves, dtype):
+        analysis_tools.batch_dlsur_analysis(self.t, self.g, True, common.R,
+                                            common.T, common.Q, g0=0.9,
+                                            dtype=dtype)
+
+
+class MsdBandwidthSweep:
+    params = [1, 4, 16]
+    param_names = ['n_bws']
+
+    def setup(self, n_bws):
+        [t, g] = common.example_curve()[0:2]
+        self.t = t
+        self.g1 = analysis_tools.calc_g1(t, g, True)
+        self.bws = np.logspace(-2., 0., n_bws)
+
+    def time_msd_bandwidth_sweep(self, n_bws):
+        [msd_smooth, alpha] = analysis_tools.msd_bandwidth_sweep(
+            self.t, self.g1, common.Q, self.bws)
+        analysis_tools.shear_modulus(self.t, msd_smooth, alpha, common.R,
+                                     common.T)
+
+    def time_msd_local_pwr_law_loop(self, n_bws):
+        for bw in self.bws:
+            [msd_smooth, alpha] = analysis_tools.msd_local_pwr_law(
+                self.t, self.g1, common.Q, bw=bw)
+            analysis_tools.shear_modulus(self.t, msd_smooth, alpha,
+                                         common.R, common.T)
+
+
+class DlsurKernel:
+    params = ['example', 'synthetic']
+    param_names = ['data']
+
+    def setup(self, data):
+        if data == 'example':
+            [t, g] = common.example_curve()[0:2]
+        else:
+            [t, g] = common.synthetic_curve()
+        self.t = t
+        self.g1 = analysis_tools.calc_g1(t, g, True)
+        self.workspace = utils.Workspace(len(t))
+
+    def time_dlsur_kernel(self, data):
+        analysis_tools.dlsur_kernel(self.t, self.g1, common.Q, common.R,
+                                    common.T, workspace=self.workspace)
+
+    def time_msd_local_pwr_law_shear_modulus(self, data):
+        [msd_smooth, alpha] = analysis_tools.msd_local_pwr_law(
+            self.t, self.g1, common.Q, workspace=self.workspace)
+        analysis_tools.shear_modulus(self.t, msd_smooth, alpha, common.R,
+                                     common.T, workspace=self.workspace)
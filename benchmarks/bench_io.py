@@ -0,0 +1,23 @@
+""" Benchmarks for parsing data exported from the Zetasizer software"""
+from dlsmicro.backend import io
+from . import common
+
+
+class ReadZetasizerCsv:
+    params = (['replicate', 'time'], [True, False])
+    param_names = ['file', 'use_zetasizer_g1']
+
+    def setup(self, file, use_zetasizer_g1):
+        if file == 'replicate':
+            self.file_path = common.EXAMPLE_CSV
+            self.row = 0
+            self.intensities_rows = None
+        else:
+            self.file_path = common.EXAMPLE_TIME_CSV
+            self.row = 1
+            self.intensities_rows = range(13, 33)
+
+    def time_read_zetasizer_csv_to_dict(self, file, use_zetasizer_g1):
+        io.read_zetasizer_csv_to_dict(self.file_path, self.row,
+                                      intensities_rows=self.intensities_rows,
+                                      use_zetasizer_g1=use_zetasizer_g1)
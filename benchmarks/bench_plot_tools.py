@@ -0,0 +1,28 @@
+""" Benchmarks for the replicate bootstrap in dlsmicro.backend.plot_tools"""
+import numpy as np
+import pandas as pd
+from dlsmicro.backend import plot_tools
+from . import common
+
+
+class Bootstrap:
+    params = ([3, 10], [1000, 10000])
+    param_names = ['n_replicates', 'n_bootstrap']
+
+    def setup(self, n_replicates, n_bootstrap):
+        np.random.seed(0)
+        t = common.lag_grid(150)
+        dfs = []
+        for replicate in range(n_replicates):
+            G1 = (1. + 0.1*np.random.randn(len(t)))*t**-0.5
+            dfs.append(pd.DataFrame({'omega': 1.e6/t, 'G1': G1,
+                                     'replicate': replicate}))
+        self.df = pd.concat(dfs)
+        self.M = plot_tools.df_to_matrix(self.df, 'G1', 'replicate')
+
+    def time_bootstrap_matrix_byrows(self, n_replicates, n_bootstrap):
+        plot_tools.bootstrap_matrix_byrows(self.M, n_bootstrap, np.mean)
+
+    def time_bootstrap_freq_sweep_ci(self, n_replicates, n_bootstrap):
+        plot_tools.bootstrap_freq_sweep_ci(self.df, 'G1', 'replicate',
+                                           n_bootstrap, 68.)
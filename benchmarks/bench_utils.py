@@ -0,0 +1,186 @@
+""" Benchmarks for the numerical kernels in dlsmicro.backend.utils"""
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dlsmicro.backend import analysis_tools
+from dlsmicro.backend import fit_funcs
+from dlsmicro.backend import utils
+from . import common
+
+
+class Loess:
+    params = ([1, 2], [50, 100, 200], [0.01, 0.1])
+    param_names = ['degree', 'n', 'bw']
+
+    def setup(self, degree, n, bw):
+        rng = np.random.RandomState(0)
+        self.x = np.log(common.lag_grid(n))
+        self.y = 0.7*self.x + 0.05*rng.randn(n)
+        self.workspace = utils.Workspace(n)
+
+    def time_loess(self, degree, n, bw):
+        utils.loess(self.x, self.y, degree=degree, alpha=bw)
+
+    def time_loess_workspace(self, degree, n, bw):
+        utils.loess(self.x, self.y, degree=degree, alpha=bw,
+                    workspace=self.workspace)
+
+    def time_loess_operator(self, degree, n, bw):
+        utils.loess_operator(self.x, degree, bw)
+
+    def time_loess_cached(self, degree, n, bw):
+        [L, H] = utils.loess_operators.get(self.x, degree, bw)
+        H.dot(self.y)
+        L[1].dot(self.y)
+
+
+class LoessGCV:
+    params = [50, 100, 200]
+    param_names = ['n']
+
+    def setup(self, n):
+        rng = np.random.RandomState(0)
+        self.x = np.log(common.lag_grid(n))
+        self.y = 0.7*self.x + 0.05*rng.randn(n)
+
+    def time_loess_gcv(self, n):
+        utils.loess_gcv(self.x, self.y)
+
+
+class CrossValidation:
+    params = ['example', 'synthetic']
+    param_names = ['data']
+
+    def setup(self, data):
+        if data == 'example':
+            [self.t, self.g] = common.example_curve()[0:2]
+        else:
+            [self.t, self.g] = common.synthetic_curve()
+        self.p0 = [self.g[1], 1.e-2, 1.]
+        self.twindows = [[2., tmax] for tmax in np.arange(40., 130., 10.)]
+        inds = utils.nearest_index(self.t, [2., 80.])
+        self.tfit = self.t[inds[0]:inds[1]+1]
+        self.gfit = self.g[inds[0]:inds[1]+1]
+
+    def time_get_cross_validation_score(self, data):
+        utils.get_cross_validation_score(self.tfit, self.gfit,
+                                         fit_funcs.stretched_exp, self.p0)
+
+    def time_minimize_cv_error(self, data):
+        utils.minimize_cv_error(self.t, self.g, self.twindows,
+                                fit_funcs.stretched_exp, self.p0)
+
+    def time_minimize_cv_error_guess(self, data):
+        utils.minimize_cv_error(self.t, self.g, self.twindows,
+                                fit_funcs.stretched_exp,
+                                fit_funcs.stretched_exp_guess)
+
+    def time_minimize_cv_error_golden(self, data):
+        utils.minimize_cv_error(self.t, self.g, self.twindows,
+                                fit_funcs.stretched_exp,
+                                fit_funcs.stretched_exp_guess,
+                                method='golden')
+
+    def time_minimize_cv_error_kfold(self, data):
+        utils.minimize_cv_error(self.t, self.g, self.twindows,
+                                fit_funcs.stretched_exp,
+                                fit_funcs.stretched_exp_guess,
+                                cv='kfold', k=5)
+
+    def track_golden_evaluations(self, data):
+        return utils.minimize_cv_error(self.t, self.g, self.twindows,
+                                       fit_funcs.stretched_exp,
+                                       fit_funcs.stretched_exp_guess,
+                                       method='golden',
+                                       full_output=True)[3]['n_evaluations']
+
+
+class CrossValidationExecutor:
+    params = [1, 2, 4]
+    param_names = ['workers']
+
+    def setup(self, workers):
+        [self.t, self.g] = common.example_curve()[0:2]
+        self.twindows = [[2., tmax] for tmax in np.arange(40., 130., 10.)]
+        self.executor = ThreadPoolExecutor(workers)
+
+    def teardown(self, workers):
+        self.executor.shutdown()
+
+    def time_minimize_cv_error(self, workers):
+        utils.minimize_cv_error(self.t, self.g, self.twindows,
+                                fit_funcs.stretched_exp,
+                                fit_funcs.stretched_exp_guess,
+                                executor=self.executor)
+
+
+class Laplace:
+    params = [50, 200, 1000]
+    param_names = ['n']
+
+    def setup(self, n):
+        self.t = common.lag_grid(n)
+        self.msd = 10.*self.t**0.6
+        self.s = self.t**-1.
+
+    def time_laplace(self, n):
+        utils.laplace(self.t, self.msd, self.s)
+
+
+class LaplaceMerge:
+    params = ['example', 'synthetic']
+    param_names = ['data']
+
+    def setup(self, data):
+        if data == 'example':
+            [t, g, Ip, Ie] = common.example_curve()
+        else:
+            [t, g] = common.synthetic_curve()
+            [Ip, Ie] = [None, None]
+        df = analysis_tools.full_dlsur_analysis(t, g, True, common.R,
+                                                common.T, common.Q, Ip, Ie)
+        [omega_L, self.G1_L, self.G2_L] = \
+            analysis_tools.shear_modulus_laplace_transform(
+                t, df['msd_smooth'].values, common.R, common.T)
+        self.omega = df['omega'].values
+        self.G1 = df['G1'].values
+        self.G2 = df['G2'].values
+
+    def time_laplace_merge(self, data):
+        utils.laplace_merge(self.omega, self.G1, self.G2,
+                            self.G1_L, self.G2_L)
+
+
+class InterpStack:
+    params = [10, 100, 1000]
+    param_names = ['n_curves']
+
+    def setup(self, n_curves):
+        rng = np.random.RandomState(0)
+        x = np.log(common.lag_grid(200))
+        lengths = rng.randint(100, 200, n_curves)
+        self.x_list = [x[:n] for n in lengths]
+        self.y_list = [np.exp(-np.exp(xi-8.)) for xi in self.x_list]
+        self.x_new = np.linspace(x[0], x[-1], 150)
+
+    def time_interp_stack(self, n_curves):
+        utils.interp_stack(self.x_list, self.y_list, self.x_new)
+
+
+class Workspace:
+    params = [False, True]
+    param_names = ['workspace']
+
+    def setup(self, workspace):
+        [self.t, g] = common.synthetic_curve()
+        self.g1 = np.sqrt(g/g[0])
+        self.workspace = utils.Workspace(len(self.t)) if workspace else None
+
+    def time_msd_and_modulus(self, workspace):
+        for i in range(10):
+            [msd, alpha] = analysis_tools.msd_local_pwr_law(
+                self.t, self.g1, common.Q, workspace=self.workspace)
+            analysis_tools.shear_modulus(self.t, msd, alpha, common.R,
+                                         common.T, workspace=self.workspace)
+
+    def peakmem_msd_and_modulus(self, workspace):
+        self.time_msd_and_modulus(workspace)
@@ -0,0 +1,58 @@
+""" Shared inputs for the DLSuR benchmarks"""
+import os
+import numpy as np
+from dlsmicro.backend import analysis_tools
+from dlsmicro.backend import io
+from dlsmicro.backend import synthetic
+
+# Location of the example data shipped with the repository
+EXAMPLE_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'example_data')
+EXAMPLE_CSV = os.path.join(EXAMPLE_DATA, 'replicate_example', 'replicate1',
+                           'exported2.csv')
+EXAMPLE_TIME_CSV = os.path.join(EXAMPLE_DATA, 'time_example',
+                                'disposable_example.csv')
+
+# Scattering geometry used by the analyze_* drivers
+Q = analysis_tools.calc_q(1.333, 173.*np.pi/180., 633.)
+T = 37. + 273.15
+R = 500./2.
+
+
+def example_curve(file_path=EXAMPLE_CSV, row=0):
+    """ Read and truncate a correlation function from the example data"""
+    data_dict = io.read_zetasizer_csv_to_dict(file_path, row)
+    t, g = analysis_tools.truncate_correlation(data_dict['time_lag'],
+                                               data_dict['correlation'])
+    return [t, g, data_dict['point_intensity'],
+            data_dict['ensemble_intensities']]
+
+
+def lag_grid(n):
+    """ Log-spaced lag grid (in microseconds) spanning the same range as
+    the Zetasizer correlator"""
+    return np.logspace(np.log10(0.5), np.log10(4.e7), n)
+
+
+def synthetic_curve(n=192, model='brownian', params=None, ergodic=True,
+                    seed=0):
+    """ Synthetic correlation function on the multi-tau lag grid, rounded
+    to the 3 significant digits exported by the Zetasizer"""
+    lags = synthetic.multi_tau_lags(n_channels=n)
+    data = synthetic.synthetic_curves(1, model=model, params=params, r=R,
+                                      T=T, q=Q, ergodic=ergodic, lags=lags,
+                                      seed=seed)
+    g = np.array([float('%.3g' % gi) for gi in data['correlation'][0]])
+    return analysis_tools.truncate_correlation(data['time_lag'], g)
+
+
+def synthetic_stack(n_curves, n=192, model='brownian', seed=0):
+    """ Stack of synthetic correlation functions on a shared multi-tau lag
+    grid, truncated at the same lag"""
+    lags = synthetic.multi_tau_lags(n_channels=n)
+    data = synthetic.synthetic_curves(n_curves, model=model, r=R, T=T, q=Q,
+                                      lags=lags, seed=seed)
+    g = data['correlation']
+    t = analysis_tools.truncate_correlation(data['time_lag'],
+                                            g.max(axis=0))[0]
+    return t, g[:, 3:3+len(t)]
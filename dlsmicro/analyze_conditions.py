@@ -1,20 +1,24 @@
-import numpy as np
-from dlsmicro.backend import analysis_tools
 from dlsmicro.backend import io
+from dlsmicro.backend import pipeline
+from dlsmicro.backend import plot_tools
 from dlsmicro.backend import utils
+from dlsmicro.backend import diagnostics as diag
 import pandas as pd
-import matplotlib.pyplot as plt
 
 def analyze_conditions(csv_name, root_folder, condition_dir, 
                        replicate_dict, T, r, erg, Laplace=False, 
                        df_save_path=None, df_file_name=None, 
                        save_as_text=True, save_as_df=True,
                        plot_corr=False, plot_msd=False, plot_G=False,
-                       save_plots=False):
+                       save_plots=False, diagnostics=None, dtype=None,
+                       measured_intercept=False, budget=None):
 
     """ Analyze files exported from Zetasizer software for multiple 
     conditions and plot data per replicate of a condition.
 
+    Each replicate is read, analyzed in memory with
+    ``pipeline.analyze_data_dict()``, and then optionally plotted and saved.
+
     Parameters
     ----------
     csv_name : str
@@ -58,6 +62,29 @@ def analyze_conditions(csv_name, root_folder, condition_dir,
              If `True`, show plot of the shear modulus of each replicate
     save_plots : boolean, `optional`
              If `True`, saves plots of correlation function, MSD, G
+    diagnostics : StudyDiagnostics, `optional`
+                  Record in which to store the time spent in each stage
+                  of the analysis and counts of fitting events for every
+                  replicate. The number of replicates affected by each event is
+                  logged once the analysis is complete.
+                  See ``dlsmicro.backend.diagnostics``
+    dtype : data-type, `optional`
+            If given, e.g. ``np.float32``, the numerical columns of the saved
+            Dataframes are converted to this floating point type to reduce
+            their size. The analysis itself is carried out in double
+            precision. See ``dlsmicro.backend.io.downcast_results``
+    measured_intercept : boolean, `optional`
+                         If `True`, use the intercept measured by the
+                         Zetasizer software when it is consistent with the
+                         correlation function, which is much faster than
+                         estimating it by cross validation. See
+                         ``analysis_tools.calc_g1``
+    budget : utils.FitBudget, `optional`
+             Limits on the fits used to estimate the intercept of each
+             correlation function. A replicate whose fits exceed the limits
+             is skipped, and is reported in ``diagnostics``. If every
+             replicate is skipped, ``utils.BudgetExceeded`` is raised
+             instead of saving the results.
     """
 
     conditions = list(condition_dir.keys())
@@ -83,11 +110,8 @@ def analyze_conditions(csv_name, root_folder, condition_dir,
         df_save_path = root_folder
     if df_file_name == None:
         df_file_name = 'condition_data.pkl'
-
-    # Define scattering vector parameters about solvent
-    n = 1.333 # index of refraction of water (default)
-    theta = 173.*np.pi/180. 
-    lam = 633.
+    if diagnostics is None:
+        diagnostics = diag.StudyDiagnostics()
 
     ####################################################
     # Analyze data
@@ -96,120 +120,68 @@ def analyze_conditions(csv_name, root_folder, condition_dir,
 
     # Create pandas dataframe to organize replicate data
     df = pd.DataFrame(columns=['t', 'msd_smooth', 'alpha', 'omega', 'G1', 'G2',
-                               'replicate', 'condition', 'id', 'scattering', 'epos'])
+                               'replicate', 'condition', 'id'])
+    # Scattering vs. position data of every replicate, keyed by id
+    scattering_dfs = []
     idx = 0
     for condition in conditions:
         for replicate in replicate_dict[condition]:
-            file_path = '%s/%s/replicate%s/%s' % (root_folder,
-                                                  condition_dir[condition],
-                                                  replicate, csv_name)
-
-            # Read the data and truncate over the desired time windows
-            data_dict = io.read_zetasizer_csv_to_dict(file_path, 0)
-            [t, g, I, Ie, point_pos, epos] = list(data_dict.values())
-
-            # Figure out where data is no longer trustworthy (correlation function goes to zero)
-            tinds = [3, len(g)]
-            tinds[1] = np.argmax(g<0.05)
-            if tinds[1] == 0:
-                tinds[1] = len(g) - 1
-            g = g[tinds[0]:tinds[1]]
-            t = t[tinds[0]:tinds[1]]
-
-            # Get a DLS microrheology object that contains all raw data
-            # and analyzed results. 
-            T = T_dict[condition]
-            r = r_dict[condition]
-            ergodic = erg_dict[condition]
-            q = analysis_tools.calc_q(n, theta, lam)
-            dlsmicro_df = analysis_tools.full_dlsur_analysis(t, g, ergodic, r, T, q,
-                                                             I, Ie)
+            save_dir = '%s/%s/replicate%s' % (root_folder,
+                                              condition_dir[condition],
+                                              replicate)
+            file_path = '%s/%s' % (save_dir, csv_name)
+
+            curve_diagnostics = diagnostics.new_curve(
+                '%s/replicate%s' % (condition, replicate))
+
+            # Read the data
+            with diag.stage(curve_diagnostics, 'parse'):
+                data_dict = io.read_zetasizer_csv_to_dict(file_path, 0)
+
+            # Analyze the data in memory
+            try:
+                [t, g, dlsmicro_df] = pipeline.analyze_data_dict(
+                    data_dict, erg_dict[condition], r_dict[condition],
+                    T_dict[condition], Laplace=Laplace,
+                    measured_intercept=measured_intercept, budget=budget,
+                    diagnostics=curve_diagnostics, replicate=replicate,
+                    condition=condition, id=idx)
+            except utils.BudgetExceeded:
+                continue
 
             # Store the scattering vs. position data
-            scattering = np.zeros(len(dlsmicro_df['t']))
-            positions = np.zeros_like(scattering)
-            scattering[0:len(Ie)] = Ie
-            positions[0:len(epos)] = epos
-
-            # Laplace transformed modulus
-            if Laplace:
-                [omega_L, G1_L, G2_L] = analysis_tools.shear_modulus_laplace_transform(t, 
-                                                       dlsmicro_df['msd_smooth'], r, T)
-                dlsmicro_df['G1'], dlsmicro_df['G2'] = utils.laplace_merge(dlsmicro_df['t'], 
-                                                                         dlsmicro_df['G1'], 
-                                                                         dlsmicro_df['G2'],
-                                                                         G1_L,G2_L)
-
-            # Construct pandas dataframe for this replicate and append it to the
-            # master dataframe
-            dlsmicro_df['replicate'] = [replicate]*len(dlsmicro_df['t'])
-            dlsmicro_df['scattering'] = scattering
-            dlsmicro_df['epos'] = positions
-            dlsmicro_df['condition'] = condition
-            dlsmicro_df['id'] = idx
+            scattering_df = io.scattering_table(
+                data_dict['ensemble_intensities'],
+                data_dict['ensemble_positions'], id=idx,
+                condition=condition, replicate=replicate)
+            scattering_dfs.append(scattering_df)
 
+            # Append the results of this replicate to the master dataframe
             idx += 1
             df = pd.concat((df,dlsmicro_df), axis=0, sort=True)
 
             ###############################################
-            # Plot the analyzed data for this replicate
+            # Plot and save the analyzed data for this replicate
             ###############################################
 
-            if plot_corr:
-                plt.plot(t, g, '-r')
-                plt.xscale('log')
-                plt.xlabel('$\\mathregular{time\ (\\mu s)}$')
-                plt.ylabel('g')
-                plt.tight_layout()
-                if save_plots:
-                    save_path = '%s/%s/replicate%s/corr' % (root_folder,
-                                                            condition_dir[condition],
-                                                            replicate)
-                    plt.savefig(save_path)
-                plt.show()
-            if plot_msd:
-                plt.plot(dlsmicro_df['t'], dlsmicro_df['msd_smooth'], '-r')
-                plt.xscale('log')
-                plt.yscale('log')
-                plt.xlabel('$\\mathregular{time\ (\\mu s)}$')
-                plt.ylabel('MSD')
-                plt.tight_layout()
-                if save_plots:
-                    save_path = '%s/%s/replicate%s/msd' % (root_folder,
-                                                            condition_dir[condition],
-                                                            replicate)
-                    plt.savefig(save_path)
-                plt.show()
-            if plot_G:
-                plt.plot(dlsmicro_df['omega'], dlsmicro_df['G1'], '-r')
-                plt.plot(dlsmicro_df['omega'], dlsmicro_df['G2'], '--r')
-                plt.ylabel('$\\mathregular{G^*\ (Pa)}$')
-                plt.xlabel('$\\mathregular{\\omega\ (s^{-1})}$')
-                plt.legend(['$\\mathregular{G^{\\prime}}$',
-                            '$\\mathregular{G^{\\prime \\prime}}$'], frameon=False,)
-                plt.xscale('log')
-                plt.yscale('log')
-                plt.tight_layout()
-                if save_plots:
-                    save_path = '%s/%s/replicate%s/G' % (root_folder,
-                                                            condition_dir[condition],
-                                                            replicate)
-                    plt.savefig(save_path)
-                plt.show()
-
-            ##############################################
-            # Save analysis results
-            ##############################################
+            plot_tools.plot_analysis(t, g, dlsmicro_df, plot_corr=plot_corr,
+                                     plot_msd=plot_msd, plot_G=plot_G,
+                                     save_dir=save_dir if save_plots else None,
+                                     tight_layout=True)
             if save_as_text:
-                save_path = '%s/%s/replicate%s/' % (root_folder,
-                                                    condition_dir[condition],
-                                                    replicate)
-                for i in dlsmicro_df.columns[:-2]:
-                    np.savetxt('%s/%s' % (save_path,i), dlsmicro_df[i].values)
+                io.save_results_as_text(save_dir, dlsmicro_df, scattering_df,
+                                        columns=dlsmicro_df.columns[:-2])
+
+    diagnostics.log_summary()
 
     #################################################
     # Save the pandas dataframe
     #################################################
     if save_as_df:
+        if not scattering_dfs:
+            raise utils.BudgetExceeded('Every replicate exceeded the fit '
+                                       'budget, so there are no results to '
+                                       'save')
         save_path = df_save_path + '/' + df_file_name
-        df.to_pickle(save_path)
+        scattering_df = pd.concat(scattering_dfs, ignore_index=True)
+        io.save_results(save_path, df, scattering_df, dtype=dtype)
@@ -1,18 +1,25 @@
-import numpy as np
-from dlsmicro.backend import analysis_tools
+import re
 from dlsmicro.backend import io
+from dlsmicro.backend import pipeline
+from dlsmicro.backend import plot_tools
 from dlsmicro.backend import utils
-import matplotlib.pyplot as plt
+from dlsmicro.backend import diagnostics as diag
 import pandas as pd
 
 def analyze_time_points(file_path, T, r, ergodic, n_points, n_positions,
                         Laplace=False, df_save_path=None, df_file_name=None,
                         save_as_txt=True, save_as_df=True, 
-                        plot_corr=False, plot_msd=False, plot_G=False):
+                        plot_corr=False, plot_msd=False, plot_G=False,
+                        diagnostics=None, dtype=None,
+                        measured_intercept=False, budget=None):
 
     """ Analyze files exported from Zetasizer software for time-
     dependent measurements and plot data per time point.
 
+    The file is read once. Each time point is then parsed, analyzed in
+    memory with ``pipeline.analyze_data_dict()``, and optionally plotted
+    and saved.
+
     Parameters
     ----------
     file_path : str
@@ -54,6 +61,29 @@ def analyze_time_points(file_path, T, r, ergodic, n_points, n_positions,
                of each replicate
     plot_G : boolean, `optional`
              If `True`, show plot of the shear modulus of each replicate
+    diagnostics : StudyDiagnostics, `optional`
+                  Record in which to store the time spent in each stage
+                  of the analysis and counts of fitting events for every
+                  time point. The number of time points affected by each event is
+                  logged once the analysis is complete.
+                  See ``dlsmicro.backend.diagnostics``
+    dtype : data-type, `optional`
+            If given, e.g. ``np.float32``, the numerical columns of the saved
+            Dataframes are converted to this floating point type to reduce
+            their size. The analysis itself is carried out in double
+            precision. See ``dlsmicro.backend.io.downcast_results``
+    measured_intercept : boolean, `optional`
+                         If `True`, use the intercept measured by the
+                         Zetasizer software when it is consistent with the
+                         correlation function, which is much faster than
+                         estimating it by cross validation. See
+                         ``analysis_tools.calc_g1``
+    budget : utils.FitBudget, `optional`
+             Limits on the fits used to estimate the intercept of each
+             correlation function. A time point whose fits exceed the limits
+             is skipped, and is reported in ``diagnostics``. If every
+             time point is skipped, ``utils.BudgetExceeded`` is raised
+             instead of saving the results.
     """
 
     if df_save_path == None:
@@ -62,6 +92,8 @@ def analyze_time_points(file_path, T, r, ergodic, n_points, n_positions,
         df_save_path = file_path[:-(len(file_name))]
     if df_file_name == None:
         df_file_name = 'time_course.pkl'
+    if diagnostics is None:
+        diagnostics = diag.StudyDiagnostics()
 
     # Row numbers for scattering intensity sweep (int_rcds)
     # Row numbers for correlation time points (time_points)
@@ -76,102 +108,185 @@ def analyze_time_points(file_path, T, r, ergodic, n_points, n_positions,
     # else:
     #     raise Exception('cuvette type entered is not valid')
 
-    # Define scattering vector parameters about solvent
-    n = 1.333 # index of refraction of water (default)
-    theta = 173.*np.pi/180. 
-    lam = 633.
-
     # Create pandas dataframe to organize time point data
     df = pd.DataFrame(columns=['time', 'MSD', 'alpha', 'omega', 'G1', 'G2',
-                               'time_point', 'scattering','epos'])
+                               'time_point'])
+    # The position scan at the end of the experiment is shared by all
+    # time points
+    scattering_df = None
+    records = pd.read_csv(file_path, header=None,
+                          names=io.default_column_order)
+    Ie = records.iloc[int_rcds]['Derived Count Rate']
+    epos = records.iloc[int_rcds]['Measurement Position']
 
     for tp in time_points:
         save_suffix = 'time_point_%s.txt' % tp
-        ####################################################
-        # Analyze data
-        # Don't edit this unless you know what you're doing
-        ####################################################
-
-        # Read the data and truncate over the desired time windows
-        data_dict = io.read_zetasizer_csv_to_dict(file_path, tp, intensities_rows=int_rcds)
-        [t, g, I, Ie, point_pos, epos] = list(data_dict.values())
-
-        # Figure out where data is no longer trustworthy (correlation function goes to zero)
-        tinds = [3, len(g)]
-        tinds[1] = np.argmax(g<0.05)
-        if tinds[1] == 0:
-            tinds[1] = len(g) - 1
-        g = g[tinds[0]:tinds[1]]
-        t = t[tinds[0]:tinds[1]]
-
-        # Get a DLS microrheology object that contains all raw data
-        # and analyzed results. 
-        q = analysis_tools.calc_q(n, theta, lam)
-        dlsmicro_df = analysis_tools.full_dlsur_analysis(t, g, ergodic, r, T, q,
-                                                         I, Ie)
-
-        # Store the scattering vs. position data
-        scattering = np.zeros(len(dlsmicro_df['t']))
-        positions = np.zeros_like(scattering)
-        scattering[0:len(Ie)] = Ie
-        positions[0:len(epos)] = epos
-
-        # Laplace transformed modulus
-        if Laplace:
-            [omega_L, G1_L, G2_L] = analysis_tools.shear_modulus_laplace_transform(t, 
-                                                   dlsmicro_df['msd_smooth'], r, T)
-            dlsmicro_df['G1'], dlsmicro_df['G2'] = utils.laplace_merge(dlsmicro_df['t'], 
-                                                                     dlsmicro_df['G1'], 
-                                                                     dlsmicro_df['G2'],
-                                                                     G1_L,G2_L)
-
-        # Construct pandas dataframe for this replicate and append it to the
-        # master dataframe
-        dlsmicro_df['time_point'] = [tp]*len(dlsmicro_df['t'])
-        dlsmicro_df['scattering'] = scattering
-        dlsmicro_df['epos'] = positions
+
+        curve_diagnostics = diagnostics.new_curve('time_point_%s' % tp)
+
+        # Parse the data and analyze it
+        with diag.stage(curve_diagnostics, 'parse'):
+            data_dict = io.parse_zetasizer_record(records.iloc[tp], Ie, epos)
+        try:
+            [t, g, dlsmicro_df] = pipeline.analyze_data_dict(
+                data_dict, ergodic, r, T, Laplace=Laplace,
+                measured_intercept=measured_intercept, budget=budget,
+                diagnostics=curve_diagnostics, time_point=tp)
+        except utils.BudgetExceeded:
+            continue
+        if scattering_df is None:
+            scattering_df = io.scattering_table(
+                data_dict['ensemble_intensities'],
+                data_dict['ensemble_positions'])
 
         df = pd.concat((df,dlsmicro_df), axis=0, sort=True)
 
         ###############################################
-        # Plot the analyzed data
+        # Plot and save the analyzed data
         ###############################################
 
-        if plot_corr:
-            plt.plot(t, g, '-r')
-            plt.xscale('log')
-            plt.xlabel('$\\mathregular{time\ (\\mu s)}$')
-            plt.ylabel('g')
-            plt.show()
-        if plot_msd:
-            plt.plot(dlsmicro_df['t'], dlsmicro_df['msd_smooth'], '-r')
-            plt.xscale('log')
-            plt.yscale('log')
-            plt.xlabel('$\\mathregular{time\ (\\mu s)}$')
-            plt.ylabel('MSD')
-            plt.show()
-        if plot_G:
-            plt.plot(dlsmicro_df['omega'], dlsmicro_df['G1'], '-r', lw=2.0)
-            plt.plot(dlsmicro_df['omega'], dlsmicro_df['G2'], '--r', lw=2.0)
-            plt.ylabel('$\\mathregular{G^*\ (Pa)}$')
-            plt.xlabel('$\\mathregular{\\omega\ (s^{-1})}$')
-            plt.legend(['$\\mathregular{G^{\\prime}}$',
-                        '$\\mathregular{G^{\\prime \\prime}}$'], frameon=False,)
-            plt.xscale('log')
-            plt.yscale('log')
-            plt.show()
-
-        ##############################################
-        # Save analysis results
-        ##############################################
-
+        plot_tools.plot_analysis(t, g, dlsmicro_df, plot_corr=plot_corr,
+                                 plot_msd=plot_msd, plot_G=plot_G, lw=2.0)
         if save_as_txt:
-            for i in dlsmicro_df.columns:
-                np.savetxt('%s/%s' % (df_save_path,i), dlsmicro_df[i].values)
+            io.save_results_as_text(df_save_path, dlsmicro_df, scattering_df)
+
+    diagnostics.log_summary()
 
     #################################################
     # Save the pandas dataframe
     #################################################
     if save_as_df:
+        if scattering_df is None:
+            raise utils.BudgetExceeded('Every time point exceeded the fit '
+                                       'budget, so there are no results to '
+                                       'save')
         save_path = df_save_path + '/' + df_file_name
-        df.to_pickle(save_path)
+        io.save_results(save_path, df, scattering_df, dtype=dtype)
+
+
+
+def follow_time_points(file_path, T, r, ergodic, Ie=None, epos=None,
+                       start_row=1, max_points=None, Laplace=False,
+                       poll_interval=1.0, timeout=None, diagnostics=None,
+                       measured_intercept=False, budget=None):
+
+    """ Analyze a file exported from Zetasizer software for time-
+    dependent measurements while the instrument is still appending
+    time points to it.
+
+    Each record is parsed and analyzed as soon as it is appended to the
+    file, so the number of time points does not need to be known up front
+    and the file is never re-read from the beginning. The Zetasizer
+    software names the time points after the sample, followed by the
+    number of each measurement, e.g. `point_correlation 3`. Following
+    stops at the first record of another sample, or whose number does not
+    follow on from that of the previous time point, i.e. at the position
+    scan that ``analyze_time_points()`` reads as ensemble intensities.
+
+    Parameters
+    ----------
+    file_path : str
+               Path to exported csv file
+    T : float
+        Temperature of the experiment in Kelvin
+    r : float  
+        Radius of particle in experiment in nanometers
+    ergodic : boolean
+              Ergodicity in experiment
+    Ie : 1d-array, `optional`
+         Vector of scattering intensities at different positions in the
+         cuvette. Required if ``ergodic=False``, since the position scan
+         is not available until the end of the experiment.
+    epos : 1d-array, `optional`
+           Vector of measurement positions corresponding to ``Ie``
+    start_row : int, `optional`
+                Row number (0-indexed) of the first time point to analyze.
+                The default matches ``analyze_time_points()``.
+    max_points : int, `optional`
+                 Stop after this many time points have been analyzed.
+                 If `None`, follow the file until ``timeout``.
+    Laplace : boolean, `optional`
+              If `True`, use direct Laplace transform to find
+              shear modulus. This is useful because it can
+              smooth the data to noise.
+    poll_interval : float, `optional`
+                    Time (in seconds) to wait between checks for new data
+    timeout : float, `optional`
+              Stop once no new time point has been appended for this many
+              seconds. If `None`, follow the file indefinitely.
+    diagnostics : StudyDiagnostics, `optional`
+                  Record in which to store the time spent in each stage
+                  of the analysis and counts of fitting events for every
+                  time point. The number of time points affected by each event is
+                  logged once the analysis is complete.
+                  See ``dlsmicro.backend.diagnostics``
+    measured_intercept : boolean, `optional`
+                         If `True`, use the intercept measured by the
+                         Zetasizer software when it is consistent with the
+                         correlation function, which is much faster than
+                         estimating it by cross validation. See
+                         ``analysis_tools.calc_g1``
+    budget : utils.FitBudget, `optional`
+             Limits on the fits used to estimate the intercept of each
+             correlation function. A time point whose fits exceed the limits
+             is skipped, and is reported in ``diagnostics``.
+
+    Yields
+    ------
+    time_point : int
+                 Row number of the time point in the exported csv file
+    dlsmicro_df : DataFrame
+                  Dataframe containing table of results from DLS
+                  microrheology analysis for this time point, with the
+                  same columns as the Dataframe saved by
+                  ``analyze_time_points()``
+    """
+
+    if not ergodic and Ie is None:
+        raise ValueError('Ensemble intensities Ie are required to follow '
+                         'non-ergodic time points')
+
+    if diagnostics is None:
+        diagnostics = diag.StudyDiagnostics()
+
+    n_analyzed = 0
+    sample = None
+    for tp, record in io.follow_zetasizer_csv(file_path, start_row=start_row,
+                                              poll_interval=poll_interval,
+                                              timeout=timeout):
+        # Stop at the position scan at the end of the experiment
+        [name, number] = _split_sample_name(record['Sample Name'])
+        if sample is not None and (
+                name != sample[0] or (number is None) != (sample[1] is None)
+                or (number is not None and number <= sample[1])):
+            break
+        sample = [name, number]
+
+        curve_diagnostics = diagnostics.new_curve('time_point_%s' % tp)
+
+        with diag.stage(curve_diagnostics, 'parse'):
+            data_dict = io.parse_zetasizer_record(record, Ie, epos)
+        try:
+            [t, g, dlsmicro_df] = pipeline.analyze_data_dict(
+                data_dict, ergodic, r, T, Laplace=Laplace,
+                measured_intercept=measured_intercept, budget=budget,
+                diagnostics=curve_diagnostics, time_point=tp)
+        except utils.BudgetExceeded:
+            continue
+        yield tp, dlsmicro_df
+
+        n_analyzed += 1
+        if max_points is not None and n_analyzed >= max_points:
+            break
+
+    diagnostics.log_summary()
+
+
+def _split_sample_name(sample_name):
+    """ Split a sample name exported by the Zetasizer software, e.g.
+    `point_correlation 3`, into the name of the sample and the number of
+    the measurement, which is `None` if the name does not end with one """
+    match = re.match(r'(.*?)\s*(\d+)$', str(sample_name).strip())
+    if match is None:
+        return [str(sample_name).strip(), None]
+    return [match.group(1), int(match.group(2))]
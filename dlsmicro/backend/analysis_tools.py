@@ -4,11 +4,14 @@ import numpy as np
 import dlsmicro.backend.utils as utils
 from scipy import special
 import dlsmicro.backend.fit_funcs as fit_funcs
+from dlsmicro.backend import diagnostics as diag
 import pandas as pd
 
 
 def find_g0(t, corr, func=fit_funcs.stretched_exp, t0=2.0,
-            tmaxs=np.arange(40., 130., 10), p0=None):
+            tmaxs=np.arange(40., 130., 10), p0=None, diagnostics=None,
+            budget=None, method='grid', executor=None, cv='loo', k=10,
+            seed=0):
     """ Estimate the intercept of the correlation function at t = 0
 
     Parameters
@@ -30,9 +33,37 @@ def find_g0(t, corr, func=fit_funcs.stretched_exp, t0=2.0,
            Vector of possible maximum time-lags to use in the fitting interval
            of the correlation coefficient. The optimal tmax will be selected
            based on minimization of the cross-validation error of the fit.
-    p0 : 1-d array, `optional`
-         Initial guesses for the parameters to ``func`` for fitting
-
+    p0 : 1-d array, callable or 'auto', `optional`
+         Initial guesses for the parameters to ``func`` for fitting. If
+         callable, ``p0(t, corr)`` is called with the data in each fitting
+         window, see ``utils.minimize_cv_error``. With ``'auto'``, the
+         guesses of the stretched exponential are estimated from the data
+         in each window with ``fit_funcs.stretched_exp_guess``.
+    diagnostics : CurveDiagnostics, `optional`
+                  Record in which to store the time spent searching for
+                  the intercept and count the fits
+    budget : utils.FitBudget, `optional`
+             Limits on the function evaluations and time of the fits, see
+             ``utils.minimize_cv_error``
+    method : {'grid', 'golden'}, `optional`
+             Search for the optimal tmax. With ``'grid'``, every value of
+             ``tmaxs`` is tried. With ``'golden'``, every time-lag between
+             the smallest and largest of ``tmaxs`` is considered, and
+             the optimum is found by golden section search, which needs
+             fewer cross-validation evaluations. See
+             ``utils.minimize_cv_error``
+    executor : concurrent.futures.Executor, `optional`
+               Executor whose ``map`` method is used to perform the fits of
+               the cross validation concurrently, see
+               ``utils.minimize_cv_error``
+    cv : {'loo', 'kfold', 'subsample'}, `optional`
+         Cross-validation strategy used to score the windows. ``'kfold'``
+         and ``'subsample'`` need ``k`` fits per window rather than one per
+         time-lag in the window, see ``utils.get_cross_validation_score``
+    k : int, `optional`
+        Number of folds or of held-out time-lags
+    seed : int, `optional`
+           Seed of the random assignment of the time-lags
 
     Returns
     -------
@@ -47,17 +78,242 @@ def find_g0(t, corr, func=fit_funcs.stretched_exp, t0=2.0,
            estimate ``g0``
     """
 
-    # Construct list of fitting windows
-    twindows = [[t0, tmax] for tmax in tmaxs]
-    # Find twindow for minimum CV error
-    [twindow_min, pmin, CV_min] = utils.minimize_cv_error(t, corr, twindows,
-                                                          func, p0)
-    g0 = func(0.0, *pmin)
+    if isinstance(p0, str) and p0 == 'auto':
+        p0 = fit_funcs.stretched_exp_guess
+    with diag.stage(diagnostics, 'g0_search'):
+        # Construct list of fitting windows
+        twindows = [[t0, tmax] for tmax in tmaxs]
+        # Find twindow for minimum CV error
+        [twindow_min, pmin, CV_min] = utils.minimize_cv_error(
+            t, corr, twindows, func, p0, diagnostics=diagnostics,
+            budget=budget, method=method, executor=executor, cv=cv, k=k,
+            seed=seed)
+        if pmin is None:
+            raise RuntimeError('The correlation function could not be fit '
+                               'in any of the windows')
+        g0 = func(0.0, *pmin)
 
     return [g0, twindow_min, pmin]
 
 
-def calc_g1(t, corr, ergodic, g0=None, Ip=None, Ie=None, eps=None):
+def truncate_correlation(t, corr, start=3, threshold=0.05):
+    """ Truncate the correlation function to the time-lags where it is
+    trustworthy, as done by the ``analyze_*`` drivers
+
+    Parameters
+    ----------
+    t : 1d-array
+        Vector of time-lags
+    corr : 1d-array
+           Correlation coefficient at the time-lags ``t``
+    start : int, `optional`
+            Index of the first time-lag to keep
+    threshold : float, `optional`
+                The correlation function is truncated at the first
+                time-lag where it falls below ``threshold``
+
+    Returns
+    -------
+    t : 1d-array
+        Truncated vector of time-lags
+    corr : 1d-array
+           Truncated correlation coefficient
+    """
+    tinds = [start, len(corr)]
+    tinds[1] = np.argmax(corr < threshold)
+    if tinds[1] == 0:
+        tinds[1] = len(corr) - 1
+    return [t[tinds[0]:tinds[1]], corr[tinds[0]:tinds[1]]]
+
+
+def log_bin_correlation(t, corr, n_bins=100, counts=None, corr_var=None):
+    """ Average the correlation function into log-spaced bins of time-lag,
+    so that the analysis runs on a controlled number of points whatever
+    the number of channels of the correlator
+
+    Bins without any channel are dropped, so channels that are already
+    further apart than the bins, e.g. at the short time-lags of a
+    multi-tau correlator, are kept as they are.
+
+    Parameters
+    ----------
+    t : 1d-array
+        Increasing vector of positive time-lags
+    corr : 1d-array
+           Correlation coefficient at the time-lags ``t``
+    n_bins : int, `optional`
+             Number of log-spaced bins between the first and last time-lag
+    counts : 1d-array, `optional`
+             Weight of each channel in the averages, e.g. its number of
+             samples or the counts returned by a previous binning. By
+             default, every channel has the same weight.
+    corr_var : 1d-array, `optional`
+               Variance of the correlation coefficient of each channel. By
+               default, the variance of each bin is estimated from the
+               scatter of its channels.
+
+    Returns
+    -------
+    t : 1d-array
+        Count-weighted mean time-lag of each bin
+    corr : 1d-array
+           Count-weighted mean correlation coefficient of each bin
+    var : 1d-array
+          Variance of the mean correlation coefficient of each bin. Without
+          ``corr_var``, it is `NaN` for the bins with a single channel.
+    counts : 1d-array
+             Total weight of the channels of each bin
+    """
+    t = np.asarray(t, dtype=float)
+    corr = np.asarray(corr, dtype=float)
+    if counts is None:
+        counts = np.ones(len(t))
+    counts = np.asarray(counts, dtype=float)
+    edges = np.logspace(np.log10(t[0]), np.log10(t[-1]), n_bins+1)
+    bins = np.clip(np.searchsorted(edges, t, side='right')-1, 0, n_bins-1)
+    W = np.bincount(bins, counts, n_bins)
+    # Sum of the squared weights, for the variance of weighted means
+    W2 = np.bincount(bins, np.square(counts), n_bins)
+    keep = W > 0
+    [W, W2] = [W[keep], W2[keep]]
+    t_bin = np.bincount(bins, counts*t, n_bins)[keep]/W
+    corr_bin = np.bincount(bins, counts*corr, n_bins)[keep]/W
+    bins = np.cumsum(keep)[bins] - 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if corr_var is None:
+            # Unbiased weighted variance of the channels of each bin
+            dev2 = np.square(corr - corr_bin[bins])
+            var = np.bincount(bins, counts*dev2)/(W - W2/W)
+            var = np.where(W2 < np.square(W), var, np.nan)*W2/np.square(W)
+        else:
+            var = np.bincount(bins, np.square(counts)*corr_var)/np.square(W)
+    return [t_bin, corr_bin, var, W]
+
+
+def _find_g0_default(t, corr, diagnostics=None, budget=None, method='grid',
+                     executor=None, cv_kws=None, p0=None):
+    """ Estimate the intercept with the default stretched exponential fit
+    used by ``calc_g1``, with the keyword arguments ``cv_kws`` (``cv``,
+    ``k`` and ``seed``) and the initial guesses ``p0`` (`None` or
+    ``'auto'``) of ``find_g0``. Returns ``[g0, twindow_min, pmin]``. """
+    if cv_kws is None:
+        cv_kws = {}
+    if p0 is None:
+        # Define guesses for the stretched exponential function fitting
+        a0 = 1.0e-2
+        beta0 = 1.0
+        p0 = [corr[1], a0, beta0]
+    # Fit the correlation and get the intercept
+    return find_g0(t, corr, func=fit_funcs.stretched_exp, t0=2.0,
+                   tmaxs=np.arange(40., 130., 10.), p0=p0,
+                   diagnostics=diagnostics, budget=budget, method=method,
+                   executor=executor, **cv_kws)
+
+
+def check_intercept(t, corr, g0, rtol=0.05, n_points=5):
+    """ Check that an intercept, e.g. the `Measured Intercept` exported by
+    the Zetasizer software, is consistent with the correlation function
+
+    Parameters
+    ----------
+    t : 1d-array
+        Vector of time-lags
+    corr : 1d-array
+           Correlation coefficient at the time-lags ``t``
+    g0 : float
+         Intercept of ``corr`` at `t=0` to check
+    rtol : float, `optional`
+           Largest accepted difference, relative to ``g0``, between ``g0``
+           and the mean of the first time-lags of ``corr``
+    n_points : int, `optional`
+               Number of time-lags over which ``corr`` is averaged
+
+    Returns
+    -------
+    valid : boolean
+            `True` if ``g0`` is a finite, positive number close to the
+            correlation function at the shortest time-lags
+    """
+    if g0 is None or not np.isfinite(g0) or g0 <= 0.:
+        return False
+    early = np.mean(corr[:n_points])
+    return bool(np.abs(early - g0) <= rtol*g0)
+
+
+def _find_g0_measured(t, corr, measured_g0, rtol=0.05, diagnostics=None,
+                      budget=None, p0=None, twindow=None):
+    """ Use a measured intercept as the intercept of ``corr`` if it passes
+    ``check_intercept``. The stretched exponential of ``calc_g1`` is then fit
+    with its intercept fixed over the single window ``twindow``, in place
+    of the cross validation search. By default, the window starts at the
+    ``t0`` of ``find_g0`` and ends in the middle of the ``tmaxs`` searched
+    by ``calc_g1``, ``[2.0, 80.]``. Returns ``[g0, twindow, pmin]``, or
+    `None` if the measured intercept is rejected or the fit fails. """
+    if twindow is None:
+        twindow = [2.0, 80.]
+    with diag.stage(diagnostics, 'g0_search'):
+        if not check_intercept(t, corr, measured_g0, rtol):
+            diag.event(diagnostics, 'measured_g0_rejected')
+            return None
+        [tmin, tmax] = utils.nearest_index(t, twindow)
+
+        def func(x, a, beta):
+            return fit_funcs.stretched_exp(x, measured_g0, a, beta)
+        if p0 == 'auto':
+            p0 = fit_funcs.stretched_exp_guess(t[tmin:tmax], corr[tmin:tmax],
+                                               x0=measured_g0, n_iter=0)[1:]
+        else:
+            p0 = [1.0e-2, 1.0]
+        try:
+            p = utils._curve_fit(func, t[tmin:tmax], corr[tmin:tmax], p0,
+                                 10000, diagnostics, budget)
+        except RuntimeError:
+            diag.event(diagnostics, 'measured_g0_rejected')
+            return None
+        diag.count(diagnostics, 'measured_g0_used')
+    return [measured_g0, twindow, np.array([measured_g0, p[0], p[1]])]
+
+
+def _search_g0(t, corr, measured_g0=None, g0_rtol=0.05, diagnostics=None,
+               budget=None, method='grid', executor=None, cv_kws=None,
+               p0=None, twindow=None):
+    """ Estimate the intercept as in ``calc_g1``, from ``measured_g0`` if it
+    is accepted, with a fit over ``twindow``, and otherwise by the cross
+    validation search. Returns ``[g0, twindow_min, pmin]``. If the fits
+    exceed the limits of ``budget`` for the whole correlation function, or
+    the per-fit limits leave no window that can be fit, the event is
+    recorded in ``diagnostics`` and ``utils.BudgetExceeded`` is raised.
+    Other fit failures raise ``RuntimeError``. """
+    if budget is not None:
+        budget = budget.start()
+        if diagnostics is None:
+            # Count the fits stopped by the budget, including those of
+            # the workers of an executor
+            diagnostics = diag.CurveDiagnostics()
+        n_stopped = diagnostics.counts['fit_timeouts']
+    try:
+        fit = None
+        if measured_g0 is not None:
+            fit = _find_g0_measured(t, corr, measured_g0, g0_rtol,
+                                    diagnostics, budget, p0, twindow)
+        if fit is None:
+            fit = _find_g0_default(t, corr, diagnostics, budget, method,
+                                   executor, cv_kws, p0)
+    except utils.BudgetExceeded:
+        diag.event(diagnostics, 'budget_exceeded')
+        raise
+    except RuntimeError as e:
+        if budget is None or diagnostics.counts['fit_timeouts'] == n_stopped:
+            raise
+        diag.event(diagnostics, 'budget_exceeded')
+        raise utils.BudgetExceeded(str(e))
+    return fit
+
+
+def calc_g1(t, corr, ergodic, g0=None, Ip=None, Ie=None, eps=None,
+            diagnostics=None, workspace=None, measured_g0=None,
+            g0_rtol=0.05, budget=None, g0_method='grid', executor=None,
+            g0_cv_kws=None, g0_p0=None, g0_twindow=None):
     """Compute the intermediate scattering function from the correlation function.
 
     This function transforms the correlation functio to the intermediate 
@@ -86,7 +342,56 @@ def calc_g1(t, corr, ergodic, g0=None, Ip=None, Ie=None, eps=None):
     g0 : float, `optional`
          Estimate of the intercept of ``g2 - 1`` at time 0. If not provided,
          the intercept will be estimated automatically based on a stretched
-         exponential fit.
+         exponential fit. If provided, the correlation function is used
+         as is.
+    diagnostics : CurveDiagnostics, `optional`
+                  Record in which to store the time spent in each stage
+    workspace : utils.Workspace, `optional`
+                Buffers in which to compute ``g1``. The returned array is
+                overwritten by the next call using the same workspace.
+    measured_g0 : float, `optional`
+                  Intercept measured by the instrument, e.g.
+                  ``data_dict['measured_intercept']`` from
+                  ``io.read_zetasizer_csv_to_dict()``. If ``g0`` is not
+                  provided and ``measured_g0`` passes ``check_intercept``,
+                  it is used as the intercept and the stretched exponential
+                  is fit over the single window ``g0_twindow``, which is
+                  much faster than the cross validation search. Otherwise the intercept is
+                  estimated as if ``measured_g0`` was not given.
+    g0_rtol : float, `optional`
+              Tolerance of ``check_intercept`` for ``measured_g0``
+    budget : utils.FitBudget, `optional`
+             Limits on the function evaluations and time of the fits used
+             to estimate the intercept. If the limits for the whole
+             correlation function are exceeded, ``utils.BudgetExceeded``
+             is raised.
+    g0_method : {'grid', 'golden'}, `optional`
+                Search for the fitting window used to estimate the
+                intercept, see ``find_g0``
+    executor : concurrent.futures.Executor, `optional`
+               Executor used to perform the fits of the search for the
+               intercept concurrently, e.g. a ``ThreadPoolExecutor`` to
+               use every core when analyzing a single sample. The results
+               are the same as without an executor. See ``find_g0``
+    g0_cv_kws : dictionary, `optional`
+                Cross-validation strategy used to estimate the intercept,
+                as the keyword arguments ``cv``, ``k`` and ``seed`` of
+                ``find_g0``, e.g. ``{'cv': 'kfold', 'k': 5}``. By default,
+                leave-one-out cross validation is used.
+    g0_p0 : 'auto', `optional`
+            With ``'auto'``, the initial guesses of the stretched
+            exponential fits used to estimate the intercept are estimated
+            from the data with ``fit_funcs.stretched_exp_guess``, which
+            needs far fewer function evaluations than the fixed default
+            guesses. The fits may then converge to different fitting
+            windows, and the results change, e.g. by a few percent for
+            some of the example data.
+    g0_twindow : list of floats, `optional`
+                 Window ``[t0, tmax]`` of time-lags over which the
+                 stretched exponential is fit when ``measured_g0`` is
+                 used. By default, ``[2.0, 80.]``, which starts at the
+                 ``t0`` of ``find_g0`` and ends in the middle of the
+                 windows searched otherwise.
 
     Returns
     -------
@@ -99,46 +404,60 @@ def calc_g1(t, corr, ergodic, g0=None, Ip=None, Ie=None, eps=None):
     The correlation function exported by the Zetasizer software is equal to
     ``g2 - 1``
     """
-
-    g2 = corr + 1.
+    if workspace is None:
+        workspace = utils.Workspace(len(corr))
+    g2 = np.add(corr, 1., out=workspace.array('g2', len(corr)))
 
     # If no intercept is provided, estimate it using a stretched exponential
     # function with default parameters
 
+    twindow_min = None
     if g0 is None:
-        # Define guesses for the stretched exponential function fitting
-        a0 = 1.0e-2
-        beta0 = 1.0
-        p0 = [corr[1], a0, beta0]
-        # Fit the correlation and get the intercept
-        [g0, twindow_min, pmin] = find_g0(t, corr, func=fit_funcs.stretched_exp, t0=2.0,
-                     tmaxs=np.arange(40., 130., 10.), p0=p0)
-    
-    # If any of the g values are greater than g0, allow
-    # g2 to be replaced with the fit to avoid negative
-    # MSD values
-    if np.any(corr > g0):
-        print('Negative values encountered in MSD...')
-        print('Replacing early time data with gfit')
-    tmin = np.argmin(np.abs(t-twindow_min[0]))
-    tmax = np.argmin(np.abs(t-twindow_min[1]))
-    gfit = fit_funcs.stretched_exp(t, *pmin)
-    g2[tmin:tmax] = gfit[tmin:tmax] + 1.
-
-    if ergodic:
-        g1 = np.sqrt((g2-1.)/g0)
-    else:
-        Ie_avg = np.average(Ie)
-        # calculate the ratio of ensemble to time averaged
-        # intensities
-        Y = Ie_avg/Ip
-        # calculate the g1 correlation function
-        if eps is None:
-            g1 = (Y-1.)/Y+np.sqrt(g2-g0)/Y
+        [g0, twindow_min, pmin] = _search_g0(t, corr, measured_g0, g0_rtol,
+                                             diagnostics, budget, g0_method,
+                                             executor, g0_cv_kws, g0_p0,
+                                             g0_twindow)
+
+    with diag.stage(diagnostics, 'g1'):
+        # If any of the g values are greater than g0, allow
+        # g2 to be replaced with the fit to avoid negative
+        # MSD values
+        if np.any(corr > g0):
+            diag.event(diagnostics, 'corr_above_g0',
+                       np.count_nonzero(corr > g0))
+        if twindow_min is not None:
+            [tmin, tmax] = utils.nearest_index(t, twindow_min)
+            gfit = fit_funcs.stretched_exp(t[tmin:tmax], *pmin)
+            np.add(gfit, 1., out=g2[tmin:tmax])
+
+        g1 = workspace.array('g1', len(corr))
+        if ergodic:
+            # g1 = sqrt((g2-1)/g0)
+            np.subtract(g2, 1., out=g1)
+            np.divide(g1, g0, out=g1)
+            np.sqrt(g1, out=g1)
         else:
-            g1 = (1.-(1.-eps)/Y +
-                  (1-eps)*np.sqrt(1. +
-                                  (g2-g0-1.)/(1-eps)**2.)/Y)
+            Ie_avg = np.average(Ie)
+            # calculate the ratio of ensemble to time averaged
+            # intensities
+            Y = Ie_avg/Ip
+            # calculate the g1 correlation function
+            if eps is None:
+                # g1 = (Y-1)/Y + sqrt(g2-g0)/Y
+                np.subtract(g2, g0, out=g1)
+                np.sqrt(g1, out=g1)
+                np.divide(g1, Y, out=g1)
+                np.add(g1, (Y-1.)/Y, out=g1)
+            else:
+                # g1 = 1-(1-eps)/Y + (1-eps)*sqrt(1+(g2-g0-1)/(1-eps)**2)/Y
+                np.subtract(g2, g0, out=g1)
+                np.subtract(g1, 1., out=g1)
+                np.divide(g1, (1-eps)**2., out=g1)
+                np.add(g1, 1., out=g1)
+                np.sqrt(g1, out=g1)
+                np.multiply(g1, 1-eps, out=g1)
+                np.divide(g1, Y, out=g1)
+                np.add(g1, 1.-(1.-eps)/Y, out=g1)
     return g1
 
 
@@ -167,7 +486,8 @@ def calc_q(n, theta, lam):
     return q
 
 
-def msd_local_pwr_law(t, g1, q, bw=0.1, replace_neg=True):
+def msd_local_pwr_law(t, g1, q, bw=0.1, replace_neg=True, diagnostics=None,
+                      workspace=None, full_output=False, t_eval=None):
     """ Calculate the local power-law scaling of the MSD and the
         smoothed MSD by locally-weighted logarithmic linear regression
 
@@ -180,45 +500,152 @@ def msd_local_pwr_law(t, g1, q, bw=0.1, replace_neg=True):
          given by ``t``
     q : float
         Scattering vector in units of 1/nm
-    bw : float, `optional`
+    bw : float or 'gcv', `optional`
            Bandwith smoothing parameter for locally-weighted regression.
-           Reasonable values are typically between 0.05 and 0.1
+           Reasonable values are typically between 0.05 and 0.1. With
+           ``'gcv'``, the bandwidth of ``utils.gcv_alphas`` that minimizes
+           the generalized cross-validation score is used, see
+           ``utils.loess_gcv``
+    diagnostics : CurveDiagnostics, `optional`
+                  Record in which to store the time spent in each stage
+    workspace : utils.Workspace, `optional`
+                Buffers in which to compute the MSD and the local
+                regression. The returned arrays are overwritten by the next
+                call using the same workspace.
+    full_output : boolean, `optional`
+                  If `True`, also return the bandwidth used
+    t_eval : 1d-array, `optional`
+             Time-lags at which to evaluate the local regression of the MSD
+             at the time-lags ``t``, e.g. a short log-spaced grid shared by
+             many measurements. The results are `NaN` at the time-lags
+             outside of the range of ``t``. By default, ``t``
 
 
     Returns
     -------
     msd_smooth: 1d-array
                 Vector of smoothed MSD values from the local regression
-                corresponding to the time lags in ``t`` (in units of nm^2).
+                corresponding to the time lags in ``t`` or ``t_eval`` (in
+                units of nm^2).
     alpha: 1d-array
            Vector of local power-law scaling exponents of the MSD
-           corresponding to the time lags in ``t``.
+           corresponding to the time lags in ``t`` or ``t_eval``.
+    bw : float
+         Only returned if ``full_output`` is `True`. Bandwidth of the
+         local regression, e.g. the one selected with ``'gcv'``
     """
-    msd = -6*np.log(g1)/(q**2.)
+    if workspace is None:
+        workspace = utils.Workspace(len(t))
+    msd = _msd(t, g1, q, replace_neg, diagnostics, workspace)
 
-    # Remove data points with 0, negative, or infinite MSD
-    if replace_neg:
-        if any(msd < 0):
-            print('negative msd values enountered,'
-                  'replacing with interpolation')
-            neg_inds = msd < 0
-            t_pos = t[msd > 0]
-            msd_pos = msd[msd > 0]
-            t_neg = t[neg_inds]
-            msd_interp = np.interp(t_neg, t_pos, msd_pos)
-            msd[neg_inds] = msd_interp
-
-    # Perform a locally-weighted logarithmic linear regression
-    [Theta, log_msd_smooth] = utils.loess(np.log(t), np.log(msd),
-                                          degree=1, alpha=bw)
+    # Perform a locally-weighted logarithmic linear regression, with the
+    # operators cached for the time-lags
+    with diag.stage(diagnostics, 'loess'):
+        log_t = np.log(t, out=workspace.array('log_t', len(t)))
+        log_msd = np.log(msd, out=msd)
+        if bw == 'gcv':
+            bw = utils.loess_gcv(log_t, log_msd)[0]
+        if t_eval is None:
+            [L, H] = utils.loess_operators.get(log_t, 1, bw)
+        else:
+            [L, H] = utils.loess_operators.get(log_t, 1, bw, np.log(t_eval))
+        n_eval = H.shape[0]
+        log_msd_smooth = np.dot(H, log_msd,
+                                out=workspace.array('loess_yp', n_eval))
+        # Define the local power law scaling exponent based
+        # on the logarithmic slopes
+        alpha = np.dot(L[1], log_msd, out=workspace.array('alpha', n_eval))
+    msd_smooth = np.exp(log_msd_smooth,
+                        out=workspace.array('msd_smooth', n_eval))
+    if t_eval is not None:
+        # Do not extrapolate the local power law
+        outside = (t_eval < t[0]) | (t_eval > t[-1])
+        msd_smooth[outside] = np.nan
+        alpha[outside] = np.nan
+    if full_output:
+        return [msd_smooth, alpha, bw]
+    return [msd_smooth, alpha]
+
+
+def _msd(t, g1, q, replace_neg=True, diagnostics=None, workspace=None):
+    """ MSD of ``msd_local_pwr_law`` before the local regression, in the
+    buffer ``'msd'`` of ``workspace`` """
+    if workspace is None:
+        workspace = utils.Workspace(len(t))
+    with diag.stage(diagnostics, 'msd'):
+        # msd = -6*log(g1)/q**2
+        msd = np.log(g1, out=workspace.array('msd', len(t)))
+        np.multiply(msd, -6, out=msd)
+        np.divide(msd, q**2., out=msd)
+
+        # Remove data points with 0, negative, or infinite MSD
+        if replace_neg:
+            _replace_negative_msd(t, msd, diagnostics)
+    return msd
+
+
+def _replace_negative_msd(t, msd, diagnostics=None):
+    """ Replace the negative values of ``msd`` in place by linear
+    interpolation in ``t`` of the positive values, and record them as an
+    event of ``diagnostics`` """
+    neg_inds = msd < 0
+    n_neg = np.count_nonzero(neg_inds)
+    if n_neg:
+        diag.event(diagnostics, 'negative_msd_replaced', n_neg)
+        pos_inds = msd > 0
+        msd[neg_inds] = np.interp(t[neg_inds], t[pos_inds], msd[pos_inds])
+    return msd
+
+
+def msd_bandwidth_sweep(t, g1, q, bws, replace_neg=True, diagnostics=None):
+    """ Local power-law analysis of the MSD, as in ``msd_local_pwr_law``,
+    with each of many bandwidths
+
+    The local regressions for all of the bandwidths share the distances
+    between the time-lags, see ``utils.loess_sweep``. The results can be
+    passed directly to ``shear_modulus`` to compare the moduli obtained
+    with each bandwidth, e.g.::
+
+        [msd_smooth, alpha] = msd_bandwidth_sweep(t, g1, q, bws)
+        [omega, G1, G2] = shear_modulus(t, msd_smooth, alpha, r, T)
+
+    Parameters
+    ----------
+    t : 1d-array
+        Vector of N time-lags
+    g1 : 1d-array
+         Vector containing the intermediate scattering function at time-lags
+         given by ``t``
+    q : float
+        Scattering vector in units of 1/nm
+    bws : 1d-array
+          Vector of B bandwith smoothing parameters for locally-weighted
+          regression
+    replace_neg : boolean, `optional`
+                  Replace negative MSD values by interpolation, as in
+                  ``msd_local_pwr_law``
+    diagnostics : CurveDiagnostics, `optional`
+                  Record in which to store the time spent in each stage
+
+    Returns
+    -------
+    msd_smooth: 2d-array
+                Array of shape ``(B, N)`` of smoothed MSD values (in units
+                of nm^2) for each bandwidth
+    alpha: 2d-array
+           Array of shape ``(B, N)`` of local power-law scaling exponents
+           of the MSD for each bandwidth
+    """
+    msd = _msd(t, g1, q, replace_neg, diagnostics)
+    with diag.stage(diagnostics, 'loess'):
+        [Theta, log_msd_smooth] = utils.loess_sweep(np.log(t), np.log(msd),
+                                                    bws)
     msd_smooth = np.exp(log_msd_smooth)
-    # Define the local power law scaling exponent based
-    # on the logarithmic slopes
-    alpha = Theta[1, :]
+    alpha = Theta[:, 1, :]
     return [msd_smooth, alpha]
 
 
-def calc_msd_raw(t, g1, q, replace_neg=True):
+def calc_msd_raw(t, g1, q, replace_neg=True, diagnostics=None):
     """ Calculate the MSD from the intermediate scattering function.
 
     Parameters
@@ -233,6 +660,8 @@ def calc_msd_raw(t, g1, q, replace_neg=True):
     replace_neg : boolean, `optional`
                   If ``True``, replace negative values of the MSD by linear
                   interpolation
+    diagnostics : CurveDiagnostics, `optional`
+                  Record in which to count the replaced MSD values
 
     Returns
     -------
@@ -240,24 +669,16 @@ def calc_msd_raw(t, g1, q, replace_neg=True):
           Vector of mean-squared-displacements at time-lags ``t``
           (in units of nm^2)
     """
-    msd = 6*np.log(g1)/(q**2.)
+    msd = -6*np.log(g1)/(q**2.)
 
     # Remove data points with 0, negative, or infinite MSD
     if replace_neg:
-        if any(msd < 0):
-            print('negative msd values enountered,'
-                  'replacing with interpolation')
-            neg_inds = msd < 0
-            t_pos = t[msd > 0]
-            msd_pos = msd[msd > 0]
-            t_neg = t[neg_inds]
-            msd_interp = np.interp(t_neg, t_pos, msd_pos)
-            msd[neg_inds] = msd_interp
+        _replace_negative_msd(t, msd, diagnostics)
 
     return msd
 
 
-def shear_modulus(t, msd, alpha, r, T):
+def shear_modulus(t, msd, alpha, r, T, workspace=None):
     """ Calculate Frequency-dependent shear modulus by power-law analysis 
 
     Calculate the frequency-dependent complex shear modulus using results
@@ -269,12 +690,18 @@ def shear_modulus(t, msd, alpha, r, T):
         Time-lags in units of microseconds
     msd : 1d-array
           Mean-squared displacements at the time-lags
-          ``t`` in units of nm^2
-    alpha : 1d-array of local power-law scaling exponents
+          ``t`` in units of nm^2. An array of shape ``(..., N)`` computes
+          the moduli of a stack of MSDs at once, e.g. of many correlation
+          functions or of the bandwidths of ``msd_bandwidth_sweep``
+    alpha : 1d-array of local power-law scaling exponents, with the same
+            shape as ``msd``
     r : float
         Radius of the probe particles in nanometers
     T : float
         Temperature in Kelvin
+    workspace : utils.Workspace, `optional`
+                Buffers in which to compute the moduli. The returned arrays
+                are overwritten by the next call using the same workspace.
 
     Returns
     -------
@@ -282,10 +709,10 @@ def shear_modulus(t, msd, alpha, r, T):
             Vector of angular frequencies in units of 1/s
     G1 : 1d-array
          Storage modulus at angular frequencies ``omega`` in
-         units of Pa
+         units of Pa, with the same shape as ``msd``
     G2 : 1d-array
          Loss modulus at angular frequencies ``omega`` in
-         units of Pa
+         units of Pa, with the same shape as ``msd``
 
     Notes
     -----
@@ -293,19 +720,176 @@ def shear_modulus(t, msd, alpha, r, T):
     lower frequency extremes than a direct numerical Laplace
     or Fourier transform.
     """
+    if workspace is None:
+        workspace = utils.Workspace()
+    shape = np.shape(msd)
+    # The moduli keep the floating point type of the MSD, e.g. that of a
+    # batch analyzed in single precision
+    dtype = np.result_type(msd, alpha)
+    G1 = workspace.array('G1', shape, dtype)
+    G2 = workspace.array('G2', shape, dtype)
+    _shear_modulus(msd, alpha, r, T, G1, G2, workspace)
+    omega = _omega(t, workspace.array('omega', np.shape(t)))
+    return [omega, G1, G2]
+
+
+def _shear_modulus(msd, alpha, r, T, G1, G2, workspace):
+    """ Storage and loss moduli of ``shear_modulus``, computed into the
+    arrays ``G1`` and ``G2`` """
+    shape = np.shape(msd)
     # Boltzman constant
     kb = 1.38e-23
-    # magnitude of the modulus
-    G = (msd**-1.)*1./(np.pi*r*special.gamma(1.+alpha))
-    G = kb*T*(1.e27)*G
+    # magnitude of the modulus, G = kb*T/(msd*pi*r*gamma(1+alpha))
+    den = np.add(alpha, 1., out=workspace.array('G_den', shape, G1.dtype))
+    special.gamma(den, out=den)
+    np.multiply(den, np.pi*r, out=den)
+    G = np.reciprocal(msd, out=workspace.array('G', shape, G1.dtype))
+    np.divide(G, den, out=G)
+    np.multiply(G, kb*T*(1.e27), out=G)
     # Storage G1 and loss G2 moduli
-    G1 = G*np.cos(np.pi*alpha/2.)
-    G2 = G*np.sin(np.pi*alpha/2.)
+    phase = np.multiply(alpha, np.pi, out=den)
+    np.divide(phase, 2., out=phase)
+    np.cos(phase, out=G1)
+    np.multiply(G1, G, out=G1)
+    np.sin(phase, out=G2)
+    np.multiply(G2, G, out=G2)
+    return [G1, G2]
+
+
+def _omega(t, out=None):
+    """ Angular frequencies (in 1/s) corresponding to the time-lags ``t``
+    (in microseconds) """
     # Calculate omega
-    omega = t**-1.
+    omega = np.reciprocal(t, out=out)
     # Convert omega to 1/s
-    omega = omega*(1.e6)
-    return [omega, G1, G2]
+    np.multiply(omega, 1.e6, out=omega)
+    return omega
+
+
+# Rows of the block of results computed by ``dlsur_kernel``
+kernel_rows = ('t', 'msd_smooth', 'alpha', 'omega', 'G1', 'G2', 'msd')
+
+
+def dlsur_kernel(t, g1, q, r, T, bw=0.1, replace_neg=True, omega=None,
+                 raw_msd=False, diagnostics=None, workspace=None, out=None):
+    """ Compute the MSD, its local power-law scaling and the shear modulus
+    from the intermediate scattering function in a single pass
+
+    This gives the same results as ``msd_local_pwr_law`` followed by
+    ``shear_modulus``, but writes every result into the rows of a single
+    block, and only computes the quantities that depend on the time-lags
+    alone (the logarithmic time-lags, the local regression operators and
+    the frequencies) again when the time-lags change between calls with
+    the same ``workspace``.
+
+    Parameters
+    ----------
+    t : 1d-array
+        Vector of N time-lags (in microseconds)
+    g1 : 1d-array
+         Vector containing the intermediate scattering function at time-lags
+         given by ``t``
+    q : float
+        Scattering vector in units of 1/nm
+    r : float
+        Particle radius in nanometers
+    T : float
+        Temperature in Kelvin
+    bw : float or 'gcv', `optional`
+         Bandwith smoothing parameter for locally-weighted regression, see
+         ``msd_local_pwr_law``
+    replace_neg : boolean, `optional`
+                  Replace negative MSD values by interpolation
+    omega : 1d-array, `optional`
+            Angular frequencies (in 1/s) at which to evaluate the results,
+            as in ``full_dlsur_analysis``. By default, the results are
+            evaluated at every time-lag ``t``.
+    raw_msd : boolean, `optional`
+              If `True`, also return the MSD before the local regression.
+              Only available if ``omega`` is not given.
+    diagnostics : CurveDiagnostics, `optional`
+                  Record in which to store the time spent in each stage
+    workspace : utils.Workspace, `optional`
+                Buffers for the intermediate arrays, and the quantities
+                that only depend on the time-lags. Pass the same workspace
+                when analyzing many correlation functions on the same
+                time-lags.
+    out : 2d-array, `optional`
+          Array of shape (6, M), or (7, M) with ``raw_msd``, in which to
+          write the results, where M is the number of time-lags or of
+          frequencies. By default, a new array is allocated.
+
+    Returns
+    -------
+    out : 2d-array
+          Block whose rows are the time-lags, smoothed MSD, local power-law
+          exponents, frequencies, storage and loss moduli, and with
+          ``raw_msd`` the MSD, in the order of ``kernel_rows``
+    bw : float
+         Bandwidth of the local regression, e.g. the one selected with
+         ``'gcv'``
+    """
+    if workspace is None:
+        workspace = utils.Workspace(len(t))
+    if omega is not None:
+        if raw_msd:
+            raise ValueError('raw_msd is only available at the time-lags t')
+        omega = np.asarray(omega, dtype=float)
+    n = len(t)
+    n_eval = n if omega is None else len(omega)
+    n_rows = len(kernel_rows) if raw_msd else len(kernel_rows) - 1
+    if out is None:
+        out = np.empty((n_rows, n_eval))
+    elif out.shape != (n_rows, n_eval) or not out.flags.c_contiguous:
+        raise ValueError('out must be a C-contiguous array of shape '
+                         '(%d, %d)' % (n_rows, n_eval))
+
+    # msd = -6*log(g1)/q**2
+    msd = _msd(t, g1, q, replace_neg, diagnostics, workspace)
+    if raw_msd:
+        out[6] = msd
+
+    with diag.stage(diagnostics, 'loess'):
+        t_key = t.tobytes()
+        log_t = workspace.memo('log_t', t_key, lambda: np.log(t))
+        log_msd = np.log(msd, out=msd)
+        if bw == 'gcv':
+            bw = utils.loess_gcv(log_t, log_msd)[0]
+        omega_key = None if omega is None else omega.tobytes()
+        [H, slope, t_out, omega_out, outside] = workspace.memo(
+            'dlsur_grid', (t_key, bw, omega_key),
+            lambda: _kernel_grid(t, log_t, bw, omega))
+        # Smoothed logarithmic MSD and local power-law exponents
+        np.dot(H, log_msd, out=out[1])
+        np.dot(slope, log_msd, out=out[2])
+    out[0] = t_out
+    out[3] = omega_out
+    np.exp(out[1], out=out[1])
+    if outside is not None:
+        # Do not extrapolate the local power law
+        out[1:3, outside] = np.nan
+
+    # Calculate the shear modulus from the power-law smoothing
+    with diag.stage(diagnostics, 'modulus'):
+        _shear_modulus(out[1], out[2], r, T, out[4], out[5], workspace)
+    return [out, bw]
+
+
+def _kernel_grid(t, log_t, bw, omega=None):
+    """ Local regression operators of the smoothed values and the slopes,
+    time-lags, frequencies and mask of the time-lags outside of ``t`` of
+    ``dlsur_kernel`` """
+    if omega is None:
+        [L, H] = utils.loess_operators.get(log_t, 1, bw)
+        [t_out, omega_out, outside] = [t, _omega(t), None]
+    else:
+        t_out = 1.e6/omega
+        [L, H] = utils.loess_operators.get(log_t, 1, bw, np.log(t_out))
+        omega_out = omega
+        outside = (t_out < t[0]) | (t_out > t[-1])
+        if not outside.any():
+            outside = None
+    return [H, L[1], t_out.copy(), omega_out.copy(), outside]
 
 
 def shear_modulus_laplace_transform(t, msd, r, T, bw=0.01):
@@ -322,10 +906,11 @@ def shear_modulus_laplace_transform(t, msd, r, T, bw=0.01):
         Radius of the probe particles in nanometers
     T : float
         Temperature in Kelvin
-    bw : float, optional
+    bw : float or 'gcv', optional
          Bandwith parameter for analytic continuation of
          the laplace transform into fourier space by locally weighted
-         regression
+         regression. With ``'gcv'``, it is selected by generalized cross
+         validation, see ``msd_local_pwr_law``
 
     Returns
     -------
@@ -355,9 +940,14 @@ def shear_modulus_laplace_transform(t, msd, r, T, bw=0.01):
     # Calculate the G*s in laplace space
     Gs = (msd_laplace**-1.)/(np.pi*r*s)
     # Perform a local power-law analysis of the laplace space shear modulus
-    [Theta, logGs] = utils.loess(np.log(s), np.log(Gs), degree=1, alpha=bw)
+    log_s = np.log(s)
+    log_Gs = np.log(Gs)
+    if bw == 'gcv':
+        bw = utils.loess_gcv(log_s, log_Gs)[0]
+    [L, H] = utils.loess_operators.get(log_s, 1, bw)
+    logGs = H.dot(log_Gs)
     # Calculate the local scaling exponent
-    alpha_direct = Theta[1, :]
+    alpha_direct = L[1].dot(log_Gs)
     G = np.exp(logGs)
     G = kb*T*(1.e27)*G
     # Storage G1 and loss G2 moduli
@@ -371,7 +961,8 @@ def shear_modulus_laplace_transform(t, msd, r, T, bw=0.01):
 
 
 def full_dlsur_analysis(t, corr, ergodic, r, T, q, Ip, Ie,
-                        calc_g1_kws={}, pwr_law_kws={}):
+                        calc_g1_kws={}, pwr_law_kws={}, diagnostics=None,
+                        workspace=None, omega=None, raw_msd=False):
     """ Perform a full microrheology analysis from the correlation function.
 
     This function returns a table reporting particle motion statistics
@@ -409,29 +1000,354 @@ def full_dlsur_analysis(t, corr, ergodic, r, T, q, Ip, Ie,
                   intermediate scattering function
     pwr_law_kws : dictionary, `optional`
                   Dictionary of keyword arguments to pass to
-                  ``analysis_tools.msd_local_pwr_law()`` for local
-                  power-law analysis of the msd
+                  ``analysis_tools.dlsur_kernel()`` for local power-law
+                  analysis of the msd, e.g. ``bw`` and ``replace_neg``
+    diagnostics : CurveDiagnostics, `optional`
+                  Record in which to store the time spent in each stage of
+                  the analysis and count fitting events. See
+                  ``dlsmicro.backend.diagnostics``
+    workspace : utils.Workspace, `optional`
+                Buffers reused for the intermediate arrays of the analysis.
+                Pass the same workspace when analyzing many correlation
+                functions of the same length.
+    omega : 1d-array, `optional`
+            Angular frequencies (in 1/s) at which to report the results,
+            e.g. 40 log-spaced frequencies, so that the results of
+            different measurements are aligned. The local regression is
+            fit to the MSD at every time-lag, and evaluated at the
+            time-lags ``1e6/omega``, see ``msd_local_pwr_law``. By
+            default, the results are reported at every time-lag ``t``.
+    raw_msd : boolean, `optional`
+              If `True`, also report the MSD before the local regression
+              in an `msd` column. Only available if ``omega`` is not given.
 
     Returns
     -------
     dlsmicro_df : DataFrame
                   Dataframe containing table of results from DLS microrheology
-                  analysis
+                  analysis, with one row per time-lag, or per element of
+                  ``omega`` if it is given. The bandwidth of the local
+                  power-law analysis, e.g. the one selected with
+                  ``pwr_law_kws={'bw': 'gcv'}``, is stored in
+                  ``dlsmicro_df.attrs['bw']``.
     """
+    if workspace is None:
+        workspace = utils.Workspace(len(t))
 
     # Find the intermediate scattering function
-    g1 = calc_g1(t, corr, ergodic, Ip=Ip, Ie=Ie, **calc_g1_kws)
+    g1 = calc_g1(t, corr, ergodic, Ip=Ip, Ie=Ie, diagnostics=diagnostics,
+                 workspace=workspace, **calc_g1_kws)
 
-    # Calculate the power-law smoothing of the msd
-    [msd_smooth, alpha] = msd_local_pwr_law(t, g1, q,
-                                            **pwr_law_kws)
+    # Calculate the power-law smoothing of the msd and the shear modulus
+    # into a new block, which the dataframe wraps without copying
+    [block, bw] = dlsur_kernel(t, g1, q, r, T, omega=omega, raw_msd=raw_msd,
+                               diagnostics=diagnostics, workspace=workspace,
+                               **pwr_law_kws)
+    dlsmicro_df = pd.DataFrame(block.T, columns=kernel_rows[:len(block)])
+    dlsmicro_df.attrs['bw'] = bw
 
-    # Calculate the shear modulus from the power-law smoothing
-    [omega, G1, G2] = shear_modulus(t, msd_smooth, alpha, r, T)
+    return dlsmicro_df
 
-    dlsmicro_dict = {'t': t, 'msd_smooth': msd_smooth,
-                     'alpha': alpha, 'omega': omega,
-                     'G1': G1, 'G2': G2}
-    dlsmicro_df = pd.DataFrame(dlsmicro_dict)
 
-    return dlsmicro_df
+def _find_g0_worker(args):
+    """ Estimate the intercept of one correlation function of a batch,
+    possibly in a worker process. ``args`` is
+    ``(t, corr, measured_g0, g0_rtol, budget, method, cv_kws, p0,
+    twindow, record)``, and the time spent and fits are recorded in a new
+    ``CurveDiagnostics`` if ``record`` is ``True``. Returns ``[g0,
+    twindow_min, pmin, diagnostics]``, where ``g0`` is `NaN` and
+    ``twindow_min`` and ``pmin`` are `None` if the search exceeded
+    ``budget``.
+    """
+    [t, corr, measured_g0, g0_rtol, budget, method, cv_kws, p0, twindow,
+     record] = args
+    diagnostics = diag.CurveDiagnostics() if record else None
+    try:
+        fit = _search_g0(t, corr, measured_g0, g0_rtol, diagnostics, budget,
+                         method, cv_kws=cv_kws, p0=p0, twindow=twindow)
+    except utils.BudgetExceeded:
+        fit = [np.nan, None, None]
+    return fit + [diagnostics]
+
+
+def batch_dlsur_analysis(t, corr, ergodic, r, T, q, Ip=None, Ie=None,
+                         g0=None, eps=None, bw=0.1, replace_neg=True,
+                         mask=None, dtype=np.float64, executor=None,
+                         diagnostics=None, labels=None, measured_g0=None,
+                         g0_rtol=0.05, budget=None, g0_method='grid',
+                         g0_cv_kws=None, g0_p0=None, g0_twindow=None):
+    """ Perform a full microrheology analysis of many correlation functions
+    sharing the same time-lags.
+
+    Each row of ``corr`` gives the same result as ``full_dlsur_analysis``,
+    but the intermediate scattering function, the MSD, its local power-law
+    smoothing and the shear modulus are computed with array operations over
+    all of the correlation functions at once. Only the estimation of the
+    intercepts is performed separately for each correlation function, and
+    may be spread over the workers of ``executor``. Correlation functions
+    measured at different time-lags can first be brought onto a shared
+    grid with ``resample_to_lag_grid``.
+
+    Parameters
+    ----------
+    t : 1d-array
+        Vector of N lag-times (in microseconds) shared by all correlation
+        functions
+    corr : 2d-array
+           Array of shape ``(M, N)`` with the correlation coefficient of one
+           correlation function per row
+    ergodic : boolean
+              If ``ergodic==False`` then corrections are applied to the
+              calculation of `g1`, based on ``Ip`` and ``Ie``
+    r : float
+        Particle radius in nanometers
+    T : float
+        Temperature in Kelvin
+    q : float
+        Scattering vector in 1/nm
+    Ip : 1d-array, `optional`
+         Length M vector of scattering intensities at the measurement
+         position of each correlation function
+         (Only used if ``ergodic=False``)
+    Ie : list of 1d-arrays, `optional`
+         Scattering intensities at different positions in the cuvette for
+         each correlation function (Only used if ``ergodic=False``)
+    g0 : float or 1d-array, `optional`
+         Intercepts of the correlation functions. If not provided, they are
+         estimated as in ``calc_g1``.
+    eps : float, `optional`
+          Passed to ``calc_g1`` for non-ergodic samples
+    bw : float, `optional`
+         Bandwith smoothing parameter for the local power-law analysis of
+         the MSD, as in ``msd_local_pwr_law``
+    replace_neg : boolean, `optional`
+                  If ``True``, replace negative values of the MSD by linear
+                  interpolation
+    mask : 2d-array of booleans, `optional`
+           Array of shape ``(M, N)`` which is ``True`` over the contiguous
+           range of time-lags where each correlation function is valid, as
+           returned by ``resample_to_lag_grid``. The results are `NaN`
+           outside of this range.
+    dtype : data-type, `optional`
+            Floating point type of the stacked arrays, e.g. ``np.float32``
+            to halve the memory used by large batches. The frequencies,
+            MSDs, exponents and moduli are returned with this type. The
+            intercept fits, the logarithm of `g1` (which is close to 1 at
+            short time-lags) and the LOESS normal equations are always
+            evaluated in double precision.
+    executor : concurrent.futures.Executor, `optional`
+               Executor whose ``map`` method is used to estimate the
+               intercepts in parallel, e.g. a ``ProcessPoolExecutor``. By
+               default the intercepts are estimated one after the other.
+    diagnostics : StudyDiagnostics, `optional`
+                  Study in which to record the diagnostics of each
+                  correlation function. The time spent in the stages shared
+                  by all correlation functions is divided evenly among them.
+                  In either case, the warnings of each event are only
+                  logged for the first
+                  ``dlsmicro.backend.diagnostics.max_repeats`` curves, which
+                  is set with ``diagnostics.set_verbosity()``.
+    labels : list of str, `optional`
+             Names of the correlation functions in ``diagnostics``
+    measured_g0 : 1d-array, `optional`
+                  Length M vector of intercepts measured by the instrument,
+                  used as in ``calc_g1`` when ``g0`` is not provided
+    g0_rtol : float, `optional`
+              Tolerance of ``check_intercept`` for ``measured_g0``
+    budget : utils.FitBudget, `optional`
+             Limits on the fits used to estimate the intercept of each
+             correlation function. The intercept and results of a
+             correlation function exceeding its limits are `NaN`.
+    g0_method : {'grid', 'golden'}, `optional`
+                Search for the fitting window used to estimate the
+                intercepts, see ``find_g0``
+    g0_cv_kws : dictionary, `optional`
+                Cross-validation strategy used to estimate the intercepts,
+                see ``calc_g1``
+    g0_p0 : 'auto', `optional`
+            Initial guesses of the fits used to estimate the intercepts,
+            see ``calc_g1``
+    g0_twindow : list of floats, `optional`
+                 Fitting window used with ``measured_g0``, see ``calc_g1``
+
+    Returns
+    -------
+    results : dictionary
+              Dictionary with the lag-times `t` and angular frequencies
+              `omega` (1d-arrays of length N), the intercepts `g0`
+              (1d-array of length M), the arrays `msd_smooth`, `alpha`,
+              `G1` and `G2` of shape ``(M, N)``, with the same units as the
+              columns returned by ``full_dlsur_analysis``, and `failed`
+              (boolean 1d-array of length M), which is ``True`` for the
+              correlation functions whose intercept search exceeded
+              ``budget``
+    """
+    corr = np.atleast_2d(corr)
+    n_curves = corr.shape[0]
+    if mask is None:
+        first = np.zeros(n_curves, dtype=int)
+        fit_data = [(t, c) for c in corr]
+    else:
+        first = np.argmax(mask, axis=1)
+        fit_data = [(t[m], c[m]) for c, m in zip(corr, mask)]
+    if diagnostics is None:
+        # Record the batch in a study of its own, so that the warnings of
+        # each event are only logged for the first few curves
+        diagnostics = diag.StudyDiagnostics()
+    if labels is None:
+        labels = ['curve%d' % i for i in range(n_curves)]
+    curves = [diagnostics.new_curve(label) for label in labels]
+    shared = diag.CurveDiagnostics()
+
+    pmin = None
+    if g0 is None:
+        # Estimate the intercept of each correlation function
+        mapper = map if executor is None else executor.map
+        if measured_g0 is None:
+            measured_g0 = [None]*n_curves
+        fits = list(mapper(_find_g0_worker,
+                           [(ti, ci, gi, g0_rtol, budget, g0_method,
+                             g0_cv_kws, g0_p0, g0_twindow, True)
+                            for (ti, ci), gi in zip(fit_data, measured_g0)]))
+        g0 = np.array([fit[0] for fit in fits])
+        failed = np.isnan(g0)
+        # The fit window is empty for the correlation functions that failed
+        [tmin, tmax] = (first[:, None] +
+                        [utils.nearest_index(ti, fit[1])
+                         if fit[1] is not None else [0, 0]
+                         for (ti, ci), fit in zip(fit_data, fits)]).T
+        pmin = np.array([fit[2] if fit[2] is not None else [np.nan]*3
+                         for fit in fits])
+        for curve, fit in zip(curves, fits):
+            curve.merge(fit[3])
+    else:
+        g0 = np.broadcast_to(np.asarray(g0, dtype=float), (n_curves,))
+        failed = np.zeros(n_curves, dtype=bool)
+
+    with diag.stage(shared, 'g1'):
+        g2 = corr.astype(float) + 1.
+        with np.errstate(invalid='ignore'):
+            n_above = np.count_nonzero(corr > g0[:, None], axis=1)
+        if pmin is not None:
+            # Replace the early time data with the fits, as in calc_g1
+            gfit = fit_funcs.stretched_exp(t[None, :], pmin[:, 0:1],
+                                           pmin[:, 1:2], pmin[:, 2:3])
+            lag_inds = np.arange(len(t))
+            window = ((lag_inds >= tmin[:, None]) &
+                      (lag_inds < tmax[:, None]))
+            g2[window] = gfit[window] + 1.
+
+        if ergodic:
+            g1 = np.sqrt((g2-1.)/g0[:, None])
+        else:
+            Ie_avg = np.array([np.average(Ie_i) for Ie_i in Ie])
+            Y = (Ie_avg/np.asarray(Ip, dtype=float))[:, None]
+            if eps is None:
+                g1 = (Y-1.)/Y+np.sqrt(g2-g0[:, None])/Y
+            else:
+                g1 = (1.-(1.-eps)/Y +
+                      (1-eps)*np.sqrt(1. +
+                                      (g2-g0[:, None]-1.)/(1-eps)**2.)/Y)
+    for curve, n in zip(curves, n_above):
+        if n:
+            diag.event(curve, 'corr_above_g0', n)
+
+    with diag.stage(shared, 'msd'):
+        msd = (-6*np.log(g1)/(q**2.)).astype(dtype, copy=False)
+        del g1
+        # Replace negative MSD values curve by curve
+        if replace_neg:
+            for i in np.flatnonzero(np.any(msd < 0, axis=1)):
+                _replace_negative_msd(t, msd[i], curves[i])
+
+    # Perform the locally-weighted logarithmic linear regression of all
+    # of the MSDs with a single operator
+    with diag.stage(shared, 'loess'):
+        [Theta, log_msd_smooth] = utils.loess_batch(np.log(t), np.log(msd),
+                                                    degree=1, alpha=bw,
+                                                    mask=mask)
+    msd_smooth = np.exp(log_msd_smooth)
+    alpha = Theta[:, 1, :]
+
+    with diag.stage(shared, 'modulus'):
+        [omega, G1, G2] = shear_modulus(t, msd_smooth, alpha, r, T)
+    omega = omega.astype(dtype, copy=False)
+
+    for curve in curves:
+        for s, v in shared.timings.items():
+            curve.timings[s] += v/n_curves
+
+    return {'t': t, 'omega': omega, 'g0': g0, 'msd_smooth': msd_smooth,
+            'alpha': alpha, 'G1': G1, 'G2': G2, 'failed': failed}
+
+
+def common_lag_grid(t_list, n_points=None, overlap=False):
+    """ Logarithmically-spaced grid of time-lags shared by many correlation
+    functions
+
+    Parameters
+    ----------
+    t_list : list of 1d-arrays
+             Time-lags of each correlation function
+    n_points : int, `optional`
+               Number of time-lags in the grid. By default, the number of
+               time-lags of the longest correlation function.
+    overlap : boolean, `optional`
+              If ``True``, the grid only spans the time-lags covered by
+              every correlation function. By default, it spans the
+              time-lags covered by any of them.
+
+    Returns
+    -------
+    t_grid : 1d-array
+             Vector of logarithmically-spaced time-lags
+    """
+    t_first = [ti[0] for ti in t_list]
+    t_last = [ti[-1] for ti in t_list]
+    if overlap:
+        [t_min, t_max] = [np.max(t_first), np.min(t_last)]
+    else:
+        [t_min, t_max] = [np.min(t_first), np.max(t_last)]
+    if n_points is None:
+        n_points = max(len(ti) for ti in t_list)
+    return np.logspace(np.log10(t_min), np.log10(t_max), n_points)
+
+
+def resample_to_lag_grid(t_list, corr_list, t_grid=None, n_points=None):
+    """ Resample correlation functions measured at different time-lags
+    onto a shared grid of time-lags
+
+    The correlation functions are linearly interpolated in the logarithm
+    of the time-lag, so that the resulting dense array can be passed to
+    ``batch_dlsur_analysis``.
+
+    Parameters
+    ----------
+    t_list : list of 1d-arrays
+             Increasing time-lags of each of the M correlation functions,
+             e.g. after truncation
+    corr_list : list of 1d-arrays
+                Correlation coefficients at the time-lags in ``t_list``
+    t_grid : 1d-array, `optional`
+             Shared time-lags. By default, ``common_lag_grid(t_list,
+             n_points)``.
+    n_points : int, `optional`
+               Number of time-lags in the default grid
+
+    Returns
+    -------
+    t_grid : 1d-array
+             Vector of N shared time-lags
+    corr : 2d-array
+           Array of shape ``(M, N)`` of resampled correlation coefficients,
+           which are `NaN` outside of the time-lags measured for each
+           correlation function
+    mask : 2d-array of booleans
+           Array of shape ``(M, N)`` which is ``True`` where each
+           correlation function was measured
+    """
+    if t_grid is None:
+        t_grid = common_lag_grid(t_list, n_points)
+    [corr, mask] = utils.interp_stack([np.log(ti) for ti in t_list],
+                                      corr_list, np.log(t_grid))
+    return [t_grid, corr, mask]
@@ -0,0 +1,277 @@
+""" Module for recording where time is spent in the DLS microrheology
+analysis of each correlation function, and for logging the events that
+occur during the analysis"""
+import logging
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+# Stages of the analysis of a single correlation function
+stages = ('parse', 'g0_search', 'g1', 'msd', 'loess', 'modulus',
+          'laplace', 'merge')
+
+# Events counted during the analysis of a single correlation function
+counters = ('curve_fit_calls', 'cv_window_evaluations', 'maxfev_exhausted',
+            'cv_point_penalties', 'cv_window_penalties', 'corr_above_g0',
+            'negative_msd_replaced', 'measured_g0_used',
+            'measured_g0_rejected', 'fit_timeouts', 'budget_exceeded')
+
+# Descriptions of the events that are logged as warnings
+events = {'corr_above_g0': 'correlation values above the intercept',
+          'negative_msd_replaced': 'negative MSD values replaced by '
+                                   'interpolation',
+          'maxfev_exhausted': 'fits that reached maxfev',
+          'measured_g0_rejected': 'measured intercepts rejected',
+          'budget_exceeded': 'intercept searches that exceeded the fit '
+                             'budget'}
+
+logger = logging.getLogger(__name__)
+
+# Number of warnings logged for each event in a study before the remaining
+# occurences are only logged at the DEBUG level
+max_repeats = 3
+
+# Number of occurences of each event logged for curves analyzed outside of
+# a study, which are throttled together
+_logged = dict((e, 0) for e in events)
+
+
+class CurveDiagnostics(object):
+    """ Wall time spent in each stage of the analysis, and counts of
+    fitting events, for a single correlation function
+
+    Parameters
+    ----------
+    label : str, `optional`
+            Name identifying the correlation function, e.g. the condition
+            and replicate
+    study : StudyDiagnostics, `optional`
+            Study to which the correlation function belongs, as set by
+            ``StudyDiagnostics.new_curve()``. ``event()`` only logs the
+            first ``max_repeats`` occurences of each event in a study as
+            warnings. Without a study, the events of every curve analyzed
+            outside of a study are throttled together, until
+            ``set_verbosity()`` is called.
+
+    Attributes
+    ----------
+    timings : dictionary
+              Wall time (in seconds) spent in each of ``stages``
+    counts : dictionary
+             Number of occurences of each of ``counters``
+    """
+
+    def __init__(self, label=None, study=None):
+        self.label = label
+        self.study = study
+        self.timings = dict((s, 0.) for s in stages)
+        self.counts = dict((c, 0) for c in counters)
+
+    @property
+    def total_time(self):
+        """ Total wall time (in seconds) spent in all stages """
+        return sum(self.timings.values())
+
+    def merge(self, other):
+        """ Add the timings and counts of another record, e.g. one filled
+        in by a worker process, to this record """
+        for s, v in other.timings.items():
+            self.timings[s] += v
+        for c, v in other.counts.items():
+            self.counts[c] += v
+
+    def to_dict(self):
+        """ Flatten the timings and counts into a single dictionary """
+        record = {'label': self.label}
+        record.update(('time_%s' % s, v) for s, v in self.timings.items())
+        record['time_total'] = self.total_time
+        record.update(self.counts)
+        return record
+
+
+class StudyDiagnostics(object):
+    """ Collection of ``CurveDiagnostics`` for every correlation function
+    analyzed in a study
+
+    Pass an instance to one of the ``analyze_*`` drivers to record the
+    diagnostics of every replicate or time point it analyzes.
+    """
+
+    def __init__(self):
+        self.curves = []
+        self.logged = dict((e, 0) for e in events)
+
+    def new_curve(self, label=None):
+        """ Start recording the diagnostics of a new correlation function
+
+        Parameters
+        ----------
+        label : str, `optional`
+                Name identifying the correlation function
+
+        Returns
+        -------
+        curve : CurveDiagnostics
+                Record to pass to the analysis functions
+        """
+        curve = CurveDiagnostics(label, study=self)
+        self.curves.append(curve)
+        return curve
+
+    def to_dataframe(self):
+        """ Table of the diagnostics with one row per correlation function
+
+        Returns
+        -------
+        df : DataFrame
+             Dataframe with a `label` column, a `time_<stage>` column for
+             each of ``stages``, a `time_total` column and a column for each
+             of ``counters``
+        """
+        columns = (['label'] + ['time_%s' % s for s in stages] +
+                   ['time_total'] + list(counters))
+        return pd.DataFrame([c.to_dict() for c in self.curves],
+                            columns=columns)
+
+    def summary(self):
+        """ Aggregate the diagnostics over all correlation functions
+
+        Returns
+        -------
+        summary : DataFrame
+                  Dataframe indexed by the timing and counter columns of
+                  ``to_dataframe()``, with their total, mean, median and
+                  maximum over the study
+        """
+        df = self.to_dataframe().drop(columns='label')
+        return df.agg(['sum', 'mean', 'median', 'max']).T
+
+    def outliers(self, factor=10.):
+        """ Find correlation functions that took much longer to analyze
+        than is typical for the study
+
+        Parameters
+        ----------
+        factor : float, `optional`
+                 Correlation functions whose total analysis time is more
+                 than ``factor`` times the median are returned
+
+        Returns
+        -------
+        df : DataFrame
+             Rows of ``to_dataframe()`` for the slow correlation functions,
+             slowest first
+        """
+        df = self.to_dataframe()
+        slow = df['time_total'] > factor*np.median(df['time_total'])
+        return df[slow].sort_values('time_total', ascending=False)
+
+    def log_summary(self):
+        """ Log the number of correlation functions affected by each event
+        as a warning, and the total analysis time at the INFO level """
+        if not self.curves:
+            return
+        df = self.to_dataframe()
+        n = len(df)
+        for e, description in events.items():
+            n_affected = np.count_nonzero(df[e] > 0)
+            if n_affected:
+                logger.warning('%d/%d curves had %s', n_affected, n,
+                               description)
+        slowest = df.loc[df['time_total'].idxmax()]
+        logger.info('Analyzed %d curves in %.3g s (median %.3g s, slowest '
+                    '%.3g s for %s)', n, df['time_total'].sum(),
+                    np.median(df['time_total']), slowest['time_total'],
+                    slowest['label'])
+
+
+@contextmanager
+def stage(diagnostics, name):
+    """ Context manager adding the wall time of the enclosed block to a
+    stage of ``diagnostics``. Does nothing if ``diagnostics`` is `None`. """
+    if diagnostics is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        diagnostics.timings[name] += time.perf_counter() - t0
+
+
+def count(diagnostics, name, n=1):
+    """ Add ``n`` occurences of an event to a counter of ``diagnostics``.
+    Does nothing if ``diagnostics`` is `None`. """
+    if diagnostics is not None:
+        diagnostics.counts[name] += n
+
+
+def event(diagnostics, name, n=1):
+    """ Count an event in ``diagnostics`` and log it as a warning
+
+    Within a study, only the first ``max_repeats`` curves with each event
+    are logged as warnings, and the rest are logged at the DEBUG level.
+    ``StudyDiagnostics.log_summary()`` reports the total. The events of
+    curves analyzed outside of a study, e.g. by ``full_dlsur_analysis()``
+    without ``diagnostics``, are throttled in the same way, over all of
+    them.
+
+    Parameters
+    ----------
+    diagnostics : CurveDiagnostics or `None`
+                  Record of the curve in which the event occured
+    name : str
+           Name of the event, one of ``events``
+    n : int, `optional`
+        Number of occurences of the event, e.g. the number of values
+        replaced
+    """
+    count(diagnostics, name, n)
+    level = logging.WARNING
+    label = None
+    study = None
+    if diagnostics is not None:
+        label = diagnostics.label
+        study = diagnostics.study
+    logged = _logged if study is None else study.logged
+    logged[name] += 1
+    n_logged = logged[name]
+    if n_logged > max_repeats:
+        level = logging.DEBUG
+    if label is None:
+        logger.log(level, '%d %s', n, events[name])
+    else:
+        logger.log(level, '%s: %d %s', label, n, events[name])
+    if n_logged == max_repeats:
+        if study is None:
+            logger.warning('Further messages for %s are suppressed, until '
+                           'set_verbosity() is called', events[name])
+        else:
+            logger.warning('Further messages for %s are suppressed in this '
+                           'study', events[name])
+
+
+def set_verbosity(level=logging.WARNING, repeats=3):
+    """ Configure how much the analysis logs
+
+    Parameters
+    ----------
+    level : int, `optional`
+            Logging level of the `dlsmicro` logger, e.g. ``logging.INFO``
+            to also log the analysis time of each study, or
+            ``logging.ERROR`` to silence warnings
+    repeats : int, `optional`
+              Number of curves in a study, or outside of any study, for
+              which each event is logged individually as a warning. The
+              count of the events of curves outside of a study restarts.
+    """
+    global max_repeats
+    package_logger = logging.getLogger('dlsmicro')
+    package_logger.setLevel(level)
+    # Without a handler, only warnings would reach the terminal
+    if not package_logger.handlers and not logging.getLogger().handlers:
+        package_logger.addHandler(logging.StreamHandler())
+    max_repeats = repeats
+    for e in _logged:
+        _logged[e] = 0
@@ -9,3 +9,39 @@ def stretched_exp(x, x0, a, beta):
 # 'exp exp' decay function
 def expexp(x, a0, a1, lam, beta):
     return a0*np.exp(-a1*(1-np.exp(-lam*x**beta)))
+
+
+
+# initial guess [x0, a, beta] of the parameters of the stretched exponential.
+# a and beta are found by a linear regression of log(-log(y/x0)) against
+# log(x), weighted by the sensitivity of log(-log(y/x0)) to noise in y.
+# Starting from x0 = y[0], x0 is then refined by a linear regression of
+# log(y) against x**beta, and the two regressions are alternated.
+def stretched_exp_guess(x, y, x0=None, n_iter=10):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if x0 is None:
+        x0 = y[0]
+    p0 = [x0, 1.0e-2, 1.0]
+    positive = (x > 0.) & (y > 0.)
+    for i in range(n_iter + 1):
+        ratio = y/x0
+        valid = positive & (ratio < 1.)
+        if np.count_nonzero(valid) < 2:
+            break
+        log_ratio = np.log(ratio[valid])
+        [beta, log_a] = np.polyfit(np.log(x[valid]), np.log(-log_ratio), 1,
+                                   w=np.abs(ratio[valid]*log_ratio))
+        if not (np.isfinite(beta) and np.isfinite(log_a)) or beta <= 0.:
+            break
+        p0 = [x0, np.exp(log_a), beta]
+        if i == n_iter:
+            break
+        # refine x0 from log(y) = log(x0) - a*x**beta
+        X = np.vstack([np.ones(np.count_nonzero(positive)),
+                       -x[positive]**beta]).T
+        [log_x0, a] = np.linalg.lstsq(X, np.log(y[positive]), rcond=None)[0]
+        if not (np.isfinite(log_x0) and a > 0.):
+            break
+        x0 = np.exp(log_x0)
+    return p0
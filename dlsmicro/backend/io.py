@@ -1,6 +1,10 @@
 """ Module for parsing data exported from Zetasizer software"""
+import os
+import time
+from io import StringIO
 import pandas as pd
 import numpy as np
+from dlsmicro.backend import utils
 
 # Columns name order for the dlsmicro_export.edf template
 default_column_order = ['Record', 'Sample Name', 'Measurement Position',
@@ -79,6 +83,12 @@ def read_zetasizer_csv_to_dict(file_path, row,
                            corresponding to
                            the scattering intensities in
                            ``data_dict['ensemble_intensity']``
+    'measured_intercept' : float
+                           Intercept of the correlation function measured
+                           by the Zetasizer software, or `NaN` if it is not
+                           exported. It can be passed to
+                           ``analysis_tools.calc_g1()`` as ``measured_g0``
+                           to skip the search for the intercept.
 
     Notes
     -----
@@ -118,37 +128,267 @@ def read_zetasizer_csv_to_dict(file_path, row,
     if intensities_rows is None:
         intensities_rows = range(row + 1, len(df))
 
+    # Get scattering intensity and positions for the ensemble
+    Ie = df.iloc[intensities_rows]['Derived Count Rate']
+    epos = df.iloc[intensities_rows]['Measurement Position']
+
+    data_dict = parse_zetasizer_record(df.iloc[row], Ie, epos,
+                                       use_zetasizer_g1=use_zetasizer_g1)
+    return data_dict
+
+
+def parse_zetasizer_record(record, ensemble_intensities=None,
+                           ensemble_positions=None, use_zetasizer_g1=True):
+    """ Parse a single measurement record exported from the Zetasizer
+    software to a dictionary containing data relevant to DLS
+    microrheology analysis
+
+    Parameters
+    ----------
+    record : Series
+             Row of the exported .csv file, indexed by the column names
+             (see ``dlsmicro.io.default_column_order``)
+    ensemble_intensities : 1d-array, `optional`
+                           Vector of scattering intensities at different
+                           positions in the cuvette
+    ensemble_positions : 1d-array, `optional`
+                         Vector of measurement positions in the cuvette
+                         corresponding to ``ensemble_intensities``
+    use_zetasizer_g1 : boolean, `optional`
+                       If `True`, the `g1` and measured baseline exported by
+                       the Zetasizer software are used to calculate the
+                       correlation function. See
+                       ``read_zetasizer_csv_to_dict()``
+
+    Returns
+    -------
+    data_dict : dictionary
+                Python dictionary with the same keys as returned by
+                ``read_zetasizer_csv_to_dict()``
+    """
     g = np.array(
-        [float(i) for i in df.iloc[row]['Correlation Data'].split(',')])
+        [float(i) for i in record['Correlation Data'].split(',')])
     t = np.array(
-        [float(i) for i in df.iloc[row]['Correlation Delay Times'].split(',')])
-    # Get the g1 correlation function data from zetasizer, which is
-    # more precise than g2
-    tfit = np.array(
-        [float(i) for i in df.iloc[row]
-         ['Distribution Fit Delay Times'].split(',')])
-    g1fit = np.array(
-        [float(i) for i in df.iloc[row]
-         ['Distribution Fit Data'].split(',')])
-
-    B = df.iloc[row]['Measured Baseline']
-    # Get scattering intensity for the row of interest and
-    # the ensemble
-    Ie = df.iloc[intensities_rows]['Derived Count Rate']
-    Ip = df.iloc[row]['Derived Count Rate']
+        [float(i) for i in record['Correlation Delay Times'].split(',')])
 
-    point_pos = df.iloc[row]['Measurement Position']
-    epos = df.iloc[intensities_rows]['Measurement Position']
+    # Get scattering intensity for the record of interest
+    Ip = record['Derived Count Rate']
+    point_pos = record['Measurement Position']
     g = np.copy(g)
 
     # Replace g with the data obtained from the g1 correlation
     # function where the data exists
     if use_zetasizer_g1:
+        # Get the g1 correlation function data from zetasizer, which is
+        # more precise than g2
+        tfit = np.array(
+            [float(i) for i in record['Distribution Fit Delay Times'].split(',')])
+        g1fit = np.array(
+            [float(i) for i in record['Distribution Fit Data'].split(',')])
+        B = record['Measured Baseline']
         gadj = B + g1fit**2.
-        tinds = [np.argmin(np.abs(t-ti)) for ti in tfit]
+        tinds = utils.nearest_index(t, tfit)
         g[tinds] = gadj
 
     data_dict = {'time_lag': t, 'correlation': g, 'point_intensity': Ip,
-                 'ensemble_intensities': Ie, 'point_position': point_pos,
-                 'ensemble_positions': epos}
+                 'ensemble_intensities': ensemble_intensities,
+                 'point_position': point_pos,
+                 'ensemble_positions': ensemble_positions,
+                 'measured_intercept': float(record.get('Measured Intercept',
+                                                        np.nan))}
     return data_dict
+
+
+def follow_zetasizer_csv(file_path, start_row=0,
+                         column_order=default_column_order,
+                         poll_interval=1.0, timeout=None):
+    """ Follow a csv file exported from the Zetasizer software as the
+    instrument appends records to it, yielding each new record
+
+    Only the bytes appended since the last poll are read and parsed, so
+    the cost of each new record does not grow with the size of the file.
+    A record is only yielded once its line has been terminated, so
+    partially written lines are never parsed.
+
+    Parameters
+    ----------
+    file_path : str
+                Path to the .csv file to be followed. The file does not
+                need to exist yet.
+    start_row : int, `optional`
+                Row number (0-indexed) of the first record to yield. Earlier
+                records are read but skipped.
+    column_order : list of str, `optional`
+                   Ordered list names for the columns in the .csv file.
+                   See ``dlsmicro.io.default_column_order``
+    poll_interval : float, `optional`
+                    Time (in seconds) to wait between checks for new data
+    timeout : float, `optional`
+              Stop following once no new record has been appended for
+              this many seconds. If ``None``, follow the file indefinitely.
+
+    Yields
+    ------
+    row : int
+          Row number (0-indexed) of the record in the .csv file
+    record : Series
+             The record, indexed by the column names in ``column_order``.
+             Pass this to ``parse_zetasizer_record()`` to obtain a data
+             dictionary.
+    """
+    offset = 0
+    row = 0
+    pending = ''
+    last_update = time.time()
+    while True:
+        lines = []
+        if os.path.exists(file_path):
+            with open(file_path, 'r') as f:
+                f.seek(offset)
+                chunk = f.read()
+                offset = f.tell()
+            pending = pending + chunk
+            # Hold back the trailing line until the instrument terminates it
+            complete = pending.rfind('\n') + 1
+            lines = [l for l in pending[:complete].splitlines() if l.strip()]
+            pending = pending[complete:]
+
+        if lines:
+            last_update = time.time()
+            df = pd.read_csv(StringIO('\n'.join(lines)), header=None,
+                             names=column_order)
+            for i in range(len(df)):
+                if row >= start_row:
+                    yield row, df.iloc[i]
+                row += 1
+        elif timeout is not None and time.time() - last_update > timeout:
+            return
+        else:
+            time.sleep(poll_interval)
+
+
+def scattering_table(ensemble_intensities, ensemble_positions, **keys):
+    """ Tabulate the scattering intensities of the position scan of a
+    sample in long format, one row per measurement position
+
+    Parameters
+    ----------
+    ensemble_intensities : 1d-array
+                           Vector of scattering intensities at different
+                           positions in the cuvette
+    ensemble_positions : 1d-array
+                         Vector of measurement positions corresponding to
+                         ``ensemble_intensities``
+    **keys
+        Columns identifying the sample, e.g. ``id=0, condition='cond1'``
+
+    Returns
+    -------
+    scattering_df : DataFrame
+                    Dataframe with a column for each of ``keys``, the
+                    position `epos` and the intensity `scattering`
+    """
+    if ensemble_intensities is None:
+        ensemble_intensities = []
+        ensemble_positions = []
+    scattering_df = pd.DataFrame(
+        {'epos': np.asarray(ensemble_positions, dtype=float),
+         'scattering': np.asarray(ensemble_intensities, dtype=float)})
+    for i, (column, value) in enumerate(keys.items()):
+        scattering_df.insert(i, column, value)
+    return scattering_df
+
+
+def scattering_table_path(df_path):
+    """ Path at which the ``analyze_*`` drivers save the table of
+    scattering intensities next to the results Dataframe ``df_path``"""
+    return '%s_scattering.pkl' % os.path.splitext(df_path)[0]
+
+
+def downcast_results(df, dtype=np.float32):
+    """ Convert the numerical columns of a Dataframe of results to compact
+    types for storage
+
+    Columns of numbers stored as objects are converted to numerical
+    types, and floating point columns are converted to ``dtype``. Other
+    columns, e.g. the condition names, are left unchanged.
+
+    Parameters
+    ----------
+    df : DataFrame
+         Dataframe of results from DLS microrheology analysis
+    dtype : data-type, `optional`
+            Floating point type in which to store the results. The
+            correlation data exported by the Zetasizer only carries 3
+            significant digits, so ``np.float32`` loses no information.
+
+    Returns
+    -------
+    df : DataFrame
+         Copy of ``df`` with compact column types
+    """
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if values.dtype == object:
+            try:
+                values = pd.to_numeric(values)
+            except (ValueError, TypeError):
+                continue
+        if np.issubdtype(values.dtype, np.floating):
+            values = values.astype(dtype)
+        df[column] = values
+    return df
+
+
+def save_results(save_path, df, scattering_df, dtype=None):
+    """ Save the Dataframe of results of a study, and the table of
+    scattering intensities next to it, as done by the ``analyze_*``
+    drivers
+
+    Parameters
+    ----------
+    save_path : str
+                Path of the pickled results Dataframe. The scattering table
+                is saved to ``scattering_table_path(save_path)``.
+    df : DataFrame
+         Dataframe of results from DLS microrheology analysis
+    scattering_df : DataFrame
+                    Table of scattering intensities, see
+                    ``scattering_table``
+    dtype : data-type, `optional`
+            If given, the numerical columns are converted to this floating
+            point type, see ``downcast_results``
+    """
+    if dtype is not None:
+        df = downcast_results(df, dtype)
+        scattering_df = downcast_results(scattering_df, dtype)
+    df.to_pickle(save_path)
+    scattering_df.to_pickle(scattering_table_path(save_path))
+
+
+def save_results_as_text(save_dir, dlsmicro_df, scattering_df,
+                         columns=None):
+    """ Save each column of the results of a single measurement, and of
+    its table of scattering intensities, as a separate text file
+
+    Parameters
+    ----------
+    save_dir : str
+               Directory in which to save the files, which are named after
+               the columns
+    dlsmicro_df : DataFrame
+                  Results of the measurement
+    scattering_df : DataFrame
+                    Table of scattering intensities, see
+                    ``scattering_table``
+    columns : list of str, `optional`
+              Columns of ``dlsmicro_df`` to save. By default, all of them.
+    """
+    if columns is None:
+        columns = dlsmicro_df.columns
+    for column in columns:
+        np.savetxt(os.path.join(save_dir, column), dlsmicro_df[column].values)
+    for column in ['scattering', 'epos']:
+        np.savetxt(os.path.join(save_dir, column),
+                   scattering_df[column].values)
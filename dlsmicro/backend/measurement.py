@@ -0,0 +1,402 @@
+""" Module for holding a DLS measurement together with the results of its
+microrheology analysis, which are computed when first accessed"""
+from collections import OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+import numpy as np
+import pandas as pd
+from dlsmicro.backend import analysis_tools
+from dlsmicro.backend import diagnostics as diag
+from dlsmicro.backend import io
+from dlsmicro.backend import utils
+from dlsmicro.backend.pipeline import default_q
+
+
+def _cached(func):
+    """ Property computed by ``func`` on first access and stored in the
+    ``_cache`` of the instance """
+    name = func.__name__
+
+    def getter(self):
+        if name not in self._cache:
+            self._cache[name] = func(self)
+        return self._cache[name]
+    getter.__doc__ = func.__doc__
+    return property(getter)
+
+
+class Measurement(object):
+    """ Correlation function of a single DLS measurement and the results of
+    its microrheology analysis
+
+    The intermediate scattering function, MSD and shear modulus are
+    computed the first time they are accessed, following the same steps
+    as ``analysis_tools.full_dlsur_analysis``, and are then cached. Only
+    the quantities that are used are computed.
+
+    Parameters
+    ----------
+    t : 1d-array
+        Vector of lag-times (in microseconds)
+    corr : 1d-array
+           Correlation coefficient at the time-lags ``t``
+    ergodic : boolean
+              If ``False``, corrections for broken ergodicity are applied
+              based on ``Ip`` and ``Ie``
+    r : float
+        Particle radius in nanometers
+    T : float
+        Temperature in Kelvin
+    q : float, `optional`
+        Scattering vector in 1/nm. By default, that of the Zetasizer.
+    Ip : float, `optional`
+         Scattering intensity at the measurement position
+    Ie : 1d-array, `optional`
+         Scattering intensities at different positions in the cuvette
+    point_position : float, `optional`
+                     Measurement position in the cuvette (in mm)
+    ensemble_positions : 1d-array, `optional`
+                         Measurement positions corresponding to ``Ie``
+    Laplace : boolean, `optional`
+              If `True`, the shear modulus is merged with the modulus from
+              the direct Laplace transform of the MSD, as in the
+              ``analyze_*`` drivers
+    label : str, `optional`
+            Name identifying the measurement
+    calc_g1_kws : dictionary, `optional`
+                  Keyword arguments to pass to ``analysis_tools.calc_g1()``
+    pwr_law_kws : dictionary, `optional`
+                  Keyword arguments to pass to
+                  ``analysis_tools.msd_local_pwr_law()``
+    diagnostics : CurveDiagnostics, `optional`
+                  Record in which to store the time spent in each stage
+
+    Notes
+    -----
+    The cached results are not updated if the attributes are changed
+    afterwards. Call ``clear_cache()`` to recompute them.
+    """
+
+    __slots__ = ('t', 'corr', 'ergodic', 'r', 'T', 'q', 'Ip', 'Ie',
+                 'point_position', 'ensemble_positions', 'Laplace', 'label',
+                 'calc_g1_kws', 'pwr_law_kws', 'diagnostics', '_cache')
+
+    def __init__(self, t, corr, ergodic, r, T, q=default_q, Ip=None,
+                 Ie=None, point_position=None, ensemble_positions=None,
+                 Laplace=False, label=None, calc_g1_kws=None,
+                 pwr_law_kws=None, diagnostics=None):
+        self.t = t
+        self.corr = corr
+        self.ergodic = ergodic
+        self.r = r
+        self.T = T
+        self.q = q
+        self.Ip = Ip
+        self.Ie = Ie
+        self.point_position = point_position
+        self.ensemble_positions = ensemble_positions
+        self.Laplace = Laplace
+        self.label = label
+        self.calc_g1_kws = calc_g1_kws or {}
+        self.pwr_law_kws = pwr_law_kws or {}
+        self.diagnostics = diagnostics
+        self._cache = {}
+
+    @classmethod
+    def from_data_dict(cls, data_dict, ergodic, r, T, truncate=True,
+                       measured_intercept=False, n_bins=None, **kws):
+        """ Create a measurement from a data dictionary returned by
+        ``io.read_zetasizer_csv_to_dict()``
+
+        Parameters
+        ----------
+        data_dict : dictionary
+                    Data dictionary of the measurement
+        ergodic : boolean
+                  Ergodicity of the sample
+        r : float
+            Particle radius in nanometers
+        T : float
+            Temperature in Kelvin
+        truncate : boolean, `optional`
+                   If `True`, truncate the correlation function with
+                   ``analysis_tools.truncate_correlation()``
+        measured_intercept : boolean, `optional`
+                             If `True`, pass the intercept measured by the
+                             Zetasizer software to
+                             ``analysis_tools.calc_g1()`` as ``measured_g0``
+        n_bins : int, `optional`
+                 If given, average the (truncated) correlation function
+                 into at most ``n_bins`` log-spaced bins of time-lag with
+                 ``analysis_tools.log_bin_correlation()``, so that the
+                 analysis runs on a controlled number of points
+        **kws
+            Other keyword arguments of ``Measurement``
+
+        Returns
+        -------
+        measurement : Measurement
+        """
+        if measured_intercept:
+            kws['calc_g1_kws'] = dict(kws.get('calc_g1_kws') or {},
+                                      measured_g0=data_dict[
+                                          'measured_intercept'])
+        t = data_dict['time_lag']
+        corr = data_dict['correlation']
+        if truncate:
+            [t, corr] = analysis_tools.truncate_correlation(t, corr)
+        if n_bins is not None:
+            [t, corr] = analysis_tools.log_bin_correlation(t, corr,
+                                                           n_bins)[0:2]
+        return cls(t, corr, ergodic, r, T,
+                   Ip=data_dict['point_intensity'],
+                   Ie=data_dict['ensemble_intensities'],
+                   point_position=data_dict['point_position'],
+                   ensemble_positions=data_dict['ensemble_positions'],
+                   **kws)
+
+    @classmethod
+    def from_zetasizer_csv(cls, file_path, ergodic, r, T, row=0,
+                           truncate=True, measured_intercept=False,
+                           n_bins=None, **kws):
+        """ Read a measurement from a csv file exported from the Zetasizer
+        software
+
+        Parameters
+        ----------
+        file_path : str
+                    Path to the .csv file
+        ergodic : boolean
+                  Ergodicity of the sample
+        r : float
+            Particle radius in nanometers
+        T : float
+            Temperature in Kelvin
+        row : int, `optional`
+              Row number (0-indexed) of the measurement record
+        truncate : boolean, `optional`
+                   If `True`, truncate the correlation function with
+                   ``analysis_tools.truncate_correlation()``
+        measured_intercept : boolean, `optional`
+                             If `True`, use the intercept measured by the
+                             Zetasizer software, as in ``from_data_dict()``
+        n_bins : int, `optional`
+                 If given, bin the correlation function into log-spaced
+                 bins of time-lag, as in ``from_data_dict()``
+        **kws
+            Other keyword arguments of ``Measurement``
+
+        Returns
+        -------
+        measurement : Measurement
+        """
+        with diag.stage(kws.get('diagnostics'), 'parse'):
+            data_dict = io.read_zetasizer_csv_to_dict(file_path, row)
+        return cls.from_data_dict(data_dict, ergodic, r, T, truncate,
+                                  measured_intercept, n_bins, **kws)
+
+    def clear_cache(self):
+        """ Discard the computed results """
+        self._cache.clear()
+
+    @_cached
+    def g1(self):
+        """ Intermediate scattering function at the time-lags ``t`` """
+        return analysis_tools.calc_g1(self.t, self.corr, self.ergodic,
+                                      Ip=self.Ip, Ie=self.Ie,
+                                      diagnostics=self.diagnostics,
+                                      **self.calc_g1_kws)
+
+    @_cached
+    def _power_law(self):
+        return analysis_tools.msd_local_pwr_law(self.t, self.g1, self.q,
+                                                diagnostics=self.diagnostics,
+                                                full_output=True,
+                                                **self.pwr_law_kws)
+
+    @property
+    def msd(self):
+        """ Smoothed mean-squared displacement (in nm^2) at the time-lags
+        ``t`` """
+        return self._power_law[0]
+
+    @property
+    def alpha(self):
+        """ Local power-law scaling exponent of the MSD at the time-lags
+        ``t`` """
+        return self._power_law[1]
+
+    @property
+    def bw(self):
+        """ Bandwidth of the local power-law analysis of the MSD, e.g. the
+        one selected with ``pwr_law_kws={'bw': 'gcv'}`` """
+        return self._power_law[2]
+
+    @_cached
+    def _modulus(self):
+        with diag.stage(self.diagnostics, 'modulus'):
+            [omega, G1, G2] = analysis_tools.shear_modulus(
+                self.t, self.msd, self.alpha, self.r, self.T)
+        if self.Laplace:
+            with diag.stage(self.diagnostics, 'laplace'):
+                [omega_L, G1_L, G2_L] = \
+                    analysis_tools.shear_modulus_laplace_transform(
+                        self.t, self.msd, self.r, self.T)
+            with diag.stage(self.diagnostics, 'merge'):
+                [G1, G2] = utils.laplace_merge(omega, G1, G2, G1_L, G2_L)
+        return [omega, G1, G2]
+
+    @property
+    def omega(self):
+        """ Angular frequencies (in 1/s) of the shear modulus """
+        return self._modulus[0]
+
+    @property
+    def G1(self):
+        """ Storage modulus (in Pa) at the angular frequencies ``omega`` """
+        return self._modulus[1]
+
+    @property
+    def G2(self):
+        """ Loss modulus (in Pa) at the angular frequencies ``omega`` """
+        return self._modulus[2]
+
+    def to_dataframe(self):
+        """ Table of results with the same columns as returned by
+        ``analysis_tools.full_dlsur_analysis()``
+
+        Returns
+        -------
+        dlsmicro_df : DataFrame
+        """
+        df = pd.DataFrame({'t': self.t, 'msd_smooth': self.msd,
+                           'alpha': self.alpha, 'omega': self.omega,
+                           'G1': self.G1, 'G2': self.G2})
+        df.attrs['bw'] = self.bw
+        return df
+
+    def __repr__(self):
+        return '<Measurement %s: %d time-lags, computed %s>' % (
+            self.label, len(self.t), sorted(self._cache))
+
+
+class Study(Mapping):
+    """ Collection of DLS measurements, each read from its csv file and
+    analyzed only when it is first accessed
+
+    A study behaves as a read-only dictionary of ``Measurement`` objects.
+    Use ``from_replicates()`` or ``from_conditions()`` to create one from
+    the same folder structure as the ``analyze_*`` drivers. The study can
+    be passed directly to the ``plot_*`` functions.
+
+    Parameters
+    ----------
+    sources : dictionary
+              Dictionary mapping the key of each measurement to a
+              dictionary with the `file_path` of its csv file, the keyword
+              arguments of ``Measurement.from_zetasizer_csv()``, and the
+              `columns` to add to its rows in ``to_dataframe()``
+    diagnostics : StudyDiagnostics, `optional`
+                  Record in which to store the diagnostics of every
+                  measurement that is analyzed
+    """
+
+    def __init__(self, sources, diagnostics=None):
+        self.sources = OrderedDict(sources)
+        self.diagnostics = diagnostics
+        self._measurements = {}
+
+    @classmethod
+    def from_replicates(cls, csv_name, root_folder, replicates, T, r,
+                        ergodic, Laplace=False, diagnostics=None):
+        """ Study of the replicates of a single condition, with the same
+        arguments as ``analyze_replicates()``. The keys of the study are
+        the replicate numbers. """
+        sources = OrderedDict()
+        for replicate in replicates:
+            sources[replicate] = {
+                'file_path': '%s/replicate%s/%s' % (root_folder, replicate,
+                                                    csv_name),
+                'ergodic': ergodic, 'r': r, 'T': T, 'Laplace': Laplace,
+                'label': 'replicate%s' % replicate,
+                'columns': {'replicate': replicate}}
+        return cls(sources, diagnostics)
+
+    @classmethod
+    def from_conditions(cls, csv_name, root_folder, condition_dir,
+                        replicate_dict, T, r, erg, Laplace=False,
+                        diagnostics=None):
+        """ Study of the replicates of several conditions, with the same
+        arguments as ``analyze_conditions()``. The keys of the study are
+        ``(condition, replicate)`` tuples. """
+        sources = OrderedDict()
+        idx = 0
+        for condition in condition_dir:
+            for replicate in replicate_dict[condition]:
+                sources[(condition, replicate)] = {
+                    'file_path': '%s/%s/replicate%s/%s' % (
+                        root_folder, condition_dir[condition], replicate,
+                        csv_name),
+                    'ergodic': erg[condition] if type(erg) is dict else erg,
+                    'r': r[condition] if type(r) is dict else r,
+                    'T': T[condition] if type(T) is dict else T,
+                    'Laplace': Laplace,
+                    'label': '%s/replicate%s' % (condition, replicate),
+                    'columns': {'replicate': replicate,
+                                'condition': condition, 'id': idx}}
+                idx += 1
+        return cls(sources, diagnostics)
+
+    def __getitem__(self, key):
+        if key not in self._measurements:
+            source = dict(self.sources[key])
+            source.pop('columns')
+            if self.diagnostics is not None:
+                source['diagnostics'] = self.diagnostics.new_curve(
+                    source['label'])
+            self._measurements[key] = Measurement.from_zetasizer_csv(
+                **source)
+        return self._measurements[key]
+
+    def __iter__(self):
+        return iter(self.sources)
+
+    def __len__(self):
+        return len(self.sources)
+
+    @property
+    def loaded(self):
+        """ Keys of the measurements that have been read """
+        return [k for k in self.sources if k in self._measurements]
+
+    def to_dataframe(self):
+        """ Table of results of every measurement, with the same columns as
+        the dataframe saved by the ``analyze_*`` drivers
+
+        Returns
+        -------
+        df : DataFrame
+        """
+        dfs = []
+        for key, measurement in self.items():
+            dlsmicro_df = measurement.to_dataframe()
+            for column, value in self.sources[key]['columns'].items():
+                dlsmicro_df[column] = value
+            dfs.append(dlsmicro_df)
+        return pd.concat(dfs, axis=0, sort=True)
+
+    def scattering_dataframe(self):
+        """ Table of scattering intensities of the position scan of every
+        measurement, as saved by the ``analyze_*`` drivers. See
+        ``io.scattering_table()``
+
+        Returns
+        -------
+        scattering_df : DataFrame
+        """
+        dfs = [io.scattering_table(m.Ie, m.ensemble_positions,
+                                   **self.sources[key]['columns'])
+               for key, m in self.items()]
+        return pd.concat(dfs, ignore_index=True)
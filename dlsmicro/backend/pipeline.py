@@ -0,0 +1,112 @@
+""" Module for the microrheology analysis of DLS measurements held in
+memory, underneath the ``analyze_*`` drivers
+
+The functions of this module take data dictionaries, such as those returned
+by ``io.read_zetasizer_csv_to_dict()``, and return the results. They do
+not read or write files, plot, or change any global state, so they can be
+called concurrently from threads or from a service, as long as each thread
+uses its own ``utils.Workspace``. Reading the data, saving the results
+(``io.save_results`` and ``io.save_results_as_text``) and plotting them
+(``plot_tools.plot_analysis``) are separate stages, which the drivers
+chain together.
+"""
+import numpy as np
+from dlsmicro.backend import analysis_tools
+from dlsmicro.backend import diagnostics as diag
+from dlsmicro.backend import utils
+
+# Scattering vector of the Zetasizer (water, backscatter at 173 degrees,
+# 633 nm laser) used by the analyze_* drivers
+default_q = analysis_tools.calc_q(1.333, 173.*np.pi/180., 633.)
+
+
+def analyze_data_dict(data_dict, ergodic, r, T, q=default_q, Laplace=False,
+                      measured_intercept=False, budget=None,
+                      diagnostics=None, workspace=None, **keys):
+    """ Microrheology analysis of a single measurement, as carried out by
+    the ``analyze_*`` drivers for every replicate or time point
+
+    The correlation function is truncated with
+    ``analysis_tools.truncate_correlation()`` and analyzed with
+    ``analysis_tools.full_dlsur_analysis()``.
+
+    Parameters
+    ----------
+    data_dict : dictionary
+                Data dictionary of the measurement, e.g. returned by
+                ``io.read_zetasizer_csv_to_dict()`` or
+                ``io.parse_zetasizer_record()``
+    ergodic : boolean
+              If ``False``, corrections for broken ergodicity are applied
+              based on the point and ensemble intensities. ``ValueError``
+              is raised if ``data_dict`` has no ensemble intensities.
+    r : float
+        Particle radius in nanometers
+    T : float
+        Temperature in Kelvin
+    q : float, `optional`
+        Scattering vector in 1/nm. By default, that of the Zetasizer.
+    Laplace : boolean, `optional`
+              If `True`, merge the shear modulus with the modulus from the
+              direct Laplace transform of the MSD
+    measured_intercept : boolean, `optional`
+                         If `True`, use the intercept measured by the
+                         Zetasizer software when it is consistent with the
+                         correlation function. See ``analysis_tools.calc_g1``
+    budget : utils.FitBudget, `optional`
+             Limits on the fits used to estimate the intercept.
+             ``utils.BudgetExceeded`` is raised if they are exceeded.
+    diagnostics : CurveDiagnostics, `optional`
+                  Record in which to store the time spent in each stage
+    workspace : utils.Workspace, `optional`
+                Buffers reused for the intermediate arrays of the analysis.
+                A workspace must not be shared between threads.
+    **keys
+        Columns identifying the measurement added to the results, e.g.
+        ``replicate=1`` or ``time_point=3``
+
+    Returns
+    -------
+    t : 1d-array
+        Truncated vector of time-lags (in microseconds)
+    g : 1d-array
+        Truncated correlation coefficient
+    dlsmicro_df : DataFrame
+                  Results of ``analysis_tools.full_dlsur_analysis()``, with
+                  a column for each of ``keys``
+    """
+    I = data_dict['point_intensity']
+    Ie = data_dict['ensemble_intensities']
+    calc_g1_kws = {'budget': budget}
+    if measured_intercept:
+        calc_g1_kws['measured_g0'] = data_dict['measured_intercept']
+    if not ergodic and (Ie is None or len(Ie) == 0):
+        raise ValueError('The ensemble intensities of a position scan are '
+                         'required to analyze a non-ergodic sample')
+
+    # Figure out where data is no longer trustworthy (correlation function
+    # goes to zero)
+    [t, g] = analysis_tools.truncate_correlation(data_dict['time_lag'],
+                                                 data_dict['correlation'])
+
+    dlsmicro_df = analysis_tools.full_dlsur_analysis(t, g, ergodic, r, T, q,
+                                                     I, Ie,
+                                                     calc_g1_kws=calc_g1_kws,
+                                                     diagnostics=diagnostics,
+                                                     workspace=workspace)
+
+    # Laplace transformed modulus
+    if Laplace:
+        with diag.stage(diagnostics, 'laplace'):
+            [omega_L, G1_L, G2_L] = \
+                analysis_tools.shear_modulus_laplace_transform(
+                    t, dlsmicro_df['msd_smooth'], r, T)
+        with diag.stage(diagnostics, 'merge'):
+            dlsmicro_df['G1'], dlsmicro_df['G2'] = utils.laplace_merge(
+                dlsmicro_df['t'], dlsmicro_df['G1'], dlsmicro_df['G2'],
+                G1_L, G2_L)
+
+    for column, value in keys.items():
+        dlsmicro_df[column] = [value]*len(dlsmicro_df['t'])
+
+    return [t, g, dlsmicro_df]
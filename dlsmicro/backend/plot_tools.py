@@ -1,11 +1,85 @@
+import os
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
+from dlsmicro.backend import io
+from dlsmicro.backend import utils
 
-def df_to_matrix(df, quantity, replicate_identifier):
+def load_results(results):
+
+	""" Get the Dataframe of results from DLS microrheology analysis
+	to plot.
+
+	Parameters
+	----------
+	results : str, DataFrame or Study
+	          Path to a Dataframe saved by one of the ``analyze_*``
+	          functions, the Dataframe itself, or a
+	          ``measurement.Study`` whose results are tabulated
+
+	Returns
+	-------
+	df : DataFrame
+	     Dataframe containing table of results from DLS microrheology
+	     analysis
+	"""
+	if isinstance(results, str):
+	    return pd.read_pickle(results)
+	if hasattr(results, 'to_dataframe'):
+	    return results.to_dataframe()
+	return results
+
+def load_scattering(results, scattering=None):
+
+	""" Get the table of scattering intensities of the position scans
+	to plot, as saved by the ``analyze_*`` functions next to the
+	Dataframe of results.
+
+	Parameters
+	----------
+	results : str, DataFrame or Study
+	          Results passed to ``load_results``
+	scattering : str or DataFrame, `optional`
+	             Path to the table of scattering intensities, or the table
+	             itself. By default, it is found from ``results``. It must
+	             be given for results in memory that do not hold the
+	             scattering intensities.
+
+	Returns
+	-------
+	scattering_df : DataFrame
+	                Dataframe with one row per measurement position, with the
+	                position `epos`, the intensity `scattering` and the
+	                columns identifying each sample
+	"""
+	if scattering is not None:
+	    return load_results(scattering)
+	if isinstance(results, str):
+	    path = io.scattering_table_path(results)
+	    if os.path.exists(path):
+	        return pd.read_pickle(path)
+	if hasattr(results, 'scattering_dataframe'):
+	    return results.scattering_dataframe()
+	# Results saved before the scattering was tabulated separately store
+	# it in zero-padded columns
+	df = load_results(results)
+	if 'epos' not in df.columns or 'scattering' not in df.columns:
+	    raise ValueError('The results do not hold the scattering '
+	                     'intensities. Pass the table saved next to them, '
+	                     'see io.scattering_table_path(), as scattering=')
+	columns = [c for c in ['id', 'condition', 'replicate', 'time_point']
+	           if c in df.columns]
+	scattering_df = df[df['epos'] != 0][columns + ['epos', 'scattering']]
+	return scattering_df.astype({'epos': float, 'scattering': float})
+
+def df_to_matrix(df, quantity, replicate_identifier, x='omega',
+                 return_grid=False):
 
 	""" Construct a matrix from a Dataframe for a given vector-valued 
 	quantity in which each vector replicate is labeled by a unique 
-	replicate identifier.
+	replicate identifier. The replicates are interpolated (in the
+	logarithm of ``x``) onto a shared grid, so that each column of the
+	matrix corresponds to the same value of ``x``.
 
     Parameters
     ----------
@@ -16,25 +90,43 @@ def df_to_matrix(df, quantity, replicate_identifier):
           	   Name of variable to plot as defined in the Dataframe
    	replicate_identifier : str
    				 		   Name of quantity to average over
+   	x : str, `optional`
+   		Name of the independent variable of ``quantity``
+   	return_grid : boolean, `optional`
+   				  If `True`, also return the shared values of ``x``
 
    	Returns
     -------
+    x_grid : 1-d array
+    		 Values of ``x`` corresponding to the columns of ``M``. These are
+    		 the values of ``x`` of the shortest replicate that lie within
+    		 the range of every replicate. (Only returned if
+    		 ``return_grid=True``)
     M : 2-d array
         Matrix where each row is a replicate of the vector quantity.
     """
 
     # Construct a matrix in which each row represents a frequency sweep
 	ids = set(df[replicate_identifier].values)
-	M_list = []
-	list_len = []
+	x_list = []
+	y_list = []
 	for idx in ids:
-	    xi = df[df[replicate_identifier] == idx][quantity].values
-	    list_len.append(len(xi))
-	    M_list.append(xi)
-    # Ensure all rows are the same length
-	limit = np.min(np.array(list_len))
-	M_list = list(m[0:limit] for m in M_list)
-	M = np.vstack(M_list)
+	    dfi = df[df[replicate_identifier] == idx]
+	    x_list.append(np.array(dfi[x].values, dtype=float))
+	    y_list.append(np.array(dfi[quantity].values, dtype=float))
+    # Interpolate every replicate onto the values of x of the shortest
+    # replicate, in increasing order of log(x)
+	x_grid = min(x_list, key=len)
+	direction = np.sign(x_grid[-1]-x_grid[0])
+	u_list = [direction*np.log(xi) for xi in x_list]
+	[M, mask] = utils.interp_stack(u_list, y_list,
+	                               direction*np.log(x_grid))
+    # Only keep values of x covered by every replicate
+	shared = np.all(mask, axis=0)
+	x_grid = x_grid[shared]
+	M = M[:, shared]
+	if return_grid:
+	    return [x_grid, M]
 	return M
 
 def bootstrap_matrix_byrows(M, n_bootstrap, estimator):
@@ -94,16 +186,7 @@ def bootstrap_freq_sweep(df, quantity, replicate_identifier,
         	 	  Matrix in which each row represents a frequency sweep
     """
 
-	ids = set(df[replicate_identifier].values)
-	M_list = []
-	list_len = []
-	for idx in ids:
-	    xi = df[df[replicate_identifier] == idx][quantity].values
-	    list_len.append(len(xi))
-	    M_list.append(xi) 
-	limit = np.min(np.array(list_len))
-	M_list = list(m[0:limit] for m in M_list)
-	M = np.vstack(M_list)
+	M = df_to_matrix(df, quantity, replicate_identifier)
 
     # Get a matrix of bootstrapped row-wise averages given by the estimator
 	M_bootstrap = bootstrap_matrix_byrows(M, n_bootstrap, estimator)
@@ -182,9 +265,8 @@ def plot_replicates_from_df(df, my_quantity, plot_ci=True, myci=68.,
    				 Name of quantity to average over
     """
 
-    y_matrix = df_to_matrix(df, my_quantity, identifier)
-    replicates = df['replicate'].values
-    time = df[df['replicate'] == replicates[0]]['omega'].values[0:np.shape(y_matrix)[1]]
+    [time, y_matrix] = df_to_matrix(df, my_quantity, identifier,
+                                    return_grid=True)
     ci = bootstrap_freq_sweep_ci(df, my_quantity, identifier, 10000,
     	                         myci, estimator=estimator)
     ci_low = ci[0]
@@ -231,3 +313,64 @@ def add_w_scaling(omega, scaling, w_b, placement):
   	     '$\omega^{%(top)s/%(bot)s}$'%{'top':np.int(scaling[0]),
   	     'bot':np.int(scaling[1])},fontsize=12)
 
+
+
+def plot_analysis(t, g, dlsmicro_df, plot_corr=False, plot_msd=False,
+                  plot_G=False, save_dir=None, tight_layout=False, lw=None):
+	""" Plot the correlation function, MSD and shear modulus of a single
+	measurement, each in its own figure, as done by the ``analyze_*``
+	drivers
+
+	Parameters
+	----------
+	t : 1d-array
+	    Vector of time-lags (in microseconds)
+	g : 1d-array
+	    Correlation coefficient at the time-lags ``t``
+	dlsmicro_df : DataFrame
+	              Results of the measurement, e.g. from
+	              ``pipeline.analyze_data_dict()``
+	plot_corr : boolean, `optional`
+	            If `True`, show plot of the correlation function
+	plot_msd : boolean, `optional`
+	           If `True`, show plot of the mean-squared displacement
+	plot_G : boolean, `optional`
+	         If `True`, show plot of the shear modulus
+	save_dir : str, `optional`
+	           If given, the plots are saved in this directory as `corr`,
+	           `msd` and `G`
+	tight_layout : boolean, `optional`
+	               If `True`, adjust the padding of the plots
+	lw : float, `optional`
+	     Line width of the shear modulus
+	"""
+	def finish(name):
+	    if tight_layout:
+	        plt.tight_layout()
+	    if save_dir is not None:
+	        plt.savefig('%s/%s' % (save_dir, name))
+	    plt.show()
+
+	if plot_corr:
+	    plt.plot(t, g, '-r')
+	    plt.xscale('log')
+	    plt.xlabel('$\\mathregular{time\\ (\\mu s)}$')
+	    plt.ylabel('g')
+	    finish('corr')
+	if plot_msd:
+	    plt.plot(dlsmicro_df['t'], dlsmicro_df['msd_smooth'], '-r')
+	    plt.xscale('log')
+	    plt.yscale('log')
+	    plt.xlabel('$\\mathregular{time\\ (\\mu s)}$')
+	    plt.ylabel('MSD')
+	    finish('msd')
+	if plot_G:
+	    plt.plot(dlsmicro_df['omega'], dlsmicro_df['G1'], '-r', lw=lw)
+	    plt.plot(dlsmicro_df['omega'], dlsmicro_df['G2'], '--r', lw=lw)
+	    plt.ylabel('$\\mathregular{G^*\\ (Pa)}$')
+	    plt.xlabel('$\\mathregular{\\omega\\ (s^{-1})}$')
+	    plt.legend(['$\\mathregular{G^{\\prime}}$',
+	                '$\\mathregular{G^{\\prime \\prime}}$'], frameon=False,)
+	    plt.xscale('log')
+	    plt.yscale('log')
+	    finish('G')
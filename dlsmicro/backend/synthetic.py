@@ -0,0 +1,457 @@
+""" Module for generating synthetic DLS correlation data with a known
+microrheology, for load testing and for checking the accuracy of the
+analysis against a ground truth"""
+import csv
+import os
+import numpy as np
+from scipy import special
+from dlsmicro.backend import analysis_tools
+from dlsmicro.backend import io
+
+# Boltzman constant
+kb = 1.38e-23
+
+# Models of the material with a known creep compliance and shear modulus
+models = ('brownian', 'power_law', 'maxwell')
+
+# Default parameters for each model (SI units)
+default_params = {'brownian': {'eta': 1.e-3},
+                  'power_law': {'S': 1.0, 'n': 0.5},
+                  'maxwell': {'G': 1.0, 'tau': 1.e-2, 'eta_s': 1.e-3}}
+
+
+def multi_tau_lags(n_channels=192, dt=0.5, per_level=8):
+    """ Construct the time-lags of a multi-tau correlator
+
+    Parameters
+    ----------
+    n_channels : int, `optional`
+                 Total number of correlator channels. The default matches
+                 the Zetasizer exports.
+    dt : float, `optional`
+         Sampling time (in microseconds) of the first level
+    per_level : int, `optional`
+                Number of channels per level. The lag spacing doubles from
+                one level to the next.
+
+    Returns
+    -------
+    t : 1d-array
+        Vector of time-lags in microseconds
+    """
+    spacing = dt*2.**(np.arange(n_channels)//per_level)
+    t = np.cumsum(spacing)
+    return t
+
+
+def creep_compliance(t, model, **params):
+    """ Calculate the creep compliance of a model material
+
+    Parameters
+    ----------
+    t : 1d-array
+        Time in seconds
+    model : str
+            One of ``'brownian'`` (Newtonian fluid with viscosity ``eta``),
+            ``'power_law'`` (critical gel with ``G(t) = S*t**-n``) or
+            ``'maxwell'`` (Maxwell fluid with plateau modulus ``G`` and
+            relaxation time ``tau``, in parallel with a solvent of viscosity
+            ``eta_s``)
+    params : float or 1d-array
+             Model parameters in SI units. Arrays of parameters are
+             broadcast against ``t``.
+
+    Returns
+    -------
+    J : array
+        Creep compliance in units of 1/Pa
+    """
+    params = dict(default_params[model], **params)
+    if model == 'brownian':
+        J = t/params['eta']
+    elif model == 'power_law':
+        n = params['n']
+        J = t**n/(params['S']*special.gamma(1.-n)*special.gamma(1.+n))
+    elif model == 'maxwell':
+        [G, tau, eta_s] = [params['G'], params['tau'], params['eta_s']]
+        # Zero-shear viscosity and retardation time
+        eta0 = G*tau + eta_s
+        lam = eta_s*tau/eta0
+        with np.errstate(divide='ignore'):
+            J = (t + (tau - lam)*(1. - np.exp(-t/lam)))/eta0
+    else:
+        raise Exception('model %s is not one of %s' % (model, models))
+    return J
+
+
+def complex_modulus(omega, model, **params):
+    """ Calculate the complex shear modulus of a model material
+
+    Parameters
+    ----------
+    omega : 1d-array
+            Vector of angular frequencies in units of 1/s
+    model : str
+            Name of the model, see ``creep_compliance()``
+    params : float or 1d-array
+             Model parameters in SI units
+
+    Returns
+    -------
+    G1 : array
+         Storage modulus at angular frequencies ``omega`` in units of Pa
+    G2 : array
+         Loss modulus at angular frequencies ``omega`` in units of Pa
+    """
+    params = dict(default_params[model], **params)
+    if model == 'brownian':
+        G2 = params['eta']*omega
+        G1 = np.zeros_like(G2)
+    elif model == 'power_law':
+        n = params['n']
+        G = params['S']*special.gamma(1.-n)*omega**n
+        G1 = G*np.cos(np.pi*n/2.)
+        G2 = G*np.sin(np.pi*n/2.)
+    elif model == 'maxwell':
+        wt = omega*params['tau']
+        G1 = params['G']*wt**2./(1.+wt**2.)
+        G2 = params['G']*wt/(1.+wt**2.) + params['eta_s']*omega
+    else:
+        raise Exception('model %s is not one of %s' % (model, models))
+    return [G1, G2]
+
+
+def msd_from_model(t, r, T, model, **params):
+    """ Calculate the MSD of probe particles embedded in a model material
+    from the generalized Stokes-Einstein relation
+
+    Parameters
+    ----------
+    t : 1d-array
+        Time-lags in units of microseconds
+    r : float
+        Radius of the probe particles in nanometers
+    T : float
+        Temperature in Kelvin
+    model : str
+            Name of the model, see ``creep_compliance()``
+    params : float or 1d-array
+             Model parameters in SI units
+
+    Returns
+    -------
+    msd : array
+          Mean-squared displacements at the time-lags ``t`` in
+          units of nm^2
+    """
+    J = creep_compliance(t*1.e-6, model, **params)
+    msd = kb*T*(1.e27)*J/(np.pi*r)
+    return msd
+
+
+def correlation_from_msd(t, msd, q, g0=0.9, Y=1.0):
+    """ Calculate the correlation coefficient measured for a given MSD
+
+    This is the inverse of the calculation performed by
+    ``analysis_tools.calc_g1()`` and ``analysis_tools.msd_local_pwr_law()``,
+    so that analyzing the result recovers ``msd``.
+
+    Parameters
+    ----------
+    t : 1d-array
+        Time-lags in units of microseconds
+    msd : array
+          Mean-squared displacements at the time-lags ``t`` in
+          units of nm^2
+    q : float
+        Scattering vector in units of 1/nm
+    g0 : float or 1d-array, `optional`
+         Intercept of the correlation coefficient at time 0
+    Y : float or 1d-array, `optional`
+        Ratio of the ensemble averaged to the time averaged scattering
+        intensity. If ``Y=1``, the sample is ergodic.
+
+    Returns
+    -------
+    corr : array
+           Correlation coefficient (equal to `g2 - 1`) at time-lags ``t``
+    """
+    g0 = np.reshape(g0, np.shape(g0) + (1,)*(np.ndim(msd) - np.ndim(g0)))
+    Y = np.reshape(Y, np.shape(Y) + (1,)*(np.ndim(msd) - np.ndim(Y)))
+    g1 = np.exp(-msd*q**2./6.)
+    if np.all(Y == 1.):
+        corr = g0*g1**2.
+    else:
+        # Invert the broken-ergodicity correction of calc_g1
+        fT = np.clip(Y*g1 - Y + 1., 0., None)
+        corr = fT**2. + g0 - 1.
+        corr = np.where(Y == 1., g0*g1**2., corr)
+    return corr
+
+
+def synthetic_curves(n_curves, model='brownian', params=None, r=250.,
+                     T=310.15, q=None, g0=0.9, noise=2.e-3, ergodic=True,
+                     n_positions=20, lags=None, seed=None):
+    """ Generate a stack of synthetic correlation functions from a model
+    material with a known microrheology
+
+    Parameters
+    ----------
+    n_curves : int
+               Number of correlation functions to generate
+    model : str, `optional`
+            Name of the model, see ``creep_compliance()``
+    params : dictionary, `optional`
+             Model parameters in SI units. Each value may be a float, or a
+             length ``n_curves`` array to vary the material across curves.
+             Missing parameters take the values in ``default_params``.
+    r : float, `optional`
+        Radius of the probe particles in nanometers
+    T : float, `optional`
+        Temperature in Kelvin
+    q : float, `optional`
+        Scattering vector in units of 1/nm. If ``None``, the scattering
+        vector used by the ``analyze_*`` drivers is used.
+    g0 : float, `optional`
+         Intercept of the correlation coefficient at time 0
+    noise : float, `optional`
+            Standard deviation of the additive Gaussian noise on the
+            correlation coefficient
+    ergodic : boolean, `optional`
+              If `False`, each curve is measured at a speckle with a random
+              scattering intensity, and the ensemble intensity is measured
+              by a position scan
+    n_positions : int, `optional`
+                  Number of positions in the position scan
+    lags : 1d-array, `optional`
+           Time-lags in microseconds. If ``None``, the lags of the
+           Zetasizer multi-tau correlator are used.
+    seed : int, `optional`
+           Seed for the random number generator
+
+    Returns
+    -------
+    data : dictionary
+           Python dictionary containing the keys below
+    'time_lag' : 1d-array
+                 Vector of time-lags (in microseconds)
+    'correlation' : 2d-array
+                    Matrix of noisy correlation coefficients, where each
+                    row is a curve
+    'correlation_exact' : 2d-array
+                          Correlation coefficients without noise
+    'point_intensity' : 1d-array
+                        Scattering intensity at the point where each curve
+                        is collected
+    'ensemble_intensities' : 2d-array
+                             Scattering intensities of the position scan of
+                             each curve
+    'ensemble_positions' : 1d-array
+                           Measurement positions (in mm) of the position scan
+    'msd' : 2d-array
+            Ground truth MSD (in nm^2) at the time-lags
+    'omega' : 1d-array
+              Angular frequencies (in 1/s) corresponding to the time-lags
+    'G1', 'G2' : 2d-array
+                 Ground truth storage and loss moduli (in Pa) at ``omega``
+    """
+    rng = np.random.RandomState(seed)
+    if q is None:
+        q = analysis_tools.calc_q(1.333, 173.*np.pi/180., 633.)
+    if lags is None:
+        lags = multi_tau_lags()
+    if params is None:
+        params = {}
+    t = np.asarray(lags, dtype=float)
+    # Broadcast the parameters of each curve against the time-lags
+    curve_params = dict((k, np.broadcast_to(v, (n_curves,))[:, None])
+                        for k, v in params.items())
+
+    msd = np.broadcast_to(msd_from_model(t, r, T, model, **curve_params),
+                          (n_curves, len(t)))
+    omega = (t**-1.)*(1.e6)
+    [G1, G2] = complex_modulus(omega, model, **curve_params)
+    G1 = np.broadcast_to(G1, msd.shape)
+    G2 = np.broadcast_to(G2, msd.shape)
+
+    # Scattering intensities of the position scan (in kcps)
+    positions = np.round(np.linspace(2., 2. + 0.1*(n_positions-1),
+                                     n_positions), 2)
+    mean_intensity = 3.e4
+    if ergodic:
+        Ie = mean_intensity*(1. + 0.02*rng.randn(n_curves, n_positions))
+        Ip = mean_intensity*(1. + 0.02*rng.randn(n_curves))
+        Y = 1.
+    else:
+        # Speckle intensities are exponentially distributed
+        Ie = rng.exponential(mean_intensity, (n_curves, n_positions))
+        Ip = rng.exponential(mean_intensity, n_curves)
+        Y = np.mean(Ie, axis=1)/Ip
+        # Only the frozen-in fraction of the scattering varies between
+        # speckles, and the time averaged intermediate scattering function
+        # 1 - Y*(1 - g1) cannot decay below zero
+        f_inf = np.exp(-msd[:, -1]*q**2./6.)
+        Y = 1. + (Y - 1.)*f_inf
+        Y = np.minimum(Y, 1./(1. - f_inf + 1.e-3))
+        Ip = np.mean(Ie, axis=1)/Y
+
+    corr_exact = correlation_from_msd(t, msd, q, g0=g0, Y=Y)
+    corr = corr_exact + noise*rng.randn(*corr_exact.shape)
+
+    data = {'time_lag': t, 'correlation': corr,
+            'correlation_exact': corr_exact, 'point_intensity': Ip,
+            'ensemble_intensities': Ie, 'ensemble_positions': positions,
+            'msd': np.array(msd), 'omega': omega, 'G1': np.array(G1),
+            'G2': np.array(G2)}
+    return data
+
+
+def _format(values):
+    """ Format values as the Zetasizer does, with 3 significant digits """
+    return ','.join('%#.3g' % v for v in values)
+
+
+def write_zetasizer_csv(file_path, t, corr, Ip, ensemble_intensities=None,
+                        ensemble_positions=None, corr_fit=None, g0=0.9,
+                        point_position=3.0, sample_name='synthetic',
+                        column_order=io.default_column_order):
+    """ Write a correlation function and position scan to a .csv file in the
+    format of the `dlsmicro_export.edf` Zetasizer export template
+
+    The first record contains the correlation function and the following
+    records contain the position scan, so the file can be read with
+    ``io.read_zetasizer_csv_to_dict(file_path, 0)``. Several correlation
+    functions are written as the consecutive time points of a
+    time-dependent measurement, followed by the position scan, as read by
+    ``analyze_time_points()``.
+
+    Parameters
+    ----------
+    file_path : str
+                Path to the .csv file to be written
+    t : 1d-array
+        Vector of time-lags in microseconds
+    corr : 1d-array or 2d-array
+           Correlation coefficient at the time-lags ``t``, or a matrix with
+           the correlation coefficient of one time point per row
+    Ip : float or 1d-array
+         Scattering intensity at the measurement position of each time
+         point
+    ensemble_intensities : 1d-array, `optional`
+                           Scattering intensities of the position scan
+    ensemble_positions : 1d-array, `optional`
+                         Measurement positions of the position scan
+    corr_fit : 1d-array or 2d-array, `optional`
+               Smooth fit to ``corr`` exported as the distribution fit.
+               If ``None``, ``corr`` is used.
+    g0 : float, `optional`
+         Exported measured intercept
+    point_position : float, `optional`
+                     Measurement position of the correlation function
+    sample_name : str, `optional`
+                  Exported sample name, followed by the number of each
+                  time point
+    column_order : list of str, `optional`
+                   Ordered list names for the columns in the .csv file.
+                   See ``dlsmicro.io.default_column_order``
+    """
+    corr = np.atleast_2d(corr)
+    if corr_fit is None:
+        corr_fit = corr
+    corr_fit = np.atleast_2d(corr_fit)
+    Ip = np.broadcast_to(Ip, (len(corr),))
+    if ensemble_intensities is None:
+        ensemble_intensities = []
+        ensemble_positions = []
+
+    records = []
+    for i in range(len(corr)):
+        # The distribution fit is exported over the decay of the correlation
+        # function on a coarser grid, with a baseline of zero
+        fit_inds = np.flatnonzero(corr_fit[i] > 0.01*corr_fit[i, 0])[1::3]
+        if len(fit_inds) < 2:
+            fit_inds = np.arange(2)
+        g1fit = np.sqrt(np.clip(corr_fit[i, fit_inds], 0., None))
+
+        records.append({'Record': i + 1,
+                        'Sample Name': '%s %d' % (sample_name, i + 1),
+                        'Measurement Position': '%.2f' % point_position,
+                        'Correlation Data': _format(corr[i]),
+                        'Correlation Delay Times': _format(t),
+                        'Distribution Fit Data': _format(g1fit),
+                        'Distribution Fit Delay Times': _format(t[fit_inds]),
+                        'Cumulants Fit Data': _format(g1fit),
+                        'Cumulants Fit Delay Times': _format(t[fit_inds]),
+                        'Derived Count Rate': '%.1f' % Ip[i],
+                        'Measured Intercept': '%.3f' % g0,
+                        'Measured Baseline': '%.3f' % 0.})
+    n_records = len(records)
+    for i, (Ii, posi) in enumerate(zip(ensemble_intensities,
+                                       ensemble_positions)):
+        records.append({'Record': n_records + i + 1, 'Sample Name': ' 1',
+                        'Measurement Position': '%.2f' % posi,
+                        'Derived Count Rate': '%.1f' % Ii})
+
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        for rec in records:
+            writer.writerow([rec.get(c, '') for c in column_order])
+
+
+def write_condition_tree(root_folder, conditions, n_replicates=3,
+                         csv_name='exported2.csv', seed=None, **kws):
+    """ Write synthetic data in the `condition/replicateN/` folder
+    structure read by ``analyze_conditions()``
+
+    Parameters
+    ----------
+    root_folder : str
+                  Folder in which to create the condition folders
+    conditions : dictionary
+                 Dictionary of condition folder names and a dictionary of
+                 keyword arguments to ``synthetic_curves()`` for each
+                 condition, e.g. ``{'cond1': {'model': 'maxwell'}}``
+    n_replicates : int, `optional`
+                   Number of replicates per condition
+    csv_name : str, `optional`
+               Name of every csv file
+    seed : int, `optional`
+           Seed for the random number generator
+    kws : `optional`
+          Keyword arguments to ``synthetic_curves()`` shared by all
+          conditions
+
+    Returns
+    -------
+    condition_dir : dictionary
+                    Dictionary of conditions and respective folders
+    replicate_dict : dictionary
+                     Dictionary of replicates for each condition
+    truth : dictionary
+            Dictionary of the data returned by ``synthetic_curves()``
+            for each condition, where row `i` is replicate `i+1`
+    """
+    rng = np.random.RandomState(seed)
+    condition_dir = {}
+    replicate_dict = {}
+    truth = {}
+    for condition, condition_kws in conditions.items():
+        curve_kws = dict(kws, **condition_kws)
+        data = synthetic_curves(n_replicates, seed=rng.randint(2**31),
+                                **curve_kws)
+        g0 = curve_kws.get('g0', 0.9)
+        for i in range(n_replicates):
+            folder = '%s/%s/replicate%s' % (root_folder, condition, i + 1)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            write_zetasizer_csv('%s/%s' % (folder, csv_name),
+                                data['time_lag'], data['correlation'][i],
+                                data['point_intensity'][i],
+                                data['ensemble_intensities'][i],
+                                data['ensemble_positions'],
+                                corr_fit=data['correlation_exact'][i],
+                                g0=g0, sample_name=condition)
+        condition_dir[condition] = condition
+        replicate_dict[condition] = list(range(1, n_replicates + 1))
+        truth[condition] = data
+    return [condition_dir, replicate_dict, truth]
@@ -1,8 +1,16 @@
+import collections
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+import time
 import numpy as np
 from numpy import linalg
 from numpy import random
 from scipy import integrate
 from scipy.optimize import curve_fit
+from dlsmicro.backend import diagnostics as diag
 
 ##########################################################
 #gauusian_weight
@@ -49,63 +57,588 @@ def weighted_linear_reg(X,y,W):
 #degree - degree of polynomial for fit (1 or 2)
 #alpha - smoothing parameter. Defined as the ratio of tau**2. divided
 #by the square in the difference between the two extrema in x
+#workspace - optional Workspace whose buffers hold the temporaries and
+#the returned Theta and yp, which are overwritten by the next call
 
 
-def loess(x,y,degree,alpha):
+def loess(x,y,degree,alpha,workspace=None):
     n = len(x)
-    #######################################################
-    #First degree polynomial regression
-    #######################################################
-    if degree == 1:
-
-        #First feature in the X array is a constant
-        #Second feature is the value of x
-        const = np.ones(n)
-        X = np.array([const,x]).T
-        W = np.identity(n)
-        tau = alpha * np.sqrt((x[0]-x[-1])**2.)
+    if degree not in (1, 2):
+        return
+    if workspace is None:
+        workspace = Workspace(n)
+    p = degree + 1
 
-        #Construct the theta matrix
-        Theta = np.zeros([2,n])
-        #Construct the prediction vector
-        yp = np.zeros(n)
-        #Loop over observations
-        for i in range(n):
-            #compute the weight matrix
-            W = gaussian_weight(x,i,tau)
-           #perform linear regression
-            theta = weighted_linear_reg(X,y,W)
-            Theta[:,i] = theta
-            yp[i] = np.dot(X[i,:],theta)
-        return [Theta,yp]
-
-    #######################################################
-    #Second degree polynomial regression
-    #######################################################
+    #First feature in the X array is a constant
+    #Second feature is the value of x
+    #Third feature (degree 2) is the value of x**2.
+    X = workspace.array('loess_X', (n, p))
+    X[:, 0] = 1.
+    X[:, 1] = x
     if degree == 2:
+        np.square(x, out=X[:, 2])
+    tau = alpha * np.sqrt((x[0]-x[-1])**2.)
+
+    #Construct the theta matrix
+    Theta = workspace.array('loess_Theta', (p, n))
+    #Construct the prediction vector
+    yp = workspace.array('loess_yp', n)
+    w = workspace.array('loess_w', n)
+    XtW = workspace.array('loess_XtW', (p, n))
+    XtWX = workspace.array('loess_XtWX', (p, p))
+    XtWy = workspace.array('loess_XtWy', p)
+    #Loop over observations
+    for i in range(n):
+        #compute the gaussian weights
+        np.subtract(x, x[i], out=w)
+        np.square(w, out=w)
+        np.negative(w, out=w)
+        np.divide(w, tau, out=w)
+        np.exp(w, out=w)
+        #perform weighted linear regression
+        np.multiply(X.T, w, out=XtW)
+        np.dot(XtW, X, out=XtWX)
+        np.dot(XtW, y, out=XtWy)
+        theta = np.dot(linalg.inv(XtWX), XtWy)
+        Theta[:,i] = theta
+        yp[i] = np.dot(X[i,:],theta)
+    return [Theta,yp]
+
+
+class Workspace(object):
+    """ Buffers reused by the analysis of many correlation functions, to
+    avoid allocating temporary arrays for every correlation function
+
+    Pass the same workspace to ``analysis_tools.full_dlsur_analysis()``
+    (or to ``calc_g1()``, ``msd_local_pwr_law()``, ``shear_modulus()``,
+    ``dlsur_kernel()`` and ``loess()``) for every correlation function of
+    a study. Buffers are allocated on first use and grown when a longer
+    correlation function is analyzed.
+
+    Parameters
+    ----------
+    n : int, `optional`
+        Default length of the buffers, e.g. the number of time-lags
+
+    Attributes
+    ----------
+    allocations : int
+                  Number of buffers allocated so far
+
+    Notes
+    -----
+    Arrays returned by functions given a workspace are views of its
+    buffers, and are overwritten by the next call using the same
+    workspace. Copy them to keep them. ``full_dlsur_analysis()`` copies
+    the results into its Dataframe.
+    """
+
+    def __init__(self, n=0):
+        self.n = n
+        self.allocations = 0
+        self._buffers = {}
+        self._memos = {}
+
+    def memo(self, name, key, factory):
+        """ Get the value ``name`` computed by ``factory()``, which is only
+        called again when ``key`` differs from that of the previous call,
+        e.g. for quantities that only depend on the time-lags
+
+        Parameters
+        ----------
+        name : str
+               Name of the value
+        key : hashable
+              Inputs from which the value is computed
+        factory : callable
+                  Function without arguments computing the value
+
+        Returns
+        -------
+        value : object
+                Value returned by ``factory()``
+        """
+        memo = self._memos.get(name)
+        if memo is None or memo[0] != key:
+            memo = (key, factory())
+            self._memos[name] = memo
+        return memo[1]
+
+    def array(self, name, shape=None, dtype=float):
+        """ Get the buffer ``name`` as an uninitialized array
+
+        Parameters
+        ----------
+        name : str
+               Name of the buffer
+        shape : int or tuple of ints, `optional`
+                Shape of the array. By default, ``(n,)``
+        dtype : data-type, `optional`
+                Floating point type of the array. Buffers of different
+                types with the same name are kept separately.
+
+        Returns
+        -------
+        a : ndarray
+            Array of type ``dtype`` and shape ``shape``
+        """
+        if shape is None:
+            shape = self.n
+        shape = tuple(np.atleast_1d(shape))
+        size = int(np.prod(shape))
+        key = (name, np.dtype(dtype))
+        buf = self._buffers.get(key)
+        if buf is None or buf.size < size:
+            buf = np.empty(size, dtype=dtype)
+            self._buffers[key] = buf
+            self.allocations += 1
+        return buf[:size].reshape(shape)
+
+
+def loess_operator(x, degree, alpha, x_eval=None):
+    """ Linear operator of the locally-weighted regression ``loess`` on a
+    fixed grid of inputs
+
+    The local regression is linear in the outputs, so for every
+    ``y`` sampled on ``x`` the local parameters are ``Theta = L.dot(y)``.
+    The operator only has to be built once for a grid shared by many data
+    sets.
+
+    Parameters
+    ----------
+    x : 1-d array
+        Length N vector of inputs
+    degree : int
+             Degree of the local polynomial (1 or 2)
+    alpha : float
+            Smoothing parameter, as in ``loess``
+    x_eval : 1-d array, `optional`
+             Length K vector of points at which to evaluate the local
+             regression of the data at ``x``. By default, ``x``
+
+    Returns
+    -------
+    L : 3-d array
+        Array of shape ``(degree+1, K, N)``. ``L[k]`` maps the outputs to
+        the `kth` coefficient of the local polynomial at each point of
+        ``x_eval``
+    """
+    X = np.vander(x, degree+1, increasing=True)
+    if x_eval is None:
+        w = _loess_weights(x, alpha)
+    else:
+        tau = alpha * np.sqrt((x[0]-x[-1])**2.)
+        w = np.exp(-((x[None, :]-np.asarray(x_eval)[:, None])**2.)/(tau))
+    XtWX = np.einsum('ij,jp,jq->ipq', w, X, X)
+    XtW = X.T[None, :, :]*w[:, None, :]
+    L = np.matmul(linalg.inv(XtWX), XtW)
+    return np.transpose(L, (1, 0, 2))
+
+
+class LoessOperatorCache(object):
+    """ Least recently used cache of the operators of ``loess`` on the
+    grids of inputs that are smoothed repeatedly
+
+    The Zetasizer exports every correlation function on the same
+    time-lags, so the operators of the local regression of the MSD are
+    built once and every later smoothing is a matrix-vector product.
+    ``analysis_tools.msd_local_pwr_law()``,
+    ``analysis_tools.shear_modulus_laplace_transform()`` and
+    ``loess_batch()`` use the module-level cache ``loess_operators``, which
+    can be configured with ``configure_loess_cache()``.
+
+    Parameters
+    ----------
+    max_bytes : int, `optional`
+                Maximum memory (in bytes) used by the cached operators. The
+                least recently used operators are discarded beyond it.
+    directory : str, `optional`
+                Directory in which the operators are also saved, and from
+                which they are loaded if they are not in memory, so that
+                they persist between sessions
+
+    Attributes
+    ----------
+    hits : int
+           Number of operators found in memory or on disk
+    misses : int
+             Number of operators built
+    nbytes : int
+             Memory used by the cached operators
+    """
+
+    def __init__(self, max_bytes=2**28, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._operators = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, x, degree, alpha, x_eval=None):
+        """ Operators of ``loess`` on the grid of inputs ``x``
+
+        Parameters
+        ----------
+        x : 1-d array
+            Length N vector of inputs
+        degree : int
+                 Degree of the local polynomial (1 or 2)
+        alpha : float
+                Smoothing parameter, as in ``loess``
+        x_eval : 1-d array, `optional`
+                 Length K vector of points at which to evaluate the local
+                 regression, see ``loess_operator``. By default, ``x``
+
+        Returns
+        -------
+        L : 3-d array
+            Operator of shape ``(degree+1, K, N)`` returned by
+            ``loess_operator``, so that ``Theta = L.dot(y)``
+        H : 2-d array
+            Operator of shape ``(K, N)`` mapping the outputs to the
+            smoothed outputs at ``x_eval``, ``yp = H.dot(y)``
+        """
+        x = np.ascontiguousarray(x, dtype=float)
+        key = (hashlib.sha1(x.tobytes()).hexdigest(), int(degree),
+               float(alpha))
+        if x_eval is not None:
+            x_eval = np.ascontiguousarray(x_eval, dtype=float)
+            key += (hashlib.sha1(x_eval.tobytes()).hexdigest(),)
+        with self._lock:
+            operators = self._operators.get(key)
+            if operators is not None:
+                self._operators.move_to_end(key)
+                self.hits += 1
+                return operators
+        operators = self._load(key, len(x) if x_eval is None else len(x_eval),
+                               len(x))
+        if operators is None:
+            L = np.ascontiguousarray(loess_operator(x, degree, alpha,
+                                                    x_eval))
+            X = np.vander(x if x_eval is None else x_eval, degree+1,
+                          increasing=True)
+            H = np.einsum('ip,pij->ij', X, L)
+            operators = np.concatenate([L, H[None, :, :]])
+            self._save(key, operators)
+            with self._lock:
+                self.misses += 1
+        else:
+            with self._lock:
+                self.hits += 1
+        operators.setflags(write=False)
+        operators = [operators[:-1], operators[-1]]
+        self._store(key, operators)
+        return operators
+
+    def clear(self):
+        """ Discard the operators cached in memory """
+        with self._lock:
+            self._operators.clear()
+            self.nbytes = 0
+
+    def _store(self, key, operators):
+        size = operators[0].nbytes + operators[1].nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._operators:
+                return
+            self._operators[key] = operators
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                [L, H] = self._operators.popitem(last=False)[1]
+                self.nbytes -= L.nbytes + H.nbytes
+
+    def _path(self, key):
+        name = '-'.join(['loess', key[0], '%d' % key[1], '%r' % key[2]] +
+                        list(key[3:]))
+        return os.path.join(self.directory, name + '.npy')
+
+    def _load(self, key, k, n):
+        if self.directory is None:
+            return None
+        try:
+            operators = np.load(self._path(key))
+        except (IOError, ValueError):
+            return None
+        if operators.shape != (key[1]+2, k, n):
+            return None
+        return operators
+
+    def _save(self, key, operators):
+        if self.directory is None:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # Write to a temporary file first, so that concurrent sessions
+        # never load a partially written operator
+        fd, tmp = tempfile.mkstemp(suffix='.npy', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, operators)
+        os.replace(tmp, self._path(key))
+
+
+# Operators of loess shared by the analysis of every correlation function
+loess_operators = LoessOperatorCache()
+
+
+def configure_loess_cache(max_bytes=2**28, directory=None):
+    """ Configure the cache of ``loess`` operators used by the analysis
+
+    Parameters
+    ----------
+    max_bytes : int, `optional`
+                Maximum memory (in bytes) used by the cached operators. With
+                0, the operators are built for every smoothing.
+    directory : str, `optional`
+                Directory in which to persist the operators between
+                sessions, e.g. for an instrument that always exports the
+                same time-lags
+    """
+    loess_operators.clear()
+    loess_operators.max_bytes = max_bytes
+    loess_operators.directory = directory
+
+
+def loess_gcv(x, y, alphas=None):
+    """ Select the smoothing parameter of a degree 1 ``loess`` by
+    generalized cross validation
+
+    For each smoothing parameter, the local regression is solved in closed
+    form from the weighted moments of the inputs and outputs about each
+    input, which gives the smoothed outputs and the trace of the hat matrix
+    without building the operators. The differences between the inputs are
+    shared by all of the smoothing parameters.
+
+    Parameters
+    ----------
+    x : 1-d array
+        Length N vector of inputs
+    y : 1-d array
+        Length N vector of outputs
+    alphas : 1-d array, `optional`
+             Smoothing parameters to compare, as in ``loess``. By default,
+             ``gcv_alphas``
+
+    Returns
+    -------
+    alpha : float
+            Smoothing parameter of ``alphas`` with the lowest score
+    gcv : 1-d array
+          Generalized cross-validation score ``N*RSS/(N - tr(H))**2`` of
+          each of ``alphas``, where RSS is the residual sum of squares and
+          H the hat matrix
+
+    Notes
+    -----
+    Generalized cross validation assumes independent errors. The errors of
+    the MSD at neighbouring time-lags are correlated, so on the example
+    data it selects smoothing parameters of about 0.001, smaller than the
+    hand-tuned default of ``analysis_tools.msd_local_pwr_law()``.
+    """
+    if alphas is None:
+        alphas = gcv_alphas
+    alphas = np.atleast_1d(np.asarray(alphas, dtype=float))
+    n = len(x)
+    gcv = np.empty(len(alphas))
+    for k, [S0, S1, S2, T0, T1, det] in enumerate(
+            _loess_moments(x, y, alphas)):
+        yp = (S2*T0 - S1*T1)/det
+        # The weight of each input in its own regression is 1
+        trace = np.sum(S2/det)
+        gcv[k] = n*np.sum(np.square(y-yp))/(n-trace)**2.
+    # The scores are NaN if the outputs are
+    return [alphas[np.argmin(np.where(np.isnan(gcv), np.inf, gcv))], gcv]
+
+
+# Smoothing parameters compared by loess_gcv by default
+gcv_alphas = np.logspace(-3., 0., 16)
+
+
+def loess_sweep(x, y, alphas):
+    """ Degree 1 ``loess`` of the same data with many smoothing parameters
+
+    The local regressions are solved in closed form from weighted moments,
+    as in ``loess_gcv``, and the differences between the inputs are shared
+    by all of the smoothing parameters.
+
+    Parameters
+    ----------
+    x : 1-d array
+        Length N vector of inputs
+    y : 1-d array
+        Length N vector of outputs
+    alphas : 1-d array
+             Length B vector of smoothing parameters, as in ``loess``
+
+    Returns
+    -------
+    Theta : 3-d array
+            Array of shape ``(B, 2, N)`` of the local intercepts and slopes
+            for each smoothing parameter, as returned by ``loess``
+    Yp : 2-d array
+         Array of shape ``(B, N)`` of smoothed outputs
+    """
+    alphas = np.atleast_1d(np.asarray(alphas, dtype=float))
+    Theta = np.empty((len(alphas), 2, len(x)))
+    Yp = np.empty((len(alphas), len(x)))
+    for k, [S0, S1, S2, T0, T1, det] in enumerate(
+            _loess_moments(x, y, alphas)):
+        # Local line about each input, y = yp + slope*(x - x_i)
+        Yp[k] = (S2*T0 - S1*T1)/det
+        Theta[k, 1] = (S0*T1 - S1*T0)/det
+        Theta[k, 0] = Yp[k] - Theta[k, 1]*x
+    return [Theta, Yp]
+
+
+def _loess_moments(x, y, alphas):
+    """ Weighted moments ``[S0, S1, S2, T0, T1, det]`` of the inputs and
+    outputs about each input of a degree 1 ``loess``, for each smoothing
+    parameter of ``alphas`` in turn. ``det`` is the determinant of the
+    local normal equations. """
+    D = x[None, :] - x[:, None]
+    D2 = np.square(D)
+    span = np.sqrt((x[0]-x[-1])**2.)
+    for alpha in alphas:
+        W = np.exp(-D2/(alpha*span))
+        WD = W*D
+        S0 = W.sum(axis=1)
+        S1 = WD.sum(axis=1)
+        S2 = np.einsum('ij,ij->i', WD, D)
+        T0 = W.dot(y)
+        T1 = WD.dot(y)
+        yield [S0, S1, S2, T0, T1, S0*S2 - np.square(S1)]
+
+
+def loess_batch(x, Y, degree, alpha, mask=None):
+    """ Locally-weighted regression of many data sets sharing the inputs
+    ``x``, equivalent to calling ``loess`` on each row of ``Y``
+
+    Parameters
+    ----------
+    x : 1-d array
+        Length N vector of inputs
+    Y : 2-d array
+        Array of shape ``(M, N)`` with one data set per row. The results
+        have the same floating point type, but the local normal equations
+        are always solved in double precision.
+    degree : int
+             Degree of the local polynomial (1 or 2)
+    alpha : float
+            Smoothing parameter, as in ``loess``
+    mask : 2-d array of booleans, `optional`
+           Array of shape ``(M, N)`` which is ``False`` where a data set has
+           no valid output, e.g. outside of its range after
+           ``interp_stack``. Invalid outputs are given zero weight in the
+           regression, and the results are `NaN` at those inputs. The
+           bandwidth is relative to the range of valid inputs of each data
+           set, as when calling ``loess`` on the valid outputs alone.
+
+    Returns
+    -------
+    Theta : 3-d array
+            Array of shape ``(M, degree+1, N)`` of local polynomial
+            coefficients for each data set
+    Yp : 2-d array
+         Array of shape ``(M, N)`` of smoothed outputs
+    """
+    X = np.vander(x, degree+1, increasing=True)
+    dtype = Y.dtype if np.issubdtype(Y.dtype, np.floating) else float
+    if mask is None:
+        L = loess_operators.get(x, degree, alpha)[0].astype(dtype,
+                                                           copy=False)
+        Theta = np.einsum('pij,mj->mpi', L, Y)
+    else:
+        # The weights differ between data sets, so solve the local normal
+        # equations of every data set at every input
+        x_first = x[np.argmax(mask, axis=1)]
+        x_last = x[len(x)-1-np.argmax(mask[:, ::-1], axis=1)]
+        Wm = _loess_weights(x, alpha, x_last-x_first)*mask[:, None, :]
+        Yz = np.where(mask, Y, 0.)
+        XtWX = np.einsum('mij,jp,jq->mipq', Wm, X, X, optimize=True)
+        XtWy = np.einsum('mij,jp,mj->mip', Wm, X, Yz, optimize=True)
+        Theta = linalg.solve(XtWX[mask], XtWy[mask])
+        Theta_full = np.full(Y.shape + (degree+1,), np.nan, dtype=dtype)
+        Theta_full[mask] = Theta
+        Theta = np.transpose(Theta_full, (0, 2, 1))
+    Yp = np.einsum('mpi,ip->mi', Theta, X.astype(dtype, copy=False))
+    return [Theta, Yp]
+
 
-        #First feature in the X array is a constant
-        #Second feature is the value of x
-        #Third feature is the value of x**2.
-        const = np.ones(n)
-        X = np.array([const,x,x**2.]).T
-        W = np.identity(n)
+def _loess_weights(x, alpha, span=None):
+    """ Gaussian weights of every observation (columns) in the regression
+    at every reference point (rows) of ``loess``. If the range of the
+    inputs ``span`` is given for M data sets, the weights have shape
+    ``(M, N, N)``. """
+    if span is None:
         tau = alpha * np.sqrt((x[0]-x[-1])**2.)
+        return np.exp(-((x[None, :]-x[:, None])**2.)/(tau))
+    tau = alpha * np.abs(span)
+    return np.exp(-((x[None, :]-x[:, None])**2.)[None, :, :] /
+                  tau[:, None, None])
+
+
+def interp_stack(x_list, y_list, x_new):
+    """ Linearly interpolate many data sets with different inputs onto a
+    shared vector of inputs
+
+    The interpolation of all data sets is performed at once, so that
+    data sets of different lengths can be stacked into a dense array.
+
+    Parameters
+    ----------
+    x_list : list of 1-d arrays
+             Increasing inputs of each of the M data sets, each with at
+             least 2 values
+    y_list : list of 1-d arrays
+             Outputs of each data set at the inputs in ``x_list``
+    x_new : 1-d array
+            Length N vector of inputs at which to interpolate every
+            data set
+
+    Returns
+    -------
+    Y : 2-d array
+        Array of shape ``(M, N)`` of interpolated outputs, which are `NaN`
+        outside of the range of inputs of each data set
+    mask : 2-d array of booleans
+           Array of shape ``(M, N)`` which is ``True`` where ``x_new`` lies
+           within the range of inputs of each data set
+    """
+    x_new = np.asarray(x_new, dtype=float)
+    m = len(x_list)
+    lengths = np.array([len(xi) for xi in x_list])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    # Pad the data sets to the same length by repeating their last point
+    pad_inds = np.minimum(np.arange(lengths.max())[None, :],
+                          lengths[:, None]-1)
+    flat_inds = starts[:, None] + pad_inds
+    X = np.concatenate([np.asarray(xi, dtype=float) for xi in x_list])
+    X = X[flat_inds]
+    Yd = np.concatenate([np.asarray(yi, dtype=float) for yi in y_list])
+    Yd = Yd[flat_inds]
+    # Shift each data set into its own disjoint interval, so that a
+    # single sorted search finds the interval of every new input
+    lo = min(X.min(), x_new.min())
+    span = max(X.max(), x_new.max()) - lo + 1.
+    offsets = span*np.arange(m)[:, None]
+    j = np.searchsorted((X-lo+offsets).ravel(),
+                        (x_new[None, :]-lo+offsets).ravel(), side='right')
+    j = j.reshape(m, len(x_new)) - X.shape[1]*np.arange(m)[:, None] - 1
+    j = np.clip(j, 0, lengths[:, None]-2)
+    rows = np.arange(m)[:, None]
+    x0 = X[rows, j]
+    x1 = X[rows, j+1]
+    y0 = Yd[rows, j]
+    y1 = Yd[rows, j+1]
+    Y = y0 + (y1-y0)*(x_new[None, :]-x0)/(x1-x0)
+    mask = ((x_new[None, :] >= X[:, 0:1]) &
+            (x_new[None, :] <= X[rows[:, 0], lengths-1][:, None]))
+    Y[~mask] = np.nan
+    return [Y, mask]
 
-        #Construct the theta matrix
-        Theta = np.zeros([3,n])
-
-        #Construct the prediction vector
-        yp = np.zeros(n)
-        #Loop over observations
-        for i in range(n):
-            #compute the weight matrix
-            W = gaussian_weight(x,i,tau)
-            #perform linear regression
-            theta = weighted_linear_reg(X,y,W)
-            Theta[:,i] = theta
-            yp[i] = np.dot(X[i,:],theta)
-        return [Theta,yp]
 
 ##################################
 #Numerical Laplace transform
@@ -124,9 +657,72 @@ def laplace(t, f, S):
     return L
 
 
-def get_cross_validation_score(t, y, func, p0=None):
-    """ Obtain the leave-one-out cross-validation score for
-    a functional model of a data set over a given fitting window.
+def nearest_index(x, values):
+    """ Find the indices of the elements of a sorted vector nearest to
+    the given values, by binary search
+
+    Equivalent to ``np.argmin(np.abs(x-value))`` for each value, including
+    the choice of the lower index for a value half-way between two
+    elements, but takes O(log N) operations per value.
+
+    Parameters
+    ----------
+    x : 1-d array
+        Length N vector sorted in increasing order, e.g. the time-lags
+    values : float or 1-d array
+             Values to locate in ``x``
+
+    Returns
+    -------
+    inds : int or 1-d array of ints
+           Indices of the elements of ``x`` nearest to ``values``
+    """
+    x = np.asarray(x)
+    values = np.asarray(values)
+    if len(x) == 1:
+        return np.zeros(values.shape, dtype=int)[()]
+    inds = np.clip(np.searchsorted(x, values), 1, len(x)-1)
+    inds = inds - (values-x[inds-1] <= x[inds]-values)
+    # First of any repeated elements, as chosen by argmin
+    return np.searchsorted(x, x[inds])[()]
+
+
+def window_slices(t, twindows):
+    """ Slices of ``t`` covering each closed interval in ``twindows``, from
+    the element nearest to the start to the element nearest to the end.
+
+    The slices are cached, so that curves sharing the same time-lags and
+    fitting windows only locate the windows once.
+
+    Parameters
+    ----------
+    t : 1-d array
+        Vector of the independent variable, sorted in increasing order
+    twindows : List of len 2 lists
+               List of the form [[t0, tend1], [t0, tend2], ...]
+
+    Returns
+    -------
+    slices : tuple of slices
+             Slice of ``t`` for each window in ``twindows``
+    """
+    t = np.ascontiguousarray(t, dtype=float)
+    twindows = tuple(tuple(float(ti) for ti in tw) for tw in twindows)
+    return _window_slices(t.tobytes(), twindows)
+
+
+@functools.lru_cache(maxsize=64)
+def _window_slices(t_bytes, twindows):
+    t = np.frombuffer(t_bytes, dtype=float)
+    tinds = nearest_index(t, np.array(twindows).reshape(-1, 2))
+    return tuple(slice(i0, i1+1) for i0, i1 in tinds)
+
+
+def get_cross_validation_score(t, y, func, p0=None, diagnostics=None,
+                               budget=None, executor=None, cv='loo', k=10,
+                               seed=0):
+    """ Obtain the cross-validation score for a functional model of a data
+    set over a given fitting window.
 
     Parameters
     ----------
@@ -141,41 +737,157 @@ def get_cross_validation_score(t, y, func, p0=None):
 
     p0 : 1-d array or list, `optional`
          Initial guesses for the M parameters to fit, [p1, p2, ..., pM]
+    diagnostics : CurveDiagnostics, `optional`
+                  Record in which to count the fits and their failures
+    budget : FitBudget, `optional`
+             Limits on the function evaluations and time of the fits
+    executor : concurrent.futures.Executor, `optional`
+               Executor whose ``map`` method is used to perform the fits
+               concurrently, e.g. a ``ThreadPoolExecutor`` or a
+               ``ProcessPoolExecutor`` (which requires ``func`` to be
+               picklable). The score is the same as without an executor.
+    cv : {'loo', 'kfold', 'subsample'}, `optional`
+         Points held out of the fits. With ``'loo'``, each point is left
+         out in turn, which needs one fit per point. With ``'kfold'``, the
+         points are split into ``k`` folds, each block of ``k`` consecutive
+         points being spread at random over the folds, and each fold is
+         left out in turn. With ``'subsample'``, each of ``k`` points drawn at
+         random is left out in turn. The score then needs ``k`` fits
+         whatever the number of points. With ``k`` at least the number of
+         points, both give the leave-one-out score.
+    k : int, `optional`
+        Number of folds or of held-out points
+    seed : int, `optional`
+           Seed of the random assignment of the points to folds or of the
+           held-out points, so that the score is reproducible
 
     Returns
     -------
     cv : float 
-         Leave-one-out cross-validation score for the model
+         Cross-validation score for the model
+    """
+    folds = cv_folds(len(t), cv, k, seed)
+    params = _map_fits(func, _cv_fits(t, y, p0, folds), diagnostics, budget,
+                       executor)
+    return _cv_score(t, y, func, params, folds, diagnostics)
+
+
+def cv_folds(n, cv='loo', k=10, seed=0):
+    """ Indices of the points held out of each fit of the cross validation
+    of ``n`` points, see ``get_cross_validation_score``
+
+    Parameters
+    ----------
+    n : int
+        Number of points
+    cv : {'loo', 'kfold', 'subsample'}, `optional`
+         Cross-validation strategy
+    k : int, `optional`
+        Number of folds or of held-out points
+    seed : int, `optional`
+           Seed of the random assignment of the points
+
+    Returns
+    -------
+    folds : list of 1d-arrays
+            Sorted indices of the points held out of each fit
     """
+    if cv == 'loo':
+        return [np.array([i]) for i in range(n)]
+    # The first draws are the same for any n, so that the nested windows of
+    # minimize_cv_error hold out mostly the same points
+    rng = np.random.RandomState(seed)
+    k = min(k, n)
+    if cv == 'kfold':
+        # Each block of k consecutive points has one point in each fold
+        labels = np.concatenate([rng.permutation(k)
+                                 for i in range(-(-n//k))])[:n]
+        folds = [np.flatnonzero(labels == i) for i in range(k)]
+    elif cv == 'subsample':
+        folds = np.argsort(rng.rand(n), kind='stable')[:k, None]
+    else:
+        raise ValueError("cv must be 'loo', 'kfold' or 'subsample'")
+    # Order the folds by their first point, so that the errors are summed
+    # in the order of the points
+    folds = [np.sort(fold) for fold in folds]
+    return sorted(folds, key=lambda fold: fold[0])
+
+
+def _cv_fits(t, y, p0, folds):
+    """ Fits ``(t, y, p0, maxfev)`` performed by
+    ``get_cross_validation_score``: the fit with each fold removed, then the
+    fit to all of the points """
+    fits = [(np.delete(t, fold), np.delete(y, fold), p0, 10000)
+            for fold in folds]
+    fits.append((t, y, p0, 10000))
+    return fits
+
+
+def _cv_score(t, y, func, params, folds, diagnostics=None):
+    """ Cross-validation score from the parameters of the fits listed by
+    ``_cv_fits`` (`None` for the fits that failed) """
+    n = len(t)
+    held_out = []
+    err = {}
+    # Squared error at each held-out (t, y) point of the
+    # fit to func with its fold removed
+    for fold, p in zip(folds, params):
+        for i in fold:
+            if p is None:
+                err[i] = 1.e3
+                diag.count(diagnostics, 'cv_point_penalties')
+            else:
+                yfiti = func(t[i], *p)
+                err[i] = (y[i]-yfiti)**2.
+        held_out.extend(fold)
+    # Average cv scores, summed in the order of the points
     cv = 0.
-    yskip = y
-    tskip = t
-    n = len(tskip)
-    # Loop over each (t, y) point and perform a
-    # fit to func with that point removed
-    # calculate MSE for that point
-    for i in range(n):
-        ytest = np.delete(yskip, i)
-        ttest = np.delete(tskip, i)
-        try:
-            paramsi = curve_fit(func, ttest, ytest, p0=p0, maxfev=10000)[0]
-            yfiti = func(tskip[i], *paramsi)
-            erri = (yskip[i]-yfiti)**2.
-        except RuntimeError:
-            erri = 1.e3
-        cv = cv + erri
-    # Average cv scores
-    cv = cv/np.float(n)
+    for i in sorted(held_out):
+        cv = cv + err[i]
+    cv = cv/float(len(held_out))
 
     # If fit is not found for this window, penalize strongly
-    try:
-        paramsi = curve_fit(func, t, y, p0=p0, maxfev=10000)[0]
-    except RuntimeError:
+    if params[len(folds)] is None:
         cv = 1.e6
+        diag.count(diagnostics, 'cv_window_penalties')
     return cv
 
 
-def minimize_cv_error(t, y, twindows, func, p0=None):
+def _fit_task(args):
+    """ Perform one fit, possibly in a worker of an executor. ``args`` is
+    ``(func, t, y, p0, maxfev, diagnostics, budget)``. Returns
+    ``[params, diagnostics]``, where ``params`` is `None` if the fit
+    failed. """
+    func, t, y, p0, maxfev, diagnostics, budget = args
+    try:
+        params = _curve_fit(func, t, y, p0, maxfev, diagnostics, budget)
+    except RuntimeError:
+        params = None
+    return [params, diagnostics]
+
+
+def _map_fits(func, fits, diagnostics=None, budget=None, executor=None):
+    """ Perform the fits ``(t, y, p0, maxfev)`` of ``func`` in ``fits``, one
+    after the other or with the workers of ``executor``. Returns the
+    parameters of each fit in the same order, `None` for the fits that
+    failed. The counts of the workers are added to ``diagnostics``. """
+    if executor is None:
+        return [_fit_task((func, t, y, p0, maxfev, diagnostics, budget))[0]
+                for t, y, p0, maxfev in fits]
+    record = diagnostics is not None
+    results = list(executor.map(
+        _fit_task, [(func, t, y, p0, maxfev,
+                     diag.CurveDiagnostics() if record else None, budget)
+                    for t, y, p0, maxfev in fits]))
+    if record:
+        for params, worker_diagnostics in results:
+            diagnostics.merge(worker_diagnostics)
+    return [params for params, worker_diagnostics in results]
+
+
+def minimize_cv_error(t, y, twindows, func, p0=None, diagnostics=None,
+                      budget=None, method='grid', full_output=False,
+                      executor=None, cv='loo', k=10, seed=0):
     """ Find the fitting interval that minimizes the cross-validation
     error for a model fitted to a sub-interval of a dataset, 
     given a set of possible intervals in the independent variable 
@@ -196,8 +908,49 @@ def minimize_cv_error(t, y, twindows, func, p0=None):
            `f(t, p1, p2, ..., pM)` where `t` is the independent variable and
            `p1, p2, ..., pM` is a set of M parameters to fit.
 
-    p0 : 1-d array or list, `optional`
-         Initial guesses for the M parameters to fit, [p1, p2, ..., pM]
+    p0 : 1-d array, list or callable, `optional`
+         Initial guesses for the M parameters to fit, [p1, p2, ..., pM].
+         If callable, ``p0(t, y)`` is called with the data in each
+         window to obtain the initial guesses for that window, e.g.
+         ``fit_funcs.stretched_exp_guess``.
+    diagnostics : CurveDiagnostics, `optional`
+                  Record in which to count the fits and their failures
+    budget : FitBudget, `optional`
+             Limits on the function evaluations and time of the fits. A
+             fit that exceeds the per-fit limits is penalized like a fit
+             that does not converge, while exceeding the limits of the
+             whole search raises ``BudgetExceeded``.
+    method : {'grid', 'golden'}, `optional`
+             With ``'grid'``, the cross-validation score of every window in
+             ``twindows`` is evaluated. With ``'golden'``, ``twindows`` only
+             gives the range of the search: the windows start at the first
+             `t0`, and their end is searched over every element of ``t``
+             between the smallest and the largest `tend`, by a golden
+             section search. This assumes that the cross-validation score
+             is unimodal in the end of the window, and needs about
+             ``2*log2(K)`` evaluations for K possible ends.
+    full_output : boolean, `optional`
+                  If `True`, also return a dictionary describing the search
+    executor : concurrent.futures.Executor, `optional`
+               Executor whose ``map`` method is used to perform the fits
+               concurrently, e.g. a ``ThreadPoolExecutor`` or a
+               ``ProcessPoolExecutor`` (which requires ``func`` to be
+               picklable). With ``'grid'``, the fits of all windows are
+               submitted at once, and with ``'golden'``, those of each
+               window. The results are the same as without an executor.
+               With a process pool, each fit is sent a copy of
+               ``budget``, so the per-curve limits are only enforced per
+               task: the function evaluations of each fit are added to
+               those made before the fits were submitted, but not to those
+               of the other fits of the same map.
+    cv : {'loo', 'kfold', 'subsample'}, `optional`
+         Cross-validation strategy, see ``get_cross_validation_score``.
+         ``'kfold'`` and ``'subsample'`` need ``k`` fits per window rather
+         than one per point in the window.
+    k : int, `optional`
+        Number of folds or of held-out points
+    seed : int, `optional`
+           Seed of the random assignment of the points of each window
 
     Returns
     -------
@@ -210,29 +963,249 @@ def minimize_cv_error(t, y, twindows, func, p0=None):
            Optimal parameters for fitting the model ``func`` to the data
            over the sub-interval ``twindow_min``
     CV_min : float
-             Leave-one-out cross-validation error for the model ``func``
-             over the interval ``twindow_min``
+             Cross-validation error for the model ``func`` over the interval
+             ``twindow_min``
+    info : dictionary
+           Only returned if ``full_output`` is `True`. Contains
+           ``'n_evaluations'``, the number of windows whose
+           cross-validation score was evaluated, and ``'twindows'`` and
+           ``'CVs'``, the evaluated windows and their scores in the order
+           of evaluation.
+
+    Notes
+    -----
+    On 61 correlation functions of the example data, with the windows and
+    initial guesses of ``analysis_tools.calc_g1``, 5-fold cross validation
+    selects the same window as leave-one-out for 58 curves, and the
+    intercepts agree to within 0.2%, with 5 times fewer fits. Subsampling
+    20 points selects the same window for about half of the curves, as the
+    scores of neighbouring windows are close, and the intercepts agree to
+    within 0.7%.
     """
-    CVs = []
-    params = []
-    for twindow in twindows:
-        tinds = [np.argmin(np.abs(t-twindow[0])),
-                 np.argmin(np.abs(t-twindow[1]))]
-        tfit = t[tinds[0]: tinds[1]+1]
-        yfit = y[tinds[0]: tinds[1]+1]
-        CVs.append(get_cross_validation_score(tfit, yfit, func, p0))
-        try:
-            paramsi = curve_fit(func, tfit, yfit, p0=p0, maxfev=100000)[0]
-            params.append(paramsi)
-        except RuntimeError:
-            params.append(None)
+    if method == 'grid':
+        windows = window_slices(t, twindows)
+        evaluated = _evaluate_windows(t, y, windows, func, p0, diagnostics,
+                                      budget, executor, (cv, k, seed))
+        evaluated_twindows = [list(tw) for tw in twindows]
+    elif method == 'golden':
+        [evaluated_twindows, evaluated] = _golden_window_search(
+            t, y, twindows, func, p0, diagnostics, budget, executor,
+            (cv, k, seed))
+    else:
+        raise ValueError("method must be 'grid' or 'golden'")
+    CVs = [cv for cv, params in evaluated]
+    diag.count(diagnostics, 'cv_window_evaluations', len(CVs))
     CV_argmin = np.argmin(CVs)
     CV_min = CVs[CV_argmin]
-    twindow_min = twindows[CV_argmin]
-    pmin = params[CV_argmin]
+    twindow_min = evaluated_twindows[CV_argmin]
+    pmin = evaluated[CV_argmin][1]
+    if full_output:
+        info = {'n_evaluations': len(CVs), 'twindows': evaluated_twindows,
+                'CVs': CVs}
+        return [twindow_min, pmin, CV_min, info]
     return [twindow_min, pmin, CV_min]
 
 
+def _evaluate_windows(t, y, windows, func, p0, diagnostics=None, budget=None,
+                      executor=None, cv_spec=('loo', 10, 0)):
+    """ Cross-validation score of the fit of ``func`` over each slice in
+    ``windows`` of the data, and the parameters of the fit to the whole
+    window (`None` if it fails). The fits of all windows are mapped at once.
+    ``cv_spec`` is ``(cv, k, seed)`` of ``get_cross_validation_score``.
+    Returns ``[cv, params]`` for each window. """
+    fits = []
+    window_folds = []
+    for window in windows:
+        tfit = t[window]
+        yfit = y[window]
+        p0_window = p0(tfit, yfit) if callable(p0) else p0
+        folds = cv_folds(len(tfit), *cv_spec)
+        window_folds.append(folds)
+        fits += _cv_fits(tfit, yfit, p0_window, folds)
+        fits.append((tfit, yfit, p0_window, 100000))
+    params = _map_fits(func, fits, diagnostics, budget, executor)
+    evaluated = []
+    first = 0
+    for window, folds in zip(windows, window_folds):
+        n_fits = len(folds) + 1
+        cv = _cv_score(t[window], y[window], func,
+                       params[first:first+n_fits], folds, diagnostics)
+        evaluated.append([cv, params[first+n_fits]])
+        first += n_fits + 1
+    return evaluated
+
+
+def _golden_window_search(t, y, twindows, func, p0, diagnostics=None,
+                          budget=None, executor=None, cv_spec=('loo', 10, 0)):
+    """ Golden section search for the end index of the fitting window with
+    the lowest cross-validation score, between the ends of the shortest and
+    longest windows in ``twindows``. Each end index is evaluated at most
+    once. Returns the evaluated windows ``[[t0, tend], ...]`` and their
+    ``[cv, params]`` in the order of evaluation. """
+    tends = [tw[1] for tw in twindows]
+    start = nearest_index(t, twindows[0][0])
+    [lo, hi] = nearest_index(t, [min(tends), max(tends)])
+    evaluated = {}
+    order = []
+
+    def cv(end):
+        if end not in evaluated:
+            evaluated[end] = _evaluate_windows(t, y, [slice(start, end+1)],
+                                               func, p0, diagnostics, budget,
+                                               executor, cv_spec)[0]
+            order.append(end)
+        return evaluated[end][0]
+
+    invphi = (np.sqrt(5.) - 1.)/2.
+    while hi - lo > 2:
+        step = int(round(invphi*(hi - lo)))
+        [c, d] = [hi - step, lo + step]
+        if d <= c:
+            d = c + 1
+        if cv(c) <= cv(d):
+            hi = d
+        else:
+            lo = c
+    for end in range(lo, hi + 1):
+        cv(end)
+    return [[[t[start], t[end]] for end in order],
+            [evaluated[end] for end in order]]
+
+
+class FitTimeout(RuntimeError):
+    """ Raised when a single fit exceeds the time or function evaluations
+    allowed by a ``FitBudget``. Like a fit that does not converge, it is
+    penalized in the cross validation. """
+
+
+class BudgetExceeded(Exception):
+    """ Raised when the fits for a correlation function exceed the total
+    function evaluations or time allowed by a ``FitBudget`` """
+
+
+class FitBudget(object):
+    """ Limits on the work spent fitting a single correlation function, so
+    that a pathological correlation function cannot stall a study
+
+    Parameters
+    ----------
+    maxfev : int, `optional`
+             Maximum number of function evaluations of each fit. A fit
+             reaching it raises ``FitTimeout``.
+    timeout : float, `optional`
+              Maximum wall time (in seconds) of each fit. A fit exceeding it
+              raises ``FitTimeout``, which is penalized like a fit that
+              does not converge.
+    curve_maxfev : int, `optional`
+                   Maximum total number of function evaluations of all the
+                   fits for one correlation function
+    curve_timeout : float, `optional`
+                    Maximum total wall time (in seconds) of all the fits for
+                    one correlation function
+
+    Notes
+    -----
+    Exceeding ``curve_maxfev`` or ``curve_timeout`` raises
+    ``BudgetExceeded`` out of the search for the intercept. The
+    ``analyze_*`` drivers then skip the correlation function, and
+    ``analysis_tools.batch_dlsur_analysis`` returns `NaN` for it. So does
+    a search in which ``maxfev`` or ``timeout`` stopped fits and no window
+    could be fit. Fits that fail without reaching the limits of the budget
+    raise ``RuntimeError`` as they would without a budget.
+
+    The function evaluations are counted under a lock, so a budget may be
+    shared by the fits of a ``ThreadPoolExecutor``.
+    """
+
+    def __init__(self, maxfev=None, timeout=None, curve_maxfev=None,
+                 curve_timeout=None):
+        self.maxfev = maxfev
+        self.timeout = timeout
+        self.curve_maxfev = curve_maxfev
+        self.curve_timeout = curve_timeout
+        self.nfev = 0
+        self.t_start = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Start spending the budget on a new correlation function
+
+        Returns
+        -------
+        budget : FitBudget
+                 Copy of the budget with its function evaluations and wall
+                 time counted from now
+        """
+        budget = FitBudget(self.maxfev, self.timeout, self.curve_maxfev,
+                           self.curve_timeout)
+        budget.t_start = time.perf_counter()
+        return budget
+
+    def wrap(self, func, maxfev):
+        """ Wrap the model ``func`` of a fit to enforce the budget, and limit
+        the ``maxfev`` of the fit to that of the budget. Returns
+        ``[func, maxfev]``. """
+        with self._lock:
+            if self.t_start is None:
+                self.t_start = time.perf_counter()
+        if self.maxfev is not None:
+            maxfev = min(maxfev, self.maxfev)
+        t_fit = time.perf_counter()
+
+        def budgeted(*args):
+            with self._lock:
+                self.nfev += 1
+                nfev = self.nfev
+            now = time.perf_counter()
+            if self.curve_maxfev is not None and nfev > self.curve_maxfev:
+                raise BudgetExceeded('more than %d function evaluations'
+                                     % self.curve_maxfev)
+            if self.curve_timeout is not None and \
+                    now - self.t_start > self.curve_timeout:
+                raise BudgetExceeded('fits took longer than %g s'
+                                     % self.curve_timeout)
+            if self.timeout is not None and now - t_fit > self.timeout:
+                raise FitTimeout('fit took longer than %g s' % self.timeout)
+            return func(*args)
+        return [budgeted, maxfev]
+
+
+def _curve_fit(func, t, y, p0, maxfev, diagnostics=None, budget=None):
+    """ Fit ``func`` to the data with ``scipy.optimize.curve_fit``,
+    counting the fit and whether it exhausted ``maxfev`` or timed out in
+    ``diagnostics``, and enforcing ``budget``. Returns the optimal
+    parameters. """
+    diag.count(diagnostics, 'curve_fit_calls')
+    limited = False
+    if budget is not None:
+        limited = budget.maxfev is not None and budget.maxfev < maxfev
+        [func, maxfev] = budget.wrap(func, maxfev)
+    try:
+        return curve_fit(func, t, y, p0=p0, maxfev=maxfev)[0]
+    except FitTimeout:
+        diag.count(diagnostics, 'fit_timeouts')
+        raise
+    except RuntimeError as e:
+        if 'maxfev' not in str(e):
+            raise
+        diag.count(diagnostics, 'maxfev_exhausted')
+        if not limited:
+            raise
+        # The fit was stopped by the budget rather than by its own maxfev
+        diag.count(diagnostics, 'fit_timeouts')
+        raise FitTimeout('fit needed more than %d function evaluations'
+                         % maxfev)
+
+
 def laplace_merge(omega, G1, G2, G1_Fdirect, G2_Fdirect):
     """ Find the interval where the Laplace transform is valid over
     the frequency space and replace the Fourier transform data with 
@@ -8,15 +8,16 @@ import matplotlib as mpl
 def plot_conditions(df_path, condition_dir, replicate_dict, cond_color=None, 
 					cond_label=None, plot_ci=True, plot_G_replicates=True, 
 					plot_alpha_replicates=True, plot_scattering=False, 
-					add_scaling=False, scaling_frac=None):
+					add_scaling=False, scaling_frac=None, scattering=None):
 
 	""" Plot DLS microrheology output data for
     multiple conditions after analysis and saving as dataframe.
 
     Parameters
     ----------
-    df_path : str
-    		  Path to saved dataframe to plot
+    df_path : str, DataFrame or Study
+    		  Path to saved dataframe to plot, or the results themselves.
+    		  See ``plot_tools.load_results``
     condition_dir : dictionary
     			    Dictionary of conditions and respective folders
     cond_color : dictionary, `optional`
@@ -40,10 +41,14 @@ def plot_conditions(df_path, condition_dir, replicate_dict, cond_color=None,
     scaling_frac : list of float, `optional`
     			   List of 2 floats, where the first number is numerator 
     			   of fraction and second is denominator of fraction
+    scattering : str or DataFrame, `optional`
+    			 Table of scattering intensities, or the path to it. By
+    			 default, it is found from ``df_path``.
+    			 See ``plot_tools.load_scattering``
     """
 	
 	conditions = list(condition_dir.keys())
-	df = pd.read_pickle(df_path)
+	df = plot_tools.load_results(df_path)
 
 	# set colors and labels in dictionaries
 	if cond_color == None:
@@ -141,15 +146,11 @@ def plot_conditions(df_path, condition_dir, replicate_dict, cond_color=None,
 		rc('lines', markersize=10)
 		rc('lines', linewidth=3)
 
+		scattering_df = plot_tools.load_scattering(df_path, scattering)
 		for condition in conditions:
-			dfi = df[df['condition'] == condition]
-			ids = set(dfi['replicate'].values)
-			for idx in ids:
-				epos = dfi[dfi['replicate'] == idx]['epos'].values
-				scattering = dfi[dfi['replicate'] == idx]['scattering'].values
-				plot_over = np.argwhere(epos)
-				plt.plot(epos[plot_over],scattering[plot_over],color=cond_color[condition],
-					     linestyle='None',marker='.')
+			dfi = scattering_df[scattering_df['condition'] == condition]
+			plt.plot(dfi['epos'].values,dfi['scattering'].values,color=cond_color[condition],
+				     linestyle='None',marker='.')
 
 		# Define line objects for legend so that line color is black rather than
 		# inheriting the color of one of the conditions
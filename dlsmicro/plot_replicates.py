@@ -8,15 +8,16 @@ import matplotlib as mpl
 def plot_replicates(df_path, replicates, replic_color=None,
 					plot_ci=True, plot_G_replicates=True,
 					plot_alpha_replicates=True, plot_scattering=False,
-					add_scaling=False, scaling_frac=None):
+					add_scaling=False, scaling_frac=None, scattering=None):
 
 	""" Plot DLS microrheology output data for
     multiple replicates after analysis and saving as dataframe.
 
     Parameters
     ----------
-    df_path : str
-    		  Path to saved dataframe to plot
+    df_path : str, DataFrame or Study
+    		  Path to saved dataframe to plot, or the results themselves.
+    		  See ``plot_tools.load_results``
     replicates : list of ints
                  List of ints corresponding to the replicate number
     replic_color : dictionary, `optional`
@@ -39,9 +40,13 @@ def plot_replicates(df_path, replicates, replic_color=None,
     scaling_frac : list of float, `optional`
     			   List of 2 floats, where the first number is numerator 
     			   of fraction and second is denominator of fraction
+    scattering : str or DataFrame, `optional`
+    			 Table of scattering intensities, or the path to it. By
+    			 default, it is found from ``df_path``.
+    			 See ``plot_tools.load_scattering``
     """
 
-	df = pd.read_pickle(df_path)
+	df = plot_tools.load_results(df_path)
 
 	# set colors and labels in dictionaries
 	if replic_color == None:
@@ -116,11 +121,10 @@ def plot_replicates(df_path, replicates, replic_color=None,
 
 		fig, ax1 = plt.subplots(1, 1)
 
+		scattering_df = plot_tools.load_scattering(df_path, scattering)
 		for replicate in replicates:
-			epos = df[df['replicate'] == replicate]['epos'].values
-			scattering = df[df['replicate'] == replicate]['scattering'].values
-			plot_over = np.argwhere(epos)
-			plt.plot(epos[plot_over],scattering[plot_over],
+			dfi = scattering_df[scattering_df['replicate'] == replicate]
+			plt.plot(dfi['epos'].values,dfi['scattering'].values,
 				     color=replic_color[replicate],linestyle='None',marker='.')
 
 		# Define line objects for legend so that line color is black rather than
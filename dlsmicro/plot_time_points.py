@@ -6,15 +6,16 @@ import pandas as pd
 
 def plot_time_points(df_path, n_points, plot_G_replicates=True,
 					plot_MSD_replicates=True, plot_scattering=False, 
-					add_scaling=False, scaling_frac=None):
+					add_scaling=False, scaling_frac=None, scattering=None):
 
 	""" Plot DLS microrheology output data for time-dependent 
 	measurements after analysis and saving as dataframe.
 
     Parameters
     ----------
-    df_path : str
-    		  Path to saved dataframe to plot
+    df_path : str, DataFrame or Study
+    		  Path to saved dataframe to plot, or the results themselves.
+    		  See ``plot_tools.load_results``
     n_points : int
                Corresponds to the number of measurements taken over 
                duration of experiment
@@ -30,6 +31,10 @@ def plot_time_points(df_path, n_points, plot_G_replicates=True,
     scaling_frac : list of float, `optional`
     			   List of 2 floats, where the first number is numerator 
     			   of fraction and second is denominator of fraction
+    scattering : str or DataFrame, `optional`
+    			 Table of scattering intensities, or the path to it. By
+    			 default, it is found from ``df_path``.
+    			 See ``plot_tools.load_scattering``
     """
 
 	# Plot style options
@@ -51,7 +56,7 @@ def plot_time_points(df_path, n_points, plot_G_replicates=True,
 	cmap = plt.cm.get_cmap('viridis',len(time_points))
 	colors = [cmap(i) for i in range(len(time_points))]
 
-	df = pd.read_pickle(df_path)
+	df = plot_tools.load_results(df_path)
 
 	if plot_MSD_replicates:
 		for i, tp in enumerate(time_points):
@@ -89,11 +94,11 @@ def plot_time_points(df_path, n_points, plot_G_replicates=True,
 		plt.show()
 
 	if plot_scattering:
-		dfi = df[df['time_point'] == time_points[0]]
-		epos = dfi['epos'].values
-		scattering = dfi['scattering'].values
-		plot_over = np.argwhere(epos)
-		plt.plot(epos[plot_over],scattering[plot_over],linestyle='None',marker='.')
+		scattering_df = plot_tools.load_scattering(df_path, scattering)
+		if 'time_point' in scattering_df.columns:
+			scattering_df = scattering_df[scattering_df['time_point'] == time_points[0]]
+		plt.plot(scattering_df['epos'].values,scattering_df['scattering'].values,
+			     linestyle='None',marker='.')
 		plt.ylabel('Scattering Intensity')
 		plt.xlabel('Position')
 		plt.yscale('log')
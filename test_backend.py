@@ -0,0 +1,427 @@
+""" Checks of the numerical utilities of the DLSuR backend
+
+Run with ``python -m pytest test_backend.py``
+"""
+import logging
+import os
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from dlsmicro.analyze_time_points import analyze_time_points
+from dlsmicro.analyze_time_points import follow_time_points
+from dlsmicro.backend import analysis_tools
+from dlsmicro.backend import diagnostics as diag
+from dlsmicro.backend import io
+from dlsmicro.backend import pipeline
+from dlsmicro.backend import synthetic
+from dlsmicro.backend import utils
+
+# Scattering geometry of the Zetasizer
+q = analysis_tools.calc_q(1.333, 173.*np.pi/180., 633.)
+r = 250.
+T = 310.15
+
+
+def synthetic_stack(n_curves, seed=0):
+    """ Stack of synthetic correlation functions truncated at a shared
+    time-lag, and their intercept """
+    data = synthetic.synthetic_curves(n_curves, r=r, T=T, q=q, seed=seed)
+    g = data['correlation']
+    t = analysis_tools.truncate_correlation(data['time_lag'],
+                                            g.max(axis=0))[0]
+    return [t, g[:, 3:3+len(t)], 0.9]
+
+
+def example_curves():
+    """ Truncated correlation functions of the replicate example data """
+    curves = []
+    for i in range(1, 4):
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'example_data', 'replicate_example',
+                                 'replicate%d' % i, 'exported2.csv')
+        data_dict = io.read_zetasizer_csv_to_dict(file_path, 0)
+        curves.append(analysis_tools.truncate_correlation(
+            data_dict['time_lag'], data_dict['correlation']))
+    return curves
+
+
+def test_batch_dtype():
+    [t, g, g0] = synthetic_stack(4)
+    for dtype in [np.float32, np.float64]:
+        results = analysis_tools.batch_dlsur_analysis(t, g, True, r, T, q,
+                                                      g0=g0, dtype=dtype)
+        for key in ['omega', 'msd_smooth', 'alpha', 'G1', 'G2']:
+            assert results[key].dtype == dtype, key
+
+
+def test_workspace_dtype():
+    workspace = utils.Workspace(10)
+    a = workspace.array('G', dtype=np.float32)
+    b = workspace.array('G')
+    assert (a.dtype, b.dtype, workspace.allocations) == (np.float32, float, 2)
+    assert workspace.array('G', 5, dtype=np.float32).base is a.base
+    assert workspace.allocations == 2
+
+
+def test_nearest_index():
+    x = np.concatenate([np.logspace(0, 5, 50), [1.e5, 2.e5]])
+    values = np.concatenate([x, 0.5*(x[1:]+x[:-1]), [-1., 0.5, 1.e6],
+                             np.random.RandomState(0).uniform(0, 3.e5, 100)])
+    inds = utils.nearest_index(x, values)
+    assert np.array_equal(inds, [np.argmin(np.abs(x-v)) for v in values])
+    assert utils.nearest_index(x, 10.) == np.argmin(np.abs(x-10.))
+    assert utils.nearest_index([3.], 10.) == 0
+
+
+def test_interp_stack():
+    rng = np.random.RandomState(0)
+    x_list = [np.sort(rng.uniform(0, 10, n)) for n in [5, 12, 30]]
+    y_list = [rng.normal(size=len(xi)) for xi in x_list]
+    x_new = np.linspace(-1, 11, 40)
+    [Y, mask] = utils.interp_stack(x_list, y_list, x_new)
+    for xi, yi, Yi, mi in zip(x_list, y_list, Y, mask):
+        assert np.array_equal(mi, (x_new >= xi[0]) & (x_new <= xi[-1]))
+        assert np.allclose(Yi[mi], np.interp(x_new[mi], xi, yi))
+        assert np.all(np.isnan(Yi[~mi]))
+
+
+def test_cv_folds():
+    for cv in ['loo', 'kfold', 'subsample']:
+        folds = utils.cv_folds(23, cv=cv, k=5)
+        assert all(np.array_equal(fold, np.sort(fold)) for fold in folds)
+        assert [fold[0] for fold in folds] == sorted(fold[0] for fold in folds)
+        points = np.concatenate(folds)
+        assert len(np.unique(points)) == len(points)
+        if cv != 'subsample':
+            assert np.array_equal(np.sort(points), np.arange(23))
+    # The points of the shorter windows are held out in the same folds
+    short = utils.cv_folds(20, cv='kfold', k=5)
+    long = utils.cv_folds(23, cv='kfold', k=5)
+    assert (sorted(tuple(fold) for fold in short) ==
+            sorted(tuple(fold[fold < 20]) for fold in long))
+
+
+def test_loess_cache(tmp_path):
+    x = np.log(np.logspace(0, 4, 60))
+    cache = utils.LoessOperatorCache(directory=str(tmp_path))
+    [L, H] = cache.get(x, 1, 0.3)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert not H.flags.writeable
+    assert np.allclose(H, np.einsum('ip,pij->ij',
+                                    np.vander(x, 2, increasing=True),
+                                    utils.loess_operator(x, 1, 0.3)))
+    [L2, H2] = cache.get(x, 1, 0.3)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert L2 is L and H2 is H
+    cache.get(x, 1, 0.4)
+    assert (cache.hits, cache.misses) == (1, 2)
+    # A new session loads the operators saved by the first one
+    reloaded = utils.LoessOperatorCache(directory=str(tmp_path))
+    [L3, H3] = reloaded.get(x, 1, 0.3)
+    assert (reloaded.hits, reloaded.misses) == (1, 0)
+    assert np.array_equal(L3, L) and np.array_equal(H3, H)
+    # Operators larger than the cache are built but not kept in memory
+    small = utils.LoessOperatorCache(max_bytes=0)
+    small.get(x, 1, 0.3)
+    small.get(x, 1, 0.3)
+    assert (small.hits, small.misses, small.nbytes) == (0, 2, 0)
+
+
+def test_batch_matches_single_curve():
+    [t, g, g0] = synthetic_stack(3)
+    results = analysis_tools.batch_dlsur_analysis(t, g, True, r, T, q, g0=g0)
+    for i in range(len(g)):
+        df = analysis_tools.full_dlsur_analysis(t, g[i], True, r, T, q,
+                                                None, None,
+                                                calc_g1_kws={'g0': g0})
+        assert np.allclose(results['omega'], df['omega'])
+        for key in ['msd_smooth', 'alpha', 'G1', 'G2']:
+            assert np.allclose(results[key][i], df[key], rtol=1.e-6), key
+
+
+def test_measured_intercept(tmp_path):
+    data = synthetic.synthetic_curves(1, r=r, T=T, q=q, g0=0.9, seed=0)
+    file_path = os.path.join(str(tmp_path), 'exported.csv')
+    synthetic.write_zetasizer_csv(file_path, data['time_lag'],
+                                  data['correlation'][0],
+                                  data['point_intensity'][0], g0=0.9)
+    data_dict = io.read_zetasizer_csv_to_dict(file_path, 0)
+    [t, g] = analysis_tools.truncate_correlation(data_dict['time_lag'],
+                                                 data_dict['correlation'])
+    # The exported intercept is used, with a single fit over the window
+    curve = diag.CurveDiagnostics()
+    [g0, twindow, pmin] = analysis_tools._search_g0(
+        t, g, data_dict['measured_intercept'], diagnostics=curve,
+        twindow=[2., 40.])
+    assert g0 == 0.9 and twindow == [2., 40.] and pmin[0] == g0
+    assert curve.counts['measured_g0_used'] == 1
+    assert curve.counts['cv_window_evaluations'] == 0
+    # A wrong intercept falls back to the cross validation search
+    curve = diag.CurveDiagnostics()
+    [g0, twindow, pmin] = analysis_tools._search_g0(t, g, 0.7,
+                                                    diagnostics=curve)
+    assert curve.counts['measured_g0_rejected'] == 1
+    assert curve.counts['measured_g0_used'] == 0
+    assert curve.counts['cv_window_evaluations'] > 0
+    assert abs(g0 - 0.9) < 0.01
+
+
+def test_fit_budget(monkeypatch):
+    [t, g, g0] = synthetic_stack(1)
+    for budget in [utils.FitBudget(maxfev=5), utils.FitBudget(timeout=0.)]:
+        with pytest.raises(utils.BudgetExceeded):
+            analysis_tools.calc_g1(t, g[0], True, budget=budget)
+
+    # A fit failure within the limits of the budget is not a budget overrun
+    def diverging(x, *p):
+        raise RuntimeError('the fit diverged')
+    monkeypatch.setattr(analysis_tools.fit_funcs, 'stretched_exp', diverging)
+    curve = diag.CurveDiagnostics()
+    with pytest.raises(RuntimeError):
+        analysis_tools.calc_g1(t, g[0], True, diagnostics=curve,
+                               budget=utils.FitBudget(maxfev=10**6,
+                                                      timeout=60.))
+    assert curve.counts['budget_exceeded'] == 0
+
+
+def test_event_logging(caplog, monkeypatch):
+    caplog.set_level(logging.DEBUG, logger='dlsmicro')
+    monkeypatch.setattr(diag, '_logged', dict((e, 0) for e in diag.events))
+    study = diag.StudyDiagnostics()
+    for i in range(5):
+        diag.event(study.new_curve('curve%d' % i), 'corr_above_g0', 2)
+    warnings = [r.getMessage() for r in caplog.records
+                if r.levelno == logging.WARNING]
+    assert warnings == ['curve%d: 2 correlation values above the intercept'
+                        % i for i in range(diag.max_repeats)] + \
+        ['Further messages for correlation values above the intercept '
+         'are suppressed in this study']
+    assert len(caplog.records) == 6
+    caplog.clear()
+    study.log_summary()
+    assert caplog.records[0].levelno == logging.WARNING
+    assert caplog.records[0].getMessage() == \
+        '5/5 curves had correlation values above the intercept'
+
+    # Curves outside of a study are throttled together
+    caplog.clear()
+    for i in range(5):
+        diag.event(None, 'negative_msd_replaced')
+    levels = [r.levelno for r in caplog.records]
+    assert levels.count(logging.WARNING) == diag.max_repeats + 1
+    assert levels.count(logging.DEBUG) == 5 - diag.max_repeats
+
+
+def test_non_ergodic_needs_position_scan(tmp_path):
+    data = synthetic.synthetic_curves(1, r=r, T=T, q=q, ergodic=False,
+                                      seed=0)
+    file_path = os.path.join(str(tmp_path), 'exported.csv')
+    synthetic.write_zetasizer_csv(file_path, data['time_lag'],
+                                  data['correlation'][0],
+                                  data['point_intensity'][0],
+                                  data['ensemble_intensities'][0],
+                                  data['ensemble_positions'])
+    data_dict = io.read_zetasizer_csv_to_dict(file_path, 0)
+    df = pipeline.analyze_data_dict(data_dict, False, r, T, q=q)[2]
+    assert np.all(np.isfinite(df['G1']))
+    data_dict['ensemble_intensities'] = None
+    with pytest.raises(ValueError):
+        pipeline.analyze_data_dict(data_dict, False, r, T, q=q)
+    # Ergodic samples do not need the position scan
+    pipeline.analyze_data_dict(data_dict, True, r, T, q=q)
+
+
+def test_follow_time_points(tmp_path):
+    data = synthetic.synthetic_curves(4, r=r, T=T, seed=0)
+    # The position scan starts at the position of the time points
+    export = os.path.join(str(tmp_path), 'export.csv')
+    synthetic.write_zetasizer_csv(export, data['time_lag'],
+                                  data['correlation'],
+                                  data['point_intensity'],
+                                  data['ensemble_intensities'][0],
+                                  np.arange(3., 5., 0.1), point_position=3.)
+    with open(export) as f:
+        lines = f.readlines()
+
+    # The instrument appends the time points, then the position scan
+    file_path = os.path.join(str(tmp_path), 'growing.csv')
+    with open(file_path, 'w') as f:
+        f.writelines(lines[:3])
+    following = follow_time_points(file_path, T, r, True,
+                                   poll_interval=0.01, timeout=10.)
+    time_points = [next(following), next(following)]
+    with open(file_path, 'a') as f:
+        f.writelines(lines[3:])
+    t0 = time.time()
+    time_points += list(following)
+    assert time.time() - t0 < 10.
+    assert [tp for tp, df in time_points] == [1, 2, 3]
+
+    # The same results as the analysis of the complete file
+    analyze_time_points(export, T, r, True, 4, 20, save_as_txt=False)
+    df = pd.read_pickle(os.path.join(str(tmp_path), 'time_course.pkl'))
+    for tp, df_tp in time_points:
+        assert np.allclose(df[df['time_point'] == tp]['G1'], df_tp['G1'])
+
+
+def msd_data():
+    """ Logarithms of the time-lags and of the MSD of a synthetic curve,
+    and its intermediate scattering function """
+    [t, g, g0] = synthetic_stack(1)
+    g1 = analysis_tools.calc_g1(t, g[0], True, g0=g0).copy()
+    msd = analysis_tools.calc_msd_raw(t, g1, q)
+    return [t, g1, np.log(t), np.log(msd)]
+
+
+def test_loess_gcv():
+    [t, g1, x, y] = msd_data()
+    alphas = [0.003, 0.03, 0.3]
+    gcv = utils.loess_gcv(x, y, alphas)[1]
+    n = len(x)
+    for k, bw in enumerate(alphas):
+        H = utils.LoessOperatorCache().get(x, 1, bw)[1]
+        rss = np.sum(np.square(y - H.dot(y)))
+        assert np.isclose(gcv[k], n*rss/(n - np.trace(H))**2., rtol=1.e-9)
+
+
+def test_loess_sweep():
+    [t, g1, x, y] = msd_data()
+    alphas = [0.003, 0.03, 0.3]
+    [Theta, Yp] = utils.loess_sweep(x, y, alphas)
+    [msd_smooth, alpha] = analysis_tools.msd_bandwidth_sweep(t, g1, q, alphas)
+    for k, bw in enumerate(alphas):
+        [Theta_k, yp] = utils.loess(x, y, 1, bw)
+        assert np.allclose(Theta[k], Theta_k, rtol=1.e-9, atol=1.e-9)
+        assert np.allclose(Yp[k], yp, rtol=1.e-9, atol=1.e-9)
+        [msd_k, alpha_k] = analysis_tools.msd_local_pwr_law(t, g1, q, bw=bw)
+        assert np.allclose(msd_smooth[k], msd_k, rtol=1.e-9)
+        assert np.allclose(alpha[k], alpha_k, rtol=1.e-9, atol=1.e-9)
+
+
+def test_dlsur_kernel():
+    [t, g1, x, y] = msd_data()
+    block = analysis_tools.dlsur_kernel(t, g1, q, r, T, raw_msd=True)[0]
+    [msd_smooth, alpha] = analysis_tools.msd_local_pwr_law(t, g1, q)
+    [omega, G1, G2] = analysis_tools.shear_modulus(t, msd_smooth, alpha, r,
+                                                   T)
+    for row, unfused in zip(block, [t, msd_smooth, alpha, omega, G1, G2,
+                                    np.exp(y)]):
+        assert np.allclose(row, unfused, rtol=1.e-12)
+
+
+def test_dlsur_kernel_omega():
+    [t, g1, x, y] = msd_data()
+    [msd_smooth, alpha] = analysis_tools.msd_local_pwr_law(t, g1, q)
+    [omega, G1, G2] = analysis_tools.shear_modulus(t, msd_smooth, alpha, r,
+                                                   T)
+    # Frequencies of some of the time-lags, between time-lags, and out of
+    # their range
+    i = np.arange(8, len(t)-1, 7)
+    mid = np.sqrt(omega[i]*omega[i+1])
+    omega_q = np.concatenate([[1.e-3], omega[i], mid, [1.e9]])
+    block = analysis_tools.dlsur_kernel(t, g1, q, r, T, omega=omega_q)[0]
+    t_eval = 1.e6/omega_q
+    [msd_q, alpha_q] = analysis_tools.msd_local_pwr_law(t, g1, q,
+                                                        t_eval=t_eval)
+    [omega_out, G1_q, G2_q] = analysis_tools.shear_modulus(t_eval, msd_q,
+                                                           alpha_q, r, T)
+    for row, unfused in zip(block, [t_eval, msd_q, alpha_q, omega_q, G1_q,
+                                    G2_q]):
+        assert np.allclose(row, unfused, rtol=1.e-12, equal_nan=True)
+    assert np.allclose(block[3], omega_out)
+    n = len(i)
+    [at_lags, between] = [block[:, 1:n+1], block[:, n+1:2*n+1]]
+    for row, unfused in zip(at_lags[1:], [msd_smooth, alpha, omega, G1, G2]):
+        assert np.allclose(row, unfused[i], rtol=1.e-9)
+    assert np.all((between[1] > msd_smooth[i]) &
+                  (between[1] < msd_smooth[i+1]))
+    # The local power law is not extrapolated
+    outside = block[:, [0, -1]]
+    assert np.all(np.isfinite(outside[[0, 3]]))
+    assert np.all(np.isnan(outside[[1, 2, 4, 5]]))
+
+
+def test_log_bin_correlation():
+    t = synthetic.multi_tau_lags()
+    rng = np.random.RandomState(0)
+    corr = 0.9*np.exp(-t/300.) + 1.e-2*rng.randn(len(t))
+    [t_bin, corr_bin, var, counts] = analysis_tools.log_bin_correlation(t,
+                                                                        corr)
+    # Empty bins are dropped, and every channel is counted once
+    assert len(t_bin) < 100 and np.all(counts > 0)
+    assert counts.sum() == len(t)
+    # The channels of a multi-tau correlator sparser than the bins pass
+    # through unchanged
+    k = np.argmax(counts > 1)
+    assert k > 0
+    assert np.array_equal(t_bin[:k], t[:k])
+    assert np.array_equal(corr_bin[:k], corr[:k])
+    assert np.all(np.isnan(var[:k]))
+    # The bins hold consecutive channels
+    ends = np.cumsum(counts).astype(int)
+    for b in range(k, len(t_bin)):
+        inds = slice(ends[b] - int(counts[b]), ends[b])
+        assert np.isclose(t_bin[b], np.mean(t[inds]))
+        assert np.isclose(corr_bin[b], np.mean(corr[inds]))
+        if counts[b] > 1:
+            assert np.isclose(var[b], np.var(corr[inds], ddof=1)/counts[b])
+
+    # Weighted means, with the weights added up in each bin
+    weights = rng.randint(1, 10, len(t)).astype(float)
+    [t_w, corr_w, var_w, counts_w] = analysis_tools.log_bin_correlation(
+        t, corr, counts=weights, corr_var=np.full(len(t), 1.e-4))
+    assert np.isclose(counts_w.sum(), weights.sum())
+    for b in range(len(t_bin)):
+        inds = slice(ends[b] - int(counts[b]), ends[b])
+        assert np.isclose(counts_w[b], weights[inds].sum())
+        assert np.isclose(corr_w[b], np.average(corr[inds],
+                                                weights=weights[inds]))
+        assert np.isclose(var_w[b], 1.e-4*np.sum(weights[inds]**2.) /
+                          weights[inds].sum()**2.)
+
+
+def test_golden_window_search():
+    # The cross-validation score is not always unimodal in the end of the
+    # window, but the intercepts agree with those of the grid search
+    for [t, g] in example_curves():
+        fits = {}
+        for method in ['grid', 'golden']:
+            curve = diag.CurveDiagnostics()
+            fits[method] = analysis_tools._find_g0_default(t, g, curve,
+                                                           method=method)
+            fits[method].append(curve.counts['cv_window_evaluations'])
+        assert abs(fits['golden'][0]/fits['grid'][0] - 1.) < 3.e-3
+        assert fits['golden'][3] < fits['grid'][3]
+        [tmin, tmax] = utils.nearest_index(t, fits['golden'][1])
+        assert t[tmin] == 2. and 40. <= t[tmax] <= 120.
+
+
+def test_kfold_window_search():
+    for [t, g] in example_curves():
+        fits = {}
+        for [cv, k] in [['loo', 10], ['kfold', 5], ['subsample', 20]]:
+            curve = diag.CurveDiagnostics()
+            fits[cv] = analysis_tools._find_g0_default(
+                t, g, curve, cv_kws={'cv': cv, 'k': k})
+            fits[cv].append(curve.counts['curve_fit_calls'])
+        assert fits['kfold'][1] == fits['loo'][1]
+        assert abs(fits['kfold'][0]/fits['loo'][0] - 1.) < 2.e-3
+        assert 4*fits['kfold'][3] < fits['loo'][3]
+        assert abs(fits['subsample'][0]/fits['loo'][0] - 1.) < 7.e-3
+
+
+def test_synthetic_round_trip():
+    for ergodic in [True, False]:
+        data = synthetic.synthetic_curves(3, model='maxwell', r=r, T=T, q=q,
+                                          ergodic=ergodic, seed=0,
+                                          params={'G': [0.5, 1., 2.]})
+        g1_exact = np.exp(-data['msd']*q**2./6.)
+        for i in range(3):
+            g1 = analysis_tools.calc_g1(data['time_lag'],
+                                        data['correlation_exact'][i],
+                                        ergodic, g0=0.9,
+                                        Ip=data['point_intensity'][i],
+                                        Ie=data['ensemble_intensities'][i])
+            # g2 = 1 + g0*g1**2 cannot resolve g1 below about 1e-8
+            assert np.allclose(g1, g1_exact[i], rtol=1.e-9, atol=1.e-8)